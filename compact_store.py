@@ -0,0 +1,364 @@
+from __future__ import annotations
+
+import heapq
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from rdflib import plugin
+from rdflib.store import Store
+from rdflib.term import Node, URIRef
+
+
+# Read-mostly triple store with integer-encoded, sorted indexes.
+#
+# rdflib's Memory store keeps every triple as a tuple of term objects in
+# several nested dicts/sets, which costs hundreds of bytes per triple. Here
+# each distinct term is interned once into ``terms``/``ids`` and the triples
+# live in three sorted permutation indexes (SPO, POS, OSP). Each index is a
+# pair of flat arrays:
+#
+#   ab  array('Q')  first two ids packed as (a << 32) | b, ascending
+#   c   array('I')  third id, ascending within equal ``ab``
+#
+# so a triple costs 3 * 12 bytes of index plus its share of the term table,
+# and every pattern is one or two bisects over a contiguous range:
+#
+#   (s p o) (s p ?) (s ? ?) (? ? ?)   SPO
+#   (? p o) (? p ?)                   POS
+#   (? ? o) (s ? o)                   OSP
+#
+# Writes don't touch those arrays. Adds of triples not in the base indexes
+# and removes of triples that are go to a delta: small sorted lists of packed
+# keys, one per index order, which every lookup bisects alongside the base
+# (removed keys are filtered out of base ranges). Once the delta passes
+# MERGE_THRESHOLD keys (or a sixteenth of the base) it is folded into fresh
+# arrays with one linear merge per index. A single-triple update therefore
+# costs a bisect and a short list copy, not a rebuild, and bulk loads
+# through addN are sorted once. Usable wherever a Graph store is:
+#
+#   g = Graph(store="Compact")      (after importing this module)
+#   g = Graph(store=CompactStore())
+
+_SHIFT = 32
+_LOW = (1 << _SHIFT) - 1
+MERGE_THRESHOLD = 4096
+
+TripleIds = Tuple[int, int, int]
+
+# Index orders (SPO, POS, OSP) as triple positions, and the inverse: where
+# s, p and o sit in a key of that order.
+_ORDERS = ((0, 1, 2), (1, 2, 0), (2, 0, 1))
+_INVERSE = ((0, 1, 2), (2, 0, 1), (1, 2, 0))
+
+
+class _Index:
+    __slots__ = ("ab", "c")
+
+    def __init__(self, keys: Iterable[int]) -> None:
+        # keys are (a << 64) | (b << 32) | c, already sorted and unique.
+        self.ab = array("Q")
+        self.c = array("I")
+        ab_append, c_append = self.ab.append, self.c.append
+        for key in keys:
+            ab_append(key >> _SHIFT)
+            c_append(key & _LOW)
+
+    def __len__(self) -> int:
+        return len(self.c)
+
+    def keys(self, lo: int = 0, hi: Optional[int] = None) -> Iterator[int]:
+        for ab, c in zip(self.ab[lo:hi], self.c[lo:hi]):
+            yield (ab << _SHIFT) | c
+
+    def range_a(self, a: int) -> Tuple[int, int]:
+        ab = self.ab
+        return bisect_left(ab, a << _SHIFT), bisect_left(ab, (a + 1) << _SHIFT)
+
+    def range_ab(self, a: int, b: int) -> Tuple[int, int]:
+        key = (a << _SHIFT) | b
+        ab = self.ab
+        return bisect_left(ab, key), bisect_right(ab, key)
+
+    def find(self, a: int, b: int, c: int) -> bool:
+        lo, hi = self.range_ab(a, b)
+        i = bisect_left(self.c, c, lo, hi)
+        return i < hi and self.c[i] == c
+
+
+def _pack(t: TripleIds, order: Tuple[int, int, int]) -> int:
+    x, y, z = order
+    return (t[x] << 64) | (t[y] << 32) | t[z]
+
+
+def _unpack(key: int, order: int) -> TripleIds:
+    parts = (key >> 64, (key >> 32) & _LOW, key & _LOW)
+    i, j, k = _INVERSE[order]
+    return parts[i], parts[j], parts[k]
+
+
+def _fold(index: _Index, adds: List[int], dels: List[int]) -> _Index:
+    """``index`` minus ``dels`` plus ``adds`` (all in the index's order), by one linear merge."""
+    base = index.keys()
+    if dels:
+        doomed = set(dels)
+        base = (key for key in base if key not in doomed)
+    return _Index(heapq.merge(base, adds))
+
+
+class _State:
+    """Base indexes plus delta, replaced as a whole on every write (readers never see it change)."""
+    __slots__ = ("indexes", "adds", "dels", "removed")
+
+    def __init__(self, indexes, adds, dels, removed) -> None:
+        self.indexes: Tuple[_Index, _Index, _Index] = indexes
+        # Sorted packed keys per order: triples added that the base lacks,
+        # and triples of the base removed since it was built.
+        self.adds: Tuple[List[int], List[int], List[int]] = adds
+        self.dels: Tuple[List[int], List[int], List[int]] = dels
+        self.removed: frozenset = removed  # dels as TripleIds, for filtering base ranges
+
+    @property
+    def delta(self) -> int:
+        return len(self.adds[0]) + len(self.dels[0])
+
+    def base_has(self, t: TripleIds) -> bool:
+        return self.indexes[0].find(*t)
+
+    def has(self, t: TripleIds) -> bool:
+        if t in self.removed:
+            return False
+        if self.base_has(t):
+            return True
+        adds = self.adds[0]
+        key = _pack(t, _ORDERS[0])
+        i = bisect_left(adds, key)
+        return i < len(adds) and adds[i] == key
+
+
+_EMPTY = _Index(())
+
+
+def _empty_state() -> _State:
+    return _State((_EMPTY, _EMPTY, _EMPTY), ([], [], []), ([], [], []), frozenset())
+
+
+def _with_keys(lists, triples: Sequence[TripleIds], insert: bool):
+    """Copies of the three per-order lists with ``triples`` inserted or deleted."""
+    out = []
+    for order, keys in zip(_ORDERS, lists):
+        keys = list(keys)
+        if insert and len(triples) > 8:
+            keys = sorted(set(keys).union(_pack(t, order) for t in triples))
+        else:
+            for t in triples:
+                key = _pack(t, order)
+                i = bisect_left(keys, key)
+                present = i < len(keys) and keys[i] == key
+                if insert and not present:
+                    keys.insert(i, key)
+                elif not insert and present:
+                    del keys[i]
+        out.append(keys)
+    return tuple(out)
+
+
+class CompactStore(Store):
+    """Single-graph store keeping SPO/POS/OSP as sorted integer arrays."""
+
+    context_aware = False
+    formula_aware = False
+    transaction_aware = False
+    graph_aware = False
+
+    def __init__(self, configuration=None, identifier=None) -> None:
+        super().__init__(configuration)
+        self.identifier = identifier
+        self.terms: List[Node] = []
+        self.ids: Dict[Node, int] = {}
+        self._state = _empty_state()
+        # addN appends here; the keys are sorted into the delta on the next read.
+        self._staged: List[TripleIds] = []
+        self._lock = threading.RLock()
+        self.merges = 0
+        self.__namespace: Dict[str, URIRef] = {}
+        self.__prefix: Dict[URIRef, str] = {}
+
+    # --- interning ---
+
+    def _intern(self, term: Node) -> int:
+        tid = self.ids.get(term)
+        if tid is None:
+            tid = self.ids[term] = len(self.terms)
+            self.terms.append(term)
+        return tid
+
+    def _lookup(self, term: Optional[Node]) -> Optional[int]:
+        return None if term is None else self.ids.get(term, -1)
+
+    # --- writes ---
+
+    def add(self, triple, context=None, quoted: bool = False) -> None:
+        s, p, o = triple
+        with self._lock:
+            key = (self._intern(s), self._intern(p), self._intern(o))
+            self._apply([key], [])
+        Store.add(self, triple, context, quoted)
+
+    def addN(self, quads) -> None:
+        intern = self._intern
+        with self._lock:
+            self._staged.extend((intern(s), intern(p), intern(o)) for s, p, o, _ in quads)
+
+    def remove(self, triple_pattern, context=None) -> None:
+        with self._lock:
+            doomed = list(self._match_ids(triple_pattern))
+            self._apply([], doomed)
+        for s, p, o in doomed:
+            Store.remove(self, (self.terms[s], self.terms[p], self.terms[o]), context)
+
+    def _apply(self, added: Sequence[TripleIds], removed: Sequence[TripleIds]) -> None:
+        """Record adds and removes in the delta (under the lock); fold it if it grew too big."""
+        state = self._settle()
+        revive = [t for t in added if t in state.removed]
+        fresh = sorted({t for t in added if t not in state.removed and not state.base_has(t)})
+        unadd = [t for t in removed if not state.base_has(t)]
+        kill = [t for t in removed if state.base_has(t) and t not in state.removed]
+        if not (revive or fresh or unadd or kill):
+            return
+        adds, dels, gone = state.adds, state.dels, state.removed
+        if fresh or unadd:
+            adds = _with_keys(_with_keys(adds, fresh, True) if fresh else adds, unadd, False)
+        if revive or kill:
+            dels = _with_keys(_with_keys(dels, kill, True) if kill else dels, revive, False)
+            gone = (gone - frozenset(revive)) | frozenset(kill)
+        state = _State(state.indexes, adds, dels, gone)
+        if state.delta > max(MERGE_THRESHOLD, len(state.indexes[0]) // 16):
+            state = _State(tuple(_fold(ix, a, d) for ix, a, d in zip(state.indexes, adds, dels)),
+                           ([], [], []), ([], [], []), frozenset())
+            self.merges += 1
+        self._state = state
+
+    def _settle(self) -> _State:
+        """The current state, with keys staged by addN moved into the delta first."""
+        if not self._staged:
+            return self._state
+        with self._lock:
+            if self._staged:
+                staged, self._staged = self._staged, []
+                self._apply(staged, [])
+            return self._state
+
+    def copy(self) -> "CompactStore":
+        """An independent store with the same contents.
+
+        States are never modified in place (every write builds a new one),
+        so the copy shares the current one and only duplicates the term table.
+        """
+        with self._lock:
+            other = CompactStore(identifier=self.identifier)
+            other.terms = list(self.terms)
+            other.ids = dict(self.ids)
+            other._state = self._settle()
+            for prefix, namespace in self.namespaces():
+                other.bind(prefix, namespace)
+            return other
+
+    # --- reads ---
+
+    def _match_ids(self, triple_pattern) -> Iterator[TripleIds]:
+        s, p, o = triple_pattern
+        si, pi, oi = self._lookup(s), self._lookup(p), self._lookup(o)
+        if -1 in (si, pi, oi):
+            return  # a bound term the store has never seen
+        state = self._settle()
+
+        if si is not None and pi is not None and oi is not None:
+            if state.has((si, pi, oi)):
+                yield si, pi, oi
+            return
+        # Pick the index whose leading positions are the bound ones.
+        if si is not None:
+            order, bound = (2, (oi, si)) if oi is not None else (0, (si,) if pi is None else (si, pi))
+        elif pi is not None:
+            order, bound = 1, (pi,) if oi is None else (pi, oi)
+        elif oi is not None:
+            order, bound = 2, (oi,)
+        else:
+            order, bound = 0, ()
+
+        index = state.indexes[order]
+        if len(bound) == 2:
+            lo, hi = index.range_ab(*bound)
+            key_lo = (bound[0] << 64) | (bound[1] << 32)
+            key_hi = key_lo + (1 << 32)
+        elif len(bound) == 1:
+            lo, hi = index.range_a(bound[0])
+            key_lo = bound[0] << 64
+            key_hi = key_lo + (1 << 64)
+        else:
+            lo, hi = 0, len(index)
+            key_lo, key_hi = 0, 1 << 96
+        adds = state.adds[order]
+        extra = adds[bisect_left(adds, key_lo):bisect_left(adds, key_hi)]
+
+        removed = state.removed
+        for key in index.keys(lo, hi):
+            t = _unpack(key, order)
+            if not removed or t not in removed:
+                yield t
+        for key in extra:
+            yield _unpack(key, order)
+
+    def triples(self, triple_pattern, context=None):
+        terms = self.terms
+        for s, p, o in self._match_ids(triple_pattern):
+            yield (terms[s], terms[p], terms[o]), iter(())
+
+    def __len__(self, context=None) -> int:
+        state = self._settle()
+        return len(state.indexes[0]) + len(state.adds[0]) - len(state.dels[0])
+
+    def contexts(self, triple=None):
+        return iter(())
+
+    # --- namespaces (same semantics as the Memory store) ---
+
+    def bind(self, prefix: str, namespace: URIRef, override: bool = True) -> None:
+        bound_namespace = self.__namespace.get(prefix)
+        bound_prefix = self.__prefix.get(namespace)
+        if bound_prefix is None and bound_namespace is not None:
+            bound_prefix = self.__prefix.get(bound_namespace)
+        if override:
+            if bound_prefix is not None:
+                del self.__namespace[bound_prefix]
+            if bound_namespace is not None:
+                del self.__prefix[bound_namespace]
+            self.__prefix[namespace] = prefix
+            self.__namespace[prefix] = namespace
+        else:
+            namespace = namespace if bound_namespace is None else bound_namespace
+            prefix = prefix if bound_prefix is None else bound_prefix
+            self.__prefix[namespace] = prefix
+            self.__namespace[prefix] = namespace
+
+    def namespace(self, prefix: str) -> Optional[URIRef]:
+        return self.__namespace.get(prefix)
+
+    def prefix(self, namespace: URIRef) -> Optional[str]:
+        return self.__prefix.get(namespace)
+
+    def namespaces(self):
+        for prefix, namespace in list(self.__namespace.items()):
+            yield prefix, namespace
+
+    def stats(self) -> dict:
+        state = self._settle()
+        index_bytes = sum(ix.ab.itemsize * len(ix.ab) + ix.c.itemsize * len(ix.c)
+                          for ix in state.indexes)
+        return {"triples": self.__len__(), "terms": len(self.terms), "index_bytes": index_bytes,
+                "delta": state.delta, "merges": self.merges}
+
+
+plugin.register("Compact", Store, __name__, "CompactStore")
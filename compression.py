@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import hashlib
+import zlib
+from typing import Dict, Optional, Tuple
+
+try:
+    import brotli  # optional: pip install brotli
+except ImportError:
+    brotli = None
+
+# Content-Encoding negotiation for the HTTP server.
+#
+# Responses are compressed with br (when the brotli package is installed) or
+# gzip, whichever the client's Accept-Encoding prefers. Streamed /sparql
+# results go through a StreamCompressor chunk by chunk; fixed bodies such as
+# the UI page are compressed once into a PrecompressedBody and served from
+# memory. Bodies under MIN_SIZE bytes go out as they are: the gzip
+# header and trailer would cost about as much as they save.
+
+MIN_SIZE = 512
+# Fast levels for per-request work; fixed bodies are compressed once, at the best level.
+STREAM_LEVELS = {"gzip": 6, "br": 4}
+BEST_LEVELS = {"gzip": 9, "br": 11}
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/sparql-results+json",
+                      "application/javascript", "application/xml", "application/sparql-results+xml")
+
+
+def supported() -> Tuple[str, ...]:
+    """Encodings this process can produce, preferred first."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compressible(content_type: str) -> bool:
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def parse_qvalues(header: Optional[str]) -> Dict[str, float]:
+    """{token: q} for an Accept or Accept-Encoding header (parameters other than q are dropped)."""
+    weights: Dict[str, float] = {}
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            weights[name] = max(q, weights.get(name, 0.0))
+    return weights
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """The encoding to use for a request's Accept-Encoding header, or None for identity."""
+    if not accept_encoding:
+        return None
+    weights = parse_qvalues(accept_encoding)
+    best, best_q = None, 0.0
+    for encoding in supported():
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    if level is None:
+        level = STREAM_LEVELS[encoding]
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    return c.compress(data) + c.flush()
+
+
+class StreamCompressor:
+    """Incremental compressor for one response body."""
+
+    def __init__(self, encoding: str) -> None:
+        self.encoding = encoding
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=STREAM_LEVELS["br"])
+        else:
+            self._c = zlib.compressobj(STREAM_LEVELS["gzip"], zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._c.process(data)
+        return self._c.compress(data)
+
+    def flush(self) -> bytes:
+        """Everything compressed so far, decodable by the client; the stream stays open."""
+        if self.encoding == "br":
+            return self._c.flush()
+        return self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._c.finish()
+        return self._c.flush()
+
+
+class PrecompressedBody:
+    """A fixed response body with every supported encoding computed up front."""
+
+    def __init__(self, body: bytes, content_type: str) -> None:
+        self.content_type = content_type
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:20] + '"'
+        self.variants: Dict[Optional[str], bytes] = {None: body}
+        if len(body) >= MIN_SIZE and compressible(content_type):
+            for encoding in supported():
+                self.variants[encoding] = compress(body, encoding, BEST_LEVELS[encoding])
+
+    def select(self, accept_encoding: Optional[str]) -> Tuple[Optional[str], bytes]:
+        """(encoding, bytes) to send for a request's Accept-Encoding."""
+        encoding = negotiate(accept_encoding)
+        if encoding not in self.variants:
+            encoding = None
+        return encoding, self.variants[encoding]
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        # Each encoding is a different representation and needs its own strong tag.
+        return self.etag if encoding is None else self.etag[:-1] + "-" + encoding + '"'
+
+    def stats(self) -> dict:
+        return {(encoding or "identity"): len(body) for encoding, body in self.variants.items()}
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import re
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from rdflib import OWL, RDF, RDFS, Graph, URIRef
+
+from movie_view import DBPEDIA_RESOURCE, MC, MovieView, strip_dbpedia
+
+# Pre-joined cross-dataset country lookups.
+#
+# The Factbook data links its country resources to DBpedia ones with
+# owl:sameAs, and the "Find country facts" query re-joins
+# mc:producedInCountry -> owl:sameAs -> five Factbook properties on every
+# call. SameAsIndex turns the sameAs links into equivalence classes (in both
+# directions, transitively), and CountryIndex keeps one record per Factbook
+# country keyed by every IRI in its class, so a movie's country resolves to
+# its facts with a dict lookup.
+
+GDP_COMMENT = re.compile(r"^\s*GDP:\s*([0-9][0-9.,]*)\s*$")
+
+
+class SameAsIndex:
+    """owl:sameAs equivalence classes: every member maps to the same frozenset."""
+
+    def __init__(self) -> None:
+        self.classes: Dict[str, frozenset] = {}
+        self.links = 0
+
+    @classmethod
+    def build(cls, graph: Graph) -> "SameAsIndex":
+        return cls.from_links(graph.subject_objects(OWL.sameAs))
+
+    @classmethod
+    def from_links(cls, links: Iterable[Tuple[object, object]]) -> "SameAsIndex":
+        index = cls()
+        parent: Dict[str, str] = {}
+
+        def find(x: str) -> str:
+            parent.setdefault(x, x)
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        for a, b in links:
+            index.links += 1
+            ra, rb = find(str(a)), find(str(b))
+            if ra != rb:
+                parent[rb] = ra
+
+        members: Dict[str, Set[str]] = defaultdict(set)
+        for x in parent:
+            members[find(x)].add(x)
+        for group in members.values():
+            frozen = frozenset(group)
+            for x in group:
+                index.classes[x] = frozen
+        return index
+
+    def equivalents(self, iri: str) -> frozenset:
+        """Every IRI known to denote the same thing as ``iri`` (including itself)."""
+        return self.classes.get(iri) or frozenset((iri,))
+
+    def same(self, a: str, b: str) -> bool:
+        return a == b or b in self.classes.get(a, ())
+
+
+class CountryRecord:
+    __slots__ = ("iri", "aliases", "name", "capital", "population", "area_km2",
+                 "description", "gdp", "movies")
+
+    def __init__(self, iri: str) -> None:
+        self.iri = iri
+        self.aliases: Tuple[str, ...] = ()
+        self.name: Optional[str] = None
+        self.capital: Optional[str] = None
+        self.population: Optional[int] = None
+        self.area_km2: Optional[float] = None
+        self.description: Optional[str] = None
+        self.gdp: Optional[int] = None
+        self.movies = 0
+
+    @property
+    def dbpedia(self) -> Optional[str]:
+        for alias in self.aliases:
+            if alias != strip_dbpedia(alias):
+                return alias
+        return None
+
+    def to_json(self) -> dict:
+        return {
+            "country": self.iri,
+            "sameAs": list(self.aliases),
+            "dbpedia": self.dbpedia,
+            "name": self.name,
+            "capital": self.capital,
+            "population": self.population,
+            "areaKm2": self.area_km2,
+            "gdp": self.gdp,
+            "description": self.description,
+            "movies": self.movies,
+        }
+
+
+def parse_gdp(comments: Iterable[str]) -> Optional[int]:
+    """The number out of a ``"GDP: 132400000000"`` comment, if there is one."""
+    for comment in comments:
+        m = GDP_COMMENT.match(comment)
+        if m:
+            try:
+                return int(float(m.group(1).replace(",", "")))
+            except ValueError:
+                continue
+    return None
+
+
+class CountryIndex:
+    def __init__(self) -> None:
+        self.same_as = SameAsIndex()
+        self.records: List[CountryRecord] = []
+        self.by_iri: Dict[str, CountryRecord] = {}
+        self.by_name: Dict[str, CountryRecord] = {}
+        self.build_seconds = 0.0
+
+    @classmethod
+    def build(cls, graph: Graph, view: Optional[MovieView] = None) -> "CountryIndex":
+        """Index every mc:Country carrying Factbook facts; ``view`` adds movie counts."""
+        start = time.perf_counter()
+        index = cls()
+        index.same_as = SameAsIndex.build(graph)
+
+        def first(s, p):
+            for o in graph.objects(s, p):
+                return o
+            return None
+
+        for country in sorted({str(c) for c in graph.subjects(RDF.type, MC.Country)}):
+            rec = CountryRecord(country)
+            subject = URIRef(country)
+            facts = {p: first(subject, p) for p in (MC.countryName, MC.capital, MC.population,
+                                                    MC.areaKm2, MC.description)}
+            if all(v is None for v in facts.values()):
+                continue  # a DBpedia country IRI typed mc:Country, not a Factbook record
+            rec.name = _text(facts[MC.countryName])
+            rec.capital = _text(facts[MC.capital])
+            rec.population = _number(facts[MC.population], int)
+            rec.area_km2 = _number(facts[MC.areaKm2], float)
+            rec.description = _text(facts[MC.description])
+            rec.gdp = parse_gdp(str(c) for c in graph.objects(subject, RDFS.comment))
+            rec.aliases = tuple(sorted(index.same_as.equivalents(country) - {country}))
+            index.records.append(rec)
+            for iri in (country, *rec.aliases):
+                index.by_iri[iri] = rec
+                index.by_name.setdefault(strip_dbpedia(iri).rsplit("#", 1)[-1].lower(), rec)
+            if rec.name:
+                index.by_name.setdefault(rec.name.lower(), rec)
+
+        if view is not None:
+            for movie in view.records:
+                for name in movie.countries:
+                    rec = index.get(name)
+                    if rec is not None:
+                        rec.movies += 1
+
+        index.build_seconds = time.perf_counter() - start
+        return index
+
+    def get(self, key: str) -> Optional[CountryRecord]:
+        """Look a country up by any IRI in its sameAs class, its local name or its name."""
+        rec = self.by_iri.get(key)
+        if rec is None:
+            rec = self.by_iri.get(DBPEDIA_RESOURCE + key) or self.by_name.get(key.lower())
+        return rec
+
+    def for_movie(self, movie) -> List[CountryRecord]:
+        """Factbook records for a MovieRecord's countries (those that have one)."""
+        found = []
+        for name in movie.countries:
+            rec = self.get(name)
+            if rec is not None and rec not in found:
+                found.append(rec)
+        return found
+
+    def stats(self) -> dict:
+        return {
+            "countries": len(self.records),
+            "same_as_links": self.same_as.links,
+            "same_as_classes": len(set(self.same_as.classes.values())),
+            "build_ms": round(self.build_seconds * 1000.0, 1),
+        }
+
+
+def _text(term) -> Optional[str]:
+    return None if term is None else str(term)
+
+
+def _number(term, kind):
+    if term is None:
+        return None
+    try:
+        return kind(float(str(term)))
+    except ValueError:
+        return None
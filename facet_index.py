@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import time
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+from movie_view import MovieRecord, MovieView
+
+# Faceted drill-down over the movie view.
+#
+# Counting movies per country, director, actor, release year or runtime range
+# in SPARQL means a COUNT(DISTINCT ...) over the whole graph for every click.
+# FacetIndex numbers the MovieView records 0..n-1 and keeps, for every value
+# of every facet, the set of movies having it as a bitset -- a Python int
+# whose bit i is movie i. A drill-down is then a handful of big-int ANDs and
+# ORs plus int.bit_count(), each a C loop over n/64 machine words.
+#
+# Selections OR within a facet and AND across facets. The counts reported for
+# a facet ignore that facet's own selection (the usual "disjunctive" facets),
+# so picking a country still shows how many movies every other country has
+# under the remaining filters.
+#
+# The index is built from a MovieView and holds on to its records, and both
+# are rebuilt and published together when the graph changes.
+
+RUNTIME_BUCKETS = (60, 90, 120, 150, 180)
+
+
+def runtime_bucket(minutes: Optional[int]) -> Optional[str]:
+    """The runtime range label for ``minutes``: "<60", "60-89", ... "180+"."""
+    if minutes is None:
+        return None
+    if minutes < RUNTIME_BUCKETS[0]:
+        return f"<{RUNTIME_BUCKETS[0]}"
+    for low, high in zip(RUNTIME_BUCKETS, RUNTIME_BUCKETS[1:]):
+        if minutes < high:
+            return f"{low}-{high - 1}"
+    return f"{RUNTIME_BUCKETS[-1]}+"
+
+
+# facet name -> values of a record
+FACETS = {
+    "country": lambda rec: rec.countries,
+    "director": lambda rec: rec.directors,
+    "actor": lambda rec: rec.actors,
+    "year": lambda rec: () if rec.year is None else (str(rec.year),),
+    "runtime": lambda rec: () if rec.runtime is None else (runtime_bucket(rec.runtime),),
+}
+
+
+def iter_bits(bits: int) -> Iterator[int]:
+    """Positions of the set bits of ``bits``, lowest first."""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class FacetIndex:
+    def __init__(self) -> None:
+        self.records: List[MovieRecord] = []
+        self.all = 0
+        self.bitsets: Dict[str, Dict[str, int]] = {name: {} for name in FACETS}
+        # lower-cased value -> value, so selections needn't match case
+        self.folded: Dict[str, Dict[str, str]] = {name: {} for name in FACETS}
+        self.build_seconds = 0.0
+
+    @classmethod
+    def build(cls, view: MovieView) -> "FacetIndex":
+        start = time.perf_counter()
+        index = cls()
+        index.records = view.records
+        # Collect positions first; one int per value is then built in one go
+        # rather than re-allocated for every movie it gains.
+        positions: Dict[str, Dict[str, List[int]]] = {name: {} for name in FACETS}
+        for i, rec in enumerate(view.records):
+            for name, values_of in FACETS.items():
+                for value in values_of(rec):
+                    positions[name].setdefault(value, []).append(i)
+        size = (len(view.records) + 7) // 8
+        for name, values in positions.items():
+            bitsets = index.bitsets[name]
+            for value, ids in values.items():
+                buf = bytearray(size)
+                for i in ids:
+                    buf[i >> 3] |= 1 << (i & 7)
+                bitsets[value] = int.from_bytes(buf, "little")
+                index.folded[name].setdefault(value.lower(), value)
+        index.all = (1 << len(view.records)) - 1
+        index.build_seconds = time.perf_counter() - start
+        return index
+
+    def bitset(self, facet: str, values: Iterable[str]) -> int:
+        """Movies having any of ``values`` for ``facet`` (unknown values match nothing)."""
+        bitsets, folded = self.bitsets[facet], self.folded[facet]
+        bits = 0
+        for value in values:
+            bits |= bitsets.get(value) or bitsets.get(folded.get(value.lower(), ""), 0)
+        return bits
+
+    def select(self, selection: Mapping[str, Sequence[str]], exclude: Optional[str] = None) -> int:
+        """Movies matching every facet of ``selection`` except ``exclude``."""
+        bits = self.all
+        for facet, values in selection.items():
+            if facet != exclude and values:
+                bits &= self.bitset(facet, values)
+        return bits
+
+    def counts(self, facet: str, within: int, top: int = 10) -> Tuple[int, List[Tuple[str, int]]]:
+        """(distinct values present, [(value, movies)] most frequent first) for movies in ``within``."""
+        found = []
+        for value, bits in self.bitsets[facet].items():
+            n = (bits & within).bit_count()
+            if n:
+                found.append((value, n))
+        found.sort(key=lambda item: (-item[1], item[0]))
+        return len(found), (found[:top] if top > 0 else found)
+
+    def query(self, selection: Mapping[str, Sequence[str]], facets: Sequence[str] = tuple(FACETS),
+              top: int = 10, limit: int = 20, offset: int = 0) -> dict:
+        """Matching movies (a page of them) and per-facet counts for a selection."""
+        start = time.perf_counter()
+        for facet in list(selection) + list(facets):
+            if facet not in FACETS:
+                raise ValueError(f"unknown facet {facet!r} (facets: {', '.join(FACETS)})")
+        matches = self.select(selection)
+        out_facets = {}
+        for facet in facets:
+            within = self.select(selection, exclude=facet) if selection.get(facet) else matches
+            distinct, values = self.counts(facet, within, top)
+            out_facets[facet] = {"distinct": distinct, "values": [{"value": v, "movies": n} for v, n in values]}
+        page = []
+        if limit != 0:
+            for n, i in enumerate(iter_bits(matches)):
+                if n < offset:
+                    continue
+                if limit > 0 and len(page) >= limit:
+                    break
+                page.append(self.records[i].to_json())
+        return {
+            "total": matches.bit_count(),
+            "selection": {facet: list(values) for facet, values in selection.items() if values},
+            "facets": out_facets,
+            "offset": offset,
+            "movies": page,
+            "us": round((time.perf_counter() - start) * 1e6, 1),
+        }
+
+    def stats(self) -> dict:
+        return {
+            "movies": len(self.records),
+            "values": {name: len(bitsets) for name, bitsets in self.bitsets.items()},
+            "bytes": sum((bits.bit_length() + 7) // 8 for bitsets in self.bitsets.values()
+                         for bits in bitsets.values()),
+            "build_ms": round(self.build_seconds * 1000.0, 1),
+        }
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+from rdflib import Graph
+
+from graph_snapshot import SourceDiff, cached_triples, diff_source
+
+
+# Incremental reload of source files into a served graph.
+#
+# The served graph is never modified in place: a reload copies it, applies
+# the triple diff of the changed files to the copy and hands the copy back,
+# so queries that already hold the old graph finish against a consistent
+# view while new requests pick up the new one once the caller publishes it.
+
+
+def copy_graph(graph: Graph) -> Graph:
+    """A writable copy of ``graph`` on the same kind of store."""
+    store = graph.store
+    if hasattr(store, "copy"):
+        return Graph(store=store.copy(), identifier=graph.identifier)
+    new = Graph(store=type(store)(), identifier=graph.identifier)
+    new.store.addN((s, p, o, new) for s, p, o in graph)
+    for prefix, namespace in graph.namespaces():
+        new.bind(prefix, namespace, override=False)
+    return new
+
+
+def apply_diffs(graph: Graph, diffs: Sequence[SourceDiff], all_sources: Sequence[str],
+                cache_dir: Optional[str] = None) -> Graph:
+    """Copy ``graph`` and apply ``diffs`` to the copy; ``graph`` itself is left untouched.
+
+    A triple dropped from one file stays if another source still asserts it,
+    so the other sources' snapshots are consulted whenever something was removed.
+    """
+    changed = {os.path.abspath(d.path) for d in diffs}
+    removed = set()
+    for d in diffs:
+        removed.update(d.removed)
+    if removed:
+        for path in all_sources:
+            if os.path.abspath(path) in changed:
+                continue
+            others = cached_triples(path, cache_dir)
+            if others:
+                removed -= others
+    # Something removed from one changed file may have been added by another.
+    for d in diffs:
+        removed.difference_update(d.added)
+
+    new = copy_graph(graph)
+    for triple in removed:
+        new.remove(triple)
+    new.store.addN((s, p, o, new) for d in diffs for s, p, o in d.added)
+    return new
+
+
+def reload_sources(graph: Graph, paths: Sequence[str], all_sources: Sequence[str],
+                   cache_dir: Optional[str] = None, force: bool = False):
+    """Diff ``paths`` against their snapshots; returns (new graph or None, diffs).
+
+    The new graph is None when none of the files changed.
+    """
+    diffs = [diff_source(path, cache_dir, force=force) for path in paths]
+    changed = [d for d in diffs if d.changed]
+    if not changed:
+        return None, diffs
+    return apply_diffs(graph, changed, all_sources, cache_dir), diffs
+
+
+class FileWatcher:
+    """Polls the mtime/size of some files and calls ``on_change(paths)`` when they change.
+
+    Polling keeps this dependency-free; a change is reported once the file has
+    looked the same for one full interval, so half-written files are skipped.
+    """
+
+    def __init__(self, paths: Iterable[str], on_change: Callable[[List[str]], None],
+                 interval: float = 2.0) -> None:
+        self.paths = list(paths)
+        self.on_change = on_change
+        self.interval = interval
+        self._seen: Dict[str, Optional[tuple]] = {p: self._stat(p) for p in self.paths}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _stat(path: str) -> Optional[tuple]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def start(self) -> "FileWatcher":
+        self._thread = threading.Thread(target=self._run, name="graph-file-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        pending: Dict[str, tuple] = {}
+        while not self._stop.wait(self.interval):
+            ready = []
+            for path in self.paths:
+                current = self._stat(path)
+                if current is None or current == self._seen.get(path):
+                    pending.pop(path, None)
+                    continue
+                if pending.get(path) == current:
+                    ready.append(path)
+                    self._seen[path] = current
+                    del pending[path]
+                else:
+                    pending[path] = current
+            if ready:
+                try:
+                    self.on_change(ready)
+                except Exception as e:
+                    print(f"✗ Reload of {', '.join(ready)} failed: {e}")
+
+
+def describe_diff(d: SourceDiff) -> str:
+    if not d.changed:
+        return "unchanged"
+    how = "full load (no previous snapshot)" if d.full else f"+{len(d.added)} / -{len(d.removed)} triples"
+    return f"{how}, {d.seconds * 1000.0:.1f} ms"
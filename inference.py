@@ -0,0 +1,319 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from rdflib import OWL, RDF, RDFS, Graph, Literal, URIRef
+from rdflib.store import Store
+
+from country_index import SameAsIndex
+from graph_reload import copy_graph
+from graph_snapshot import DEFAULT_CACHE_DIR, _sha256, encode_graph, snapshot_triples
+
+# Forward-chaining materialization of the ontology's entailments.
+#
+# ontology.owl declares domains/ranges, owl:inverseOf pairs (hasActor /
+# actedInMovie, hasDirector / directedMovie, producedInCountry /
+# countryProducesMovie) and the Actor/Director -> Person hierarchy, and the
+# Factbook links its countries to DBpedia with owl:sameAs. None of that is
+# applied by rdflib's SPARQL engine, so ``?p a mc:Person`` or
+# ``?a mc:actedInMovie ?m`` match nothing. ``closure`` computes, once, every
+# triple entailed by these rules:
+#
+#   rdfs2/3    (x p y) (p domain C) -> (x a C);  (p range C) -> (y a C)
+#   rdfs5/7    subPropertyOf is transitive; (x p y) (p sub q) -> (x q y)
+#   rdfs9/11   subClassOf is transitive; (x a C) (C sub D) -> (x a D)
+#   inverseOf  (x p y) (p inverseOf q) -> (y q x), in both directions
+#   sameAs     symmetric and transitive (the links themselves; statements
+#              are not copied across aliases)
+#
+# The result is kept as its own graph, identified by INFERRED_GRAPH, in a
+# store of its own. The served graph reads through an InferredStore, the
+# union of the asserted store and that one, so an entailed pattern is an
+# ordinary index lookup, while writes (updates, reloads) only ever touch
+# the asserted triples -- an INSERT of a triple that is merely entailed is
+# a real change, journalled and logged like any other. The inferred triples
+# are cached on disk as a snapshot keyed by the content of every source file
+# (ontology.owl included) and of the update log, so editing the ontology --
+# or the data -- invalidates them. Live reloads and updates recompute them
+# in memory with ``refresh``.
+
+INFERRED_GRAPH = URIRef("urn:x-sem-web-ctu:inferred")
+RULES_VERSION = 1
+
+Triple = Tuple[object, object, object]
+
+
+class Schema:
+    """The rule inputs read from the asserted triples."""
+
+    def __init__(self, triples: Iterable[Triple]) -> None:
+        sub_class: Dict[object, Set[object]] = defaultdict(set)
+        sub_property: Dict[object, Set[object]] = defaultdict(set)
+        self.domains: Dict[object, Set[object]] = defaultdict(set)
+        self.ranges: Dict[object, Set[object]] = defaultdict(set)
+        self.inverses: Dict[object, Set[object]] = defaultdict(set)
+        same_as: List[Triple] = []
+        for s, p, o in triples:
+            if p == RDFS.subClassOf:
+                sub_class[s].add(o)
+            elif p == RDFS.subPropertyOf:
+                sub_property[s].add(o)
+            elif p == RDFS.domain:
+                self.domains[s].add(o)
+            elif p == RDFS.range:
+                self.ranges[s].add(o)
+            elif p == OWL.inverseOf:
+                self.inverses[s].add(o)
+                self.inverses[o].add(s)
+            elif p == OWL.sameAs:
+                same_as.append((s, p, o))
+        self.super_classes = _transitive(sub_class)
+        self.super_properties = _transitive(sub_property)
+        self.same_as = same_as
+
+    def consequences(self, triple: Triple) -> Iterable[Triple]:
+        s, p, o = triple
+        if p == RDF.type:
+            for c in self.super_classes.get(o, ()):
+                yield s, RDF.type, c
+        for q in self.super_properties.get(p, ()):
+            yield s, q, o
+        for c in self.domains.get(p, ()):
+            yield s, RDF.type, c
+        if not isinstance(o, Literal):
+            for c in self.ranges.get(p, ()):
+                yield o, RDF.type, c
+            for q in self.inverses.get(p, ()):
+                yield o, q, s
+
+
+def _transitive(edges: Dict[object, Set[object]]) -> Dict[object, Set[object]]:
+    closed: Dict[object, Set[object]] = {}
+    for start in edges:
+        seen: Set[object] = set()
+        stack = list(edges[start])
+        while stack:
+            node = stack.pop()
+            if node in seen or node == start:
+                continue
+            seen.add(node)
+            stack.extend(edges.get(node, ()))
+        closed[start] = seen
+    return closed
+
+
+def _same_as_closure(links: Sequence[Triple]) -> Iterable[Triple]:
+    terms = {}
+    for s, _, o in links:
+        terms[str(s)] = s
+        terms[str(o)] = o
+    index = SameAsIndex.from_links((str(s), str(o)) for s, _, o in links)
+    for group in set(index.classes.values()):
+        for a in group:
+            for b in group:
+                if a != b:
+                    yield terms[a], OWL.sameAs, terms[b]
+
+
+def closure(asserted: Set[Triple]) -> Set[Triple]:
+    """Every triple entailed by ``asserted`` under the rules above, minus ``asserted`` itself.
+
+    Semi-naive: each round only fires the rules on the triples derived in the
+    previous one, until a round derives nothing new.
+    """
+    schema = Schema(asserted)
+    derived: Set[Triple] = set()
+    delta = list(asserted)
+    for t in _same_as_closure(schema.same_as):
+        if t not in asserted:
+            derived.add(t)
+    while delta:
+        fresh = []
+        for triple in delta:
+            for t in schema.consequences(triple):
+                if t not in derived and t not in asserted:
+                    derived.add(t)
+                    fresh.append(t)
+        delta = fresh
+    return derived
+
+
+@dataclass
+class Materialized:
+    triples: Set[Triple]
+    from_cache: bool
+    seconds: float
+
+    @property
+    def graph(self) -> Graph:
+        """The inferred triples as a standalone graph named INFERRED_GRAPH."""
+        g = Graph(identifier=INFERRED_GRAPH)
+        g.store.addN((s, p, o, g) for s, p, o in self.triples)
+        return g
+
+    def stats(self) -> dict:
+        return {"graph": str(INFERRED_GRAPH), "triples": len(self.triples),
+                "from_cache": self.from_cache, "ms": round(self.seconds * 1000.0, 1)}
+
+
+def cache_key(paths: Sequence[str]) -> str:
+    """Fingerprint of the inputs: the rules version plus the content of every file in ``paths``."""
+    h = hashlib.sha256(f"rules-{RULES_VERSION}".encode("utf-8"))
+    for path in paths:
+        h.update(os.path.abspath(path).encode("utf-8"))
+        h.update(_sha256(path).encode("ascii") if os.path.exists(path) else b"-")
+    return h.hexdigest()[:16]
+
+
+def _cache_path(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, f"inferred.{key}.snap")
+
+
+class InferredStore(Store):
+    """Asserted triples plus a separate, read-only store of the triples inferred from them.
+
+    Reads see both; writes go to ``asserted``. An inferred triple that gets
+    asserted is "shadowed" (not yielded twice) until the next ``refresh``.
+    """
+
+    formula_aware = False
+    transaction_aware = False
+
+    def __init__(self, asserted: Store, result: Materialized, identifier=None) -> None:
+        super().__init__()
+        # The asserted triples' context (with a context-aware store) is the served graph.
+        self.identifier = identifier
+        self.asserted = asserted
+        self.context_aware = asserted.context_aware
+        self.graph_aware = asserted.graph_aware
+        self.set_inferred(result)
+
+    def set_inferred(self, result: Materialized) -> None:
+        self.inferred = result.graph.store
+        self.inferred_triples = result.triples
+        self.shadowed: Set[Triple] = set()
+
+    def copy(self) -> "InferredStore":
+        """Copy of the asserted triples; the inferred store is shared (it is only ever replaced)."""
+        other = InferredStore.__new__(InferredStore)
+        Store.__init__(other)
+        other.identifier = self.identifier
+        other.asserted = copy_graph(Graph(store=self.asserted, identifier=self.identifier)).store
+        other.context_aware, other.graph_aware = self.context_aware, self.graph_aware
+        other.inferred, other.inferred_triples = self.inferred, self.inferred_triples
+        other.shadowed = set(self.shadowed)
+        return other
+
+    def add(self, triple, context=None, quoted: bool = False) -> None:
+        self.asserted.add(triple, context, quoted)
+        if triple in self.inferred_triples:
+            self.shadowed.add(triple)
+
+    def addN(self, quads) -> None:
+        for s, p, o, c in quads:
+            self.add((s, p, o), c)
+
+    def remove(self, triple_pattern, context=None) -> None:
+        for triple, _ in list(self.asserted.triples(triple_pattern, context)):
+            self.asserted.remove(triple, context)
+            self.shadowed.discard(triple)
+
+    def triples(self, triple_pattern, context=None):
+        yield from self.asserted.triples(triple_pattern, context)
+        shadowed = self.shadowed
+        # The inferred store has its own context; it holds nothing else.
+        for triple, contexts in self.inferred.triples(triple_pattern, None):
+            if not shadowed or triple not in shadowed:
+                yield triple, contexts
+
+    def __len__(self, context=None) -> int:
+        return self.asserted.__len__(context) + len(self.inferred_triples) - len(self.shadowed)
+
+    def contexts(self, triple=None):
+        return self.asserted.contexts(triple)
+
+    def add_graph(self, graph) -> None:
+        self.asserted.add_graph(graph)
+
+    def remove_graph(self, graph) -> None:
+        self.asserted.remove_graph(graph)
+
+    def bind(self, prefix, namespace, override: bool = True) -> None:
+        self.asserted.bind(prefix, namespace, override=override)
+
+    def namespace(self, prefix):
+        return self.asserted.namespace(prefix)
+
+    def prefix(self, namespace):
+        return self.asserted.prefix(namespace)
+
+    def namespaces(self):
+        return self.asserted.namespaces()
+
+
+def with_inferred(graph: Graph, result: Materialized) -> Graph:
+    """A graph over ``graph``'s store (the asserted triples) plus ``result``."""
+    return Graph(store=InferredStore(graph.store, result, graph.identifier), identifier=graph.identifier)
+
+
+def materialize(graph: Graph, inputs: Sequence[str], cache_dir: Optional[str] = None) -> Materialized:
+    """Compute (or load from cache) the triples inferred from ``graph``; see ``with_inferred``.
+
+    ``inputs`` are the files ``graph`` was loaded from; a cached result is
+    used only when all of them are byte-identical to when it was computed.
+    It is kept in ``cache_dir``, by default the snapshot cache directory next
+    to the first input.
+    """
+    start = time.perf_counter()
+    if not inputs:
+        result = Materialized(closure(set(graph)), False, 0.0)
+        result.seconds = time.perf_counter() - start
+        return result
+    # Next to the sources (like their snapshots), not wherever the process runs.
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(inputs[0])), DEFAULT_CACHE_DIR)
+    key = cache_key(inputs)
+    path = _cache_path(cache_dir, key)
+    try:
+        with open(path, "rb") as f:
+            result = Materialized(snapshot_triples(f.read()), True, 0.0)
+    except (OSError, ValueError, EOFError):
+        result = Materialized(closure(set(graph)), False, 0.0)
+        _store(cache_dir, key, result)
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def _store(cache_dir: str, key: str, result: Materialized) -> None:
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = _cache_path(cache_dir, key)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(encode_graph(result.graph))
+        os.replace(tmp, path)
+        # Only the latest result is worth keeping.
+        for name in os.listdir(cache_dir):
+            if name.startswith("inferred.") and name.endswith(".snap") and name != os.path.basename(path):
+                os.remove(os.path.join(cache_dir, name))
+    except OSError as e:
+        print(f"  (could not cache inferred triples: {e})")
+
+
+def refresh(graph: Graph, previous: Materialized) -> Materialized:
+    """Re-derive the inferred triples of a changed ``graph`` (a ``with_inferred`` graph) in place.
+
+    The closure is recomputed from the asserted triples alone and replaces
+    the inferred store of ``graph``; ``previous`` and the graphs still
+    sharing its store are left as they are.
+    """
+    start = time.perf_counter()
+    store = graph.store
+    result = Materialized(closure({t for t, _ in store.asserted.triples((None, None, None))}), False, 0.0)
+    store.set_inferred(result)
+    result.seconds = time.perf_counter() - start
+    return result
@@ -0,0 +1,517 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from request_metrics import percentile
+
+# Load and soak testing for sparql_server.py over HTTP.
+#
+# test.py checks what the queries return; this drives a running server the
+# way the UI does -- the example queries (POSTed as forms, first page of a
+# cursor), /stats polls and page loads of / -- from an asyncio client that
+# keeps HTTP/1.1 connections alive. Two ways to apply load:
+#
+#   closed loop  --concurrency N: N clients, each sending its next request
+#                as soon as the previous one answers (throughput = what the
+#                server can sustain at N in flight)
+#   open loop    --rps R: requests start on a fixed schedule whatever the
+#                server does; latency is measured from the scheduled start,
+#                so queueing behind a slow server is counted rather than
+#                hidden (no coordinated omission)
+#
+# Every --interval seconds a line reports throughput, latency percentiles,
+# errors and the server's resident memory (from /proc, summed over worker
+# processes); a summary and an optional JSON report follow at the end. Only
+# loopback targets are accepted.
+#
+#   python load_test.py --spawn --duration 60 --concurrency 16
+#   python load_test.py --url http://localhost:8888 --pid 1234 --rps 50 --duration 3600
+
+PAGE_SIZE = 200  # what the UI asks for
+DEFAULT_MIX = "examples=8,stats=1,ui=1"
+
+
+@dataclass(frozen=True)
+class Target:
+    name: str
+    method: str
+    path: str
+    body: bytes = b""
+
+
+def example_queries() -> List[str]:
+    """The example queries of the server's HTML interface, in UI order."""
+    from sparql_server import HTML_INTERFACE
+
+    block = re.search(r"const examples = \[(.*?)\];", HTML_INTERFACE, re.S)
+    if block is None:
+        raise RuntimeError("no examples found in HTML_INTERFACE")
+    return [q.replace("\\n", "\n") for q in re.findall(r"`([^`]*)`", block.group(1))]
+
+
+def build_mix(spec: str) -> Tuple[List[Target], List[float]]:
+    """Targets and their weights for a "examples=8,stats=1,ui=1" style spec."""
+    weights: Dict[str, float] = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ("examples", "stats", "ui"):
+            raise ValueError(f"unknown mix entry {name!r} (use examples, stats, ui)")
+        weights[name] = float(weight or 1)
+    targets: List[Target] = []
+    shares: List[float] = []
+    if weights.get("examples"):
+        queries = example_queries()
+        for i, query in enumerate(queries, 1):
+            body = urllib.parse.urlencode({"query": query, "page_size": PAGE_SIZE}).encode("utf-8")
+            targets.append(Target(f"example {i}", "POST", "/sparql", body))
+            shares.append(weights["examples"] / len(queries))
+    if weights.get("stats"):
+        targets.append(Target("/stats", "GET", "/stats"))
+        shares.append(weights["stats"])
+    if weights.get("ui"):
+        targets.append(Target("/", "GET", "/"))
+        shares.append(weights["ui"])
+    if not targets:
+        raise ValueError("the request mix is empty")
+    return targets, shares
+
+
+# --- HTTP/1.1 client ---
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection; just enough protocol for this server."""
+
+    def __init__(self, host: str, port: int, headers: Dict[str, str]) -> None:
+        self.host = host
+        self.port = port
+        self.headers = headers
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, target: Target, body: bytes) -> Tuple[int, int]:
+        """(status, body bytes) of one request/response exchange."""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = [f"{target.method} {target.path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        head += [f"{name}: {value}" for name, value in self.headers.items()]
+        if target.method == "POST":
+            head += ["Content-Type: application/x-www-form-urlencoded", f"Content-Length: {len(body)}"]
+        self.writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await self.writer.drain()
+
+        reader = self.reader
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed by server")
+        status = int(status_line.split()[1])
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        size = 0
+        if target.method == "HEAD" or status in (204, 304):
+            pass
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                chunk = int((await reader.readline()).split(b";")[0], 16)
+                if chunk == 0:
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                size += len(await reader.readexactly(chunk + 2)) - 2
+        elif "content-length" in headers:
+            size = len(await reader.readexactly(int(headers["content-length"])))
+        else:
+            size = len(await reader.read())
+            headers["connection"] = "close"
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, size
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+# --- Measurement ---
+
+@dataclass
+class Window:
+    """Outcomes of the requests that finished within one reporting interval (or the whole run)."""
+    latencies: List[float] = field(default_factory=list)
+    errors: Counter = field(default_factory=Counter)
+    bytes: int = 0
+
+    def add(self, latency: float, error: Optional[str], size: int) -> None:
+        self.latencies.append(latency)
+        self.bytes += size
+        if error:
+            self.errors[error] += 1
+
+    def summary(self, seconds: float) -> dict:
+        times = sorted(self.latencies)
+        n = len(times)
+        failed = sum(self.errors.values())
+        return {
+            "requests": n,
+            "rps": n / seconds if seconds > 0 else 0.0,
+            "errors": failed,
+            "error_rate": failed / n if n else 0.0,
+            "p50_ms": percentile(times, 50) * 1000.0,
+            "p90_ms": percentile(times, 90) * 1000.0,
+            "p99_ms": percentile(times, 99) * 1000.0,
+            "max_ms": (times[-1] if times else 0.0) * 1000.0,
+            "mean_ms": (sum(times) / n if n else 0.0) * 1000.0,
+            "mb_per_s": self.bytes / seconds / 1e6 if seconds > 0 else 0.0,
+            "error_kinds": dict(self.errors),
+        }
+
+
+class Recorder:
+    def __init__(self, measure_from: float) -> None:
+        self.measure_from = measure_from
+        self.window = Window()
+        self.total = Window()
+        self.by_target: Dict[str, Window] = defaultdict(Window)
+
+    def add(self, target: Target, started: float, finished: float, status: int, size: int,
+            error: Optional[str] = None) -> None:
+        if started < self.measure_from:
+            return  # warm-up
+        if error is None and status >= 400:
+            error = f"HTTP {status}"
+        latency = finished - started
+        for w in (self.window, self.total, self.by_target[target.name]):
+            w.add(latency, error, size)
+
+
+def process_tree(pid: int) -> List[int]:
+    """``pid`` and all its descendants (Linux /proc)."""
+    pids, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        pids.append(p)
+        try:
+            for tid in os.listdir(f"/proc/{p}/task"):
+                with open(f"/proc/{p}/task/{tid}/children") as f:
+                    todo.extend(int(c) for c in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def rss_mb(pid: Optional[int]) -> Optional[float]:
+    """Resident memory of a server process and its forked workers, in MB; None if unknown."""
+    if pid is None:
+        return None
+    total = 0
+    found = False
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        found = True
+                        break
+        except OSError:
+            continue
+    return total / 1024.0 if found else None
+
+
+# --- Load generation ---
+
+class LoadRun:
+    def __init__(self, args: argparse.Namespace, host: str, port: int,
+                 targets: List[Target], weights: List[float]) -> None:
+        self.args = args
+        self.targets = targets
+        self.weights = weights
+        self.rng = random.Random(args.seed)
+        self.sent = 0
+        headers = {"Accept": "application/sparql-results+json, application/json;q=0.9, */*;q=0.1"}
+        if args.compress:
+            headers["Accept-Encoding"] = "gzip, br"
+        self.pool: asyncio.Queue = asyncio.Queue()
+        for _ in range(args.concurrency):
+            self.pool.put_nowait(Connection(host, port, headers))
+        self.start = time.perf_counter()
+        self.stop_at = self.start + args.warmup + args.duration
+        self.recorder = Recorder(self.start + args.warmup)
+
+    def next_body(self, target: Target) -> bytes:
+        self.sent += 1
+        if self.args.bust_cache and target.method == "POST":
+            # A trailing comment changes the query text, and so the result cache key.
+            return target.body + urllib.parse.quote(f"\n# load_test {self.sent}").encode("ascii")
+        return target.body
+
+    async def one(self, target: Target, started: float) -> None:
+        conn = await self.pool.get()
+        try:
+            status, size = await asyncio.wait_for(conn.request(target, self.next_body(target)), self.args.timeout)
+            self.recorder.add(target, started, time.perf_counter(), status, size)
+        except asyncio.TimeoutError:
+            conn.close()
+            self.recorder.add(target, started, time.perf_counter(), 0, 0, "timeout")
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError) as e:
+            conn.close()
+            self.recorder.add(target, started, time.perf_counter(), 0, 0, type(e).__name__)
+        finally:
+            self.pool.put_nowait(conn)
+
+    def pick(self) -> Target:
+        return self.rng.choices(self.targets, self.weights)[0]
+
+    async def closed_loop(self) -> None:
+        async def client() -> None:
+            while time.perf_counter() < self.stop_at:
+                await self.one(self.pick(), time.perf_counter())
+        await asyncio.gather(*(client() for _ in range(self.args.concurrency)))
+
+    async def open_loop(self) -> None:
+        interval = 1.0 / self.args.rps
+        tasks = set()
+        scheduled = self.start
+        while scheduled < self.stop_at:
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.ensure_future(self.one(self.pick(), scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            scheduled += self.rng.expovariate(self.args.rps) if self.args.poisson else interval
+        if tasks:
+            await asyncio.wait(tasks, timeout=self.args.timeout)
+
+    async def report(self) -> List[dict]:
+        """Print one line per interval until the run ends; returns the samples."""
+        samples = []
+        last = self.start
+        rss0 = rss_mb(self.args.pid)
+        print(f"{'t':>6s} {'req/s':>8s} {'p50':>8s} {'p90':>8s} {'p99':>8s} {'max':>8s} {'err':>6s} {'rss':>9s}")
+        while True:
+            await asyncio.sleep(min(self.args.interval, max(0.0, self.stop_at - time.perf_counter()) + 0.05))
+            now = time.perf_counter()
+            window, self.recorder.window = self.recorder.window, Window()
+            s = window.summary(now - last)
+            rss = rss_mb(self.args.pid)
+            sample = {"t": round(now - self.start, 1), "rss_mb": rss, **s}
+            samples.append(sample)
+            rss_text = "n/a" if rss is None else f"{rss:.1f}MB"
+            warm = " (warm-up)" if now < self.recorder.measure_from else ""
+            print(f"{now - self.start:5.0f}s {s['rps']:8.1f} {s['p50_ms']:7.1f}ms {s['p90_ms']:7.1f}ms "
+                  f"{s['p99_ms']:7.1f}ms {s['max_ms']:7.0f}ms {s['errors']:6d} {rss_text:>9s}{warm}")
+            last = now
+            if now >= self.stop_at:
+                break
+        if rss0 is not None:
+            samples.insert(0, {"t": 0.0, "rss_mb": rss0})
+        return samples
+
+    async def run(self) -> List[dict]:
+        load = self.open_loop() if self.args.rps else self.closed_loop()
+        samples, _ = await asyncio.gather(self.report(), load)
+        while not self.pool.empty():
+            self.pool.get_nowait().close()
+        return samples
+
+
+def rss_growth(samples: List[dict]) -> Optional[dict]:
+    """First/last/peak RSS and the least-squares slope, in MB per hour."""
+    points = [(s["t"], s["rss_mb"]) for s in samples if s.get("rss_mb") is not None]
+    if len(points) < 2:
+        return None
+    n = len(points)
+    mean_t = sum(t for t, _ in points) / n
+    mean_m = sum(m for _, m in points) / n
+    var = sum((t - mean_t) ** 2 for t, _ in points)
+    slope = sum((t - mean_t) * (m - mean_m) for t, m in points) / var if var else 0.0
+    return {
+        "start_mb": points[0][1],
+        "end_mb": points[-1][1],
+        "peak_mb": max(m for _, m in points),
+        "growth_mb": points[-1][1] - points[0][1],
+        "slope_mb_per_hour": slope * 3600.0,
+    }
+
+
+# --- Server under test ---
+
+def is_loopback(host: str) -> bool:
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except socket.gaierror:
+        return False
+    return all(info[4][0].startswith("127.") or info[4][0] == "::1" for info in infos)
+
+
+def wait_for_server(base_url: str, proc: Optional[subprocess.Popen], timeout: float = 120.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"server exited with status {proc.returncode}")
+        try:
+            with urllib.request.urlopen(base_url + "/stats", timeout=2) as r:
+                r.read()
+            return
+        except OSError:
+            time.sleep(0.25)
+    raise RuntimeError(f"server at {base_url} did not come up within {timeout:.0f}s")
+
+
+def spawn_server(port: int, extra: str, log_path: str) -> subprocess.Popen:
+    here = os.path.dirname(os.path.abspath(__file__))
+    cmd = [sys.executable, os.path.join(here, "sparql_server.py"), str(port), *shlex.split(extra)]
+    print(f"Starting {' '.join(shlex.quote(c) for c in cmd)} (log: {log_path})")
+    log = open(log_path, "w", encoding="utf-8")
+    return subprocess.Popen(cmd, cwd=here, stdout=log, stderr=subprocess.STDOUT)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def print_summary(report: dict) -> None:
+    t = report["total"]
+    print("=" * 80)
+    print(f"{report['meta']['mode']}: {t['requests']} requests in {report['meta']['duration_s']:.0f}s, "
+          f"{t['rps']:.1f} req/s, {t['mb_per_s']:.2f} MB/s")
+    print(f"latency p50 {t['p50_ms']:.1f}ms  p90 {t['p90_ms']:.1f}ms  p99 {t['p99_ms']:.1f}ms  "
+          f"max {t['max_ms']:.0f}ms  mean {t['mean_ms']:.1f}ms")
+    print(f"errors {t['errors']} ({t['error_rate'] * 100.0:.2f}%)"
+          + (f": {', '.join(f'{k} x{v}' for k, v in t['error_kinds'].items())}" if t["errors"] else ""))
+    rss = report["rss"]
+    if rss:
+        print(f"server RSS {rss['start_mb']:.1f} -> {rss['end_mb']:.1f} MB (peak {rss['peak_mb']:.1f}, "
+              f"{rss['growth_mb']:+.1f} MB, {rss['slope_mb_per_hour']:+.1f} MB/h)")
+    print(f"\n{'target':20s} {'req':>7s} {'p50':>8s} {'p99':>8s} {'err':>6s}")
+    for name, s in report["targets"].items():
+        print(f"{name:20s} {s['requests']:7d} {s['p50_ms']:7.1f}ms {s['p99_ms']:7.1f}ms {s['errors']:6d}")
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Load- and soak-test sparql_server.py on localhost.")
+    ap.add_argument("--url", default="http://127.0.0.1:8888", help="server to test (loopback only)")
+    ap.add_argument("--spawn", action="store_true",
+                    help="start sparql_server.py on a free port for the run (and stop it afterwards)")
+    ap.add_argument("--server-args", default="",
+                    help="extra sparql_server.py arguments with --spawn")
+    ap.add_argument("--pid", type=int, default=None,
+                    help="server process id, to track RSS when not using --spawn")
+    ap.add_argument("--concurrency", "-c", type=int, default=8,
+                    help="closed loop: clients in flight; open loop: connection pool size (default 8)")
+    ap.add_argument("--rps", type=float, default=0.0,
+                    help="open loop at this many requests/s instead of a closed loop")
+    ap.add_argument("--poisson", action="store_true", help="open loop with exponential inter-arrival times")
+    ap.add_argument("--duration", type=float, default=30.0, help="measured seconds (default 30)")
+    ap.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds before that (default 3)")
+    ap.add_argument("--interval", type=float, default=5.0, help="seconds per progress line (default 5)")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help=f"request weights (default {DEFAULT_MIX})")
+    ap.add_argument("--bust-cache", action="store_true",
+                    help="make every query text unique so the result cache never hits")
+    ap.add_argument("--compress", action="store_true", help="send Accept-Encoding: gzip, br")
+    ap.add_argument("--timeout", type=float, default=60.0, help="per-request timeout in seconds (default 60)")
+    ap.add_argument("--seed", type=int, default=1, help="random seed for the request mix")
+    ap.add_argument("--json", default="", help="write the report here ('-' for stdout)")
+    ap.add_argument("--max-error-rate", type=float, default=0.0,
+                    help="exit 1 if the error rate is above this fraction (default 0)")
+    args = ap.parse_args(argv)
+    if args.concurrency < 1:
+        ap.error("--concurrency must be at least 1")
+    if args.rps < 0 or args.duration <= 0 or args.interval <= 0:
+        ap.error("--rps, --duration and --interval must be positive")
+    return args
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    proc = None
+    if args.spawn:
+        port = free_port()
+        args.url = f"http://127.0.0.1:{port}"
+        proc = spawn_server(port, args.server_args, os.path.join(tempfile.gettempdir(), f"load_test_server_{port}.log"))
+        args.pid = proc.pid
+    url = urllib.parse.urlsplit(args.url)
+    host, port = url.hostname or "127.0.0.1", url.port or 80
+    if not is_loopback(host):
+        print(f"✗ {host} is not a loopback address; load tests only run against localhost")
+        return 2
+    try:
+        targets, weights = build_mix(args.mix)
+        wait_for_server(f"http://{host}:{port}", proc)
+        mode = f"open loop {args.rps:g} req/s" if args.rps else f"closed loop, concurrency {args.concurrency}"
+        print(f"Load test: {mode}, {args.warmup:g}s warm-up + {args.duration:g}s against {host}:{port} "
+              f"({len(targets)} targets: {args.mix})")
+        run = LoadRun(args, host, port, targets, weights)
+        samples = asyncio.run(run.run())
+    except (RuntimeError, ValueError) as e:
+        print(f"✗ {e}")
+        return 2
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    recorder = run.recorder
+    report = {
+        "meta": {
+            "url": f"http://{host}:{port}",
+            "mode": mode,
+            "concurrency": args.concurrency,
+            "rps": args.rps,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "mix": args.mix,
+            "bust_cache": args.bust_cache,
+            "compress": args.compress,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "total": recorder.total.summary(args.duration),
+        "targets": {name: w.summary(args.duration) for name, w in sorted(recorder.by_target.items())},
+        "rss": rss_growth(samples),
+        "samples": samples,
+    }
+    print_summary(report)
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.json}")
+    if report["total"]["error_rate"] > args.max_error_rate:
+        print(f"✗ error rate {report['total']['error_rate'] * 100.0:.2f}% above "
+              f"{args.max_error_rate * 100.0:.2f}%")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
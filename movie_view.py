@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+from rdflib import RDF, Graph, Namespace
+
+# Materialized per-movie records.
+#
+# The canned UI queries all rebuild the same row: title, GROUP_CONCAT of
+# directors and actors, SAMPLE of country/runtime/release date/IMDb id, with
+# the dbpedia prefix REPLACE()d away. MovieView does that join once per graph
+# load and keeps one slotted record per mc:Movie, so /movies answers from a
+# dict and a scan over ~1k small objects instead of a multi-OPTIONAL query.
+
+MC = Namespace("http://www.semanticweb.org/lenovo/ontologies/2025/11/untitled-ontology-5#")
+DBPEDIA_RESOURCE = "http://dbpedia.org/resource/"
+
+
+def strip_dbpedia(value: str) -> str:
+    return value.replace(DBPEDIA_RESOURCE, "")
+
+
+class MovieRecord:
+    __slots__ = ("iri", "name", "titles", "directors", "actors", "countries",
+                 "runtime", "release_date", "imdb_id", "_search")
+
+    def __init__(self, iri: str) -> None:
+        self.iri = iri
+        self.name = strip_dbpedia(iri)
+        self.titles: Tuple[str, ...] = ()
+        self.directors: Tuple[str, ...] = ()
+        self.actors: Tuple[str, ...] = ()
+        self.countries: Tuple[str, ...] = ()
+        self.runtime: Optional[int] = None
+        self.release_date: Optional[str] = None
+        self.imdb_id: Optional[str] = None
+        self._search: Dict[str, str] = {}
+
+    @property
+    def title(self) -> str:
+        return self.titles[0] if self.titles else ""
+
+    @property
+    def year(self) -> Optional[int]:
+        if self.release_date and self.release_date[:4].isdigit():
+            return int(self.release_date[:4])
+        return None
+
+    def to_json(self) -> dict:
+        return {
+            "movie": self.iri,
+            "title": self.title,
+            "directors": list(self.directors),
+            "actors": list(self.actors),
+            "country": self.countries[0] if self.countries else None,
+            "countries": list(self.countries),
+            "runtime": self.runtime,
+            "releaseDate": self.release_date,
+            "imdbId": self.imdb_id,
+        }
+
+
+# /movies filter parameter -> the record field it searches (case-insensitive substring).
+TEXT_FILTERS = {
+    "title": "titles",
+    "actor": "actors",
+    "director": "directors",
+    "country": "countries",
+}
+
+
+class MovieView:
+    def __init__(self) -> None:
+        self.records: List[MovieRecord] = []
+        self.by_iri: Dict[str, MovieRecord] = {}
+        self.by_name: Dict[str, MovieRecord] = {}
+        self.build_seconds = 0.0
+
+    @classmethod
+    def build(cls, graph: Graph) -> "MovieView":
+        start = time.perf_counter()
+        view = cls()
+
+        def collect(predicate) -> Dict[str, List[str]]:
+            values: Dict[str, List[str]] = defaultdict(list)
+            for s, o in graph.subject_objects(predicate):
+                values[str(s)].append(str(o))
+            return values
+
+        titles = collect(MC.title)
+        directors = collect(MC.hasDirector)
+        actors = collect(MC.hasActor)
+        countries = collect(MC.producedInCountry)
+        runtimes = collect(MC.runtimeMinutes)
+        releases = collect(MC.releaseDate)
+        imdb_ids = collect(MC.imdbId)
+
+        for movie in sorted({str(m) for m in graph.subjects(RDF.type, MC.Movie)}):
+            rec = MovieRecord(movie)
+            rec.titles = tuple(sorted(set(titles.get(movie, ()))))
+            rec.directors = tuple(sorted({strip_dbpedia(v) for v in directors.get(movie, ())}))
+            rec.actors = tuple(sorted({strip_dbpedia(v) for v in actors.get(movie, ())}))
+            rec.countries = tuple(sorted({strip_dbpedia(v) for v in countries.get(movie, ())}))
+            runtime = runtimes.get(movie)
+            if runtime:
+                try:
+                    rec.runtime = int(float(runtime[0]))
+                except ValueError:
+                    pass
+            rec.release_date = min(releases[movie]) if movie in releases else None
+            rec.imdb_id = imdb_ids[movie][0] if movie in imdb_ids else None
+            rec._search = {field: "\n".join(getattr(rec, field)).lower()
+                           for field in TEXT_FILTERS.values()}
+            view.records.append(rec)
+            view.by_iri[movie] = rec
+            view.by_name[rec.name] = rec
+
+        view.build_seconds = time.perf_counter() - start
+        return view
+
+    def get(self, key: str) -> Optional[MovieRecord]:
+        return self.by_iri.get(key) or self.by_name.get(key)
+
+    def filter(self, params: Mapping[str, str]) -> Iterable[MovieRecord]:
+        """Records matching every given filter.
+
+        Text filters (title/actor/director/country) are case-insensitive
+        substring matches like the UI's FILTER(CONTAINS(LCASE(...))) queries;
+        min_runtime/max_runtime and year/min_year/max_year are numeric bounds.
+        """
+        text = [(TEXT_FILTERS[k], v.lower()) for k, v in params.items() if k in TEXT_FILTERS and v]
+        min_runtime = _int_param(params, "min_runtime")
+        max_runtime = _int_param(params, "max_runtime")
+        year = _int_param(params, "year")
+        min_year = _int_param(params, "min_year")
+        max_year = _int_param(params, "max_year")
+
+        for rec in self.records:
+            if any(needle not in rec._search[field] for field, needle in text):
+                continue
+            if min_runtime is not None and (rec.runtime is None or rec.runtime < min_runtime):
+                continue
+            if max_runtime is not None and (rec.runtime is None or rec.runtime > max_runtime):
+                continue
+            if year is not None or min_year is not None or max_year is not None:
+                y = rec.year
+                if y is None:
+                    continue
+                if (year is not None and y != year) or (min_year is not None and y < min_year) \
+                        or (max_year is not None and y > max_year):
+                    continue
+            yield rec
+
+    def stats(self) -> dict:
+        return {
+            "movies": len(self.records),
+            "build_ms": round(self.build_seconds * 1000.0, 1),
+        }
+
+
+def _int_param(params: Mapping[str, str], name: str) -> Optional[int]:
+    value = params.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer") from None
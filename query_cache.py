@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Mapping, Optional, Tuple, Union
+
+from rdflib import BNode, Literal, URIRef, Variable
+from rdflib.plugins.sparql import prepareQuery
+from rdflib.plugins.sparql.sparql import Query
+
+
+# rdflib's SPARQL grammar is a set of module-level pyparsing objects, and
+# parsing from two threads at once corrupts their shared state (e.g.
+# "Param.postParse2() missing 1 required positional argument"). Every parse
+# in the server -- queries and updates -- holds this lock.
+PARSE_LOCK = threading.Lock()
+
+
+# String literals are matched first so whitespace inside them is left alone.
+_TOKEN_RE = re.compile(
+    r'"""(?:[^"\\]|\\.|"(?!""))*"""'
+    r"|'''(?:[^'\\]|\\.|'(?!''))*'''"
+    r'|"(?:[^"\\\n]|\\.)*"'
+    r"|'(?:[^'\\\n]|\\.)*'"
+    r"|[ \t\r\f\v]*\n\s*"
+    r"|[ \t\r\f\v]+",
+    re.DOTALL,
+)
+
+
+def normalize_query(query: str) -> str:
+    """Canonical cache key for a query: blank runs collapsed outside literals.
+
+    Line breaks are kept (as a single newline) because a ``#`` comment runs to
+    the end of its line.
+    """
+    def sub(m: re.Match) -> str:
+        tok = m.group(0)
+        if tok[0] in "\"'":
+            return tok
+        return "\n" if "\n" in tok else " "
+
+    return _TOKEN_RE.sub(sub, query.strip())
+
+
+class PreparedQueryCache:
+    """Thread-safe LRU of parsed + algebra-translated queries.
+
+    Entries are keyed on the normalized text and the prefix bindings it was
+    parsed with: the same text can resolve ``ex:`` differently under other
+    namespaces.
+    """
+
+    def __init__(self, maxsize: int = 256) -> None:
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Tuple[str, tuple], Query]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, query: str, init_ns: Optional[Mapping[str, str]] = None) -> Query:
+        text = normalize_query(query)
+        namespaces = tuple(sorted((str(prefix), str(ns)) for prefix, ns in (init_ns or {}).items()))
+        key = (text, namespaces)
+        with self._lock:
+            prepared = self._entries.get(key)
+            if prepared is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return prepared
+            self.misses += 1
+
+        # Parse outside the cache lock; two threads racing on the same new query
+        # just both parse it once.
+        with PARSE_LOCK:
+            prepared = prepareQuery(text, initNs=dict(init_ns or {}))
+        with self._lock:
+            self._entries[key] = prepared
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return prepared
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def parse_term(value):
+    """Turn a JSON binding value into an rdflib term.
+
+    Plain JSON strings/numbers/bools become literals; SPARQL-JSON term objects
+    (``{"type": "uri", "value": ...}``) are honoured as well.
+    """
+    if isinstance(value, dict):
+        kind = value.get("type")
+        raw = value.get("value", "")
+        if kind == "uri":
+            return URIRef(raw)
+        if kind == "bnode":
+            return BNode(raw)
+        if kind in ("literal", "typed-literal"):
+            dt = value.get("datatype")
+            return Literal(raw, lang=value.get("xml:lang"), datatype=URIRef(dt) if dt else None)
+        raise ValueError(f"unknown binding type: {kind!r}")
+    if isinstance(value, (str, int, float, bool)):
+        return Literal(value)
+    raise ValueError(f"unsupported binding value: {value!r}")
+
+
+def parse_bindings(text: str) -> Dict[Variable, object]:
+    """Decode the ``bindings`` request parameter (a JSON object) into initBindings."""
+    if not text:
+        return {}
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError("bindings must be a JSON object")
+    return {Variable(name.lstrip("?$")): parse_term(value) for name, value in data.items()}
+
+
+def result_key(version: Union[int, str], query: str, bindings: Optional[Mapping] = None, variant: str = "") -> str:
+    """Cache key for an encoded response: graph version + query + bindings + variant."""
+    bound = sorted((str(k), v.n3()) for k, v in (bindings or {}).items())
+    return f"{version}\x00{variant}\x00{normalize_query(query)}\x00{bound!r}"
+
+
+def etag_for(key: str) -> str:
+    # The graph is immutable for a given version, so the response is a pure
+    # function of the key and the tag can be handed out before evaluating.
+    return '"' + hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or ("W/" + etag) in tags
+
+
+class ResultCache:
+    """Thread-safe LRU of encoded (content type, body) responses, bounded by count and bytes."""
+
+    def __init__(self, maxsize: int = 512, max_bytes: int = 64 << 20,
+                 max_entry_bytes: int = 4 << 20) -> None:
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, entry: Tuple[str, bytes]) -> bool:
+        size = len(entry[1])
+        if size > self.max_entry_bytes:
+            return False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._entries[key] = entry
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.maxsize or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted[1])
+                self.evictions += 1
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "bytes": self._bytes,
+                "maxsize": self.maxsize,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, Iterable, Iterator, Optional, Set
+
+from rdflib.plugins.sparql import CUSTOM_EVALS
+from rdflib.plugins.sparql.evaluate import evalPart
+from rdflib.plugins.sparql.parserutils import CompValue
+from rdflib.plugins.sparql.sparql import Query
+
+# Cooperative query timeouts.
+#
+# A QueryDeadline is the evaluation-time budget of one query. Only time
+# spent inside ``with deadline:`` sections counts (evaluate() itself and
+# pulling each solution, see ``iterate``), so parsing, serialization and a
+# slow client don't use it up. The budget is checked, and QueryTimeout
+# raised, only at fixed points in the query's own thread: between the
+# solutions handed to the serializer and, because ORDER BY, GROUP BY and
+# DISTINCT read their whole input before producing anything, inside the
+# query as well. ``guard`` wraps every basic graph pattern of a query in a
+# DeadlineCheck node that checks the evaluating thread's deadline each time
+# the pattern is evaluated and for each solution it produces. Nothing is
+# ever raised into rdflib or a store from outside, so no lock or index is
+# left half-updated.
+#
+# What checks can't bound is a single step that produces no solution for a
+# long time: one pattern scanning many triples for few matches, or a sort
+# of an input already read. In pre-forked worker processes the watchdog
+# below backs the deadlines up: a query still running ``grace`` seconds
+# past its budget ends the worker (and the parent forks a fresh one).
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+_current = threading.local()
+
+
+class QueryDeadline:
+    """Evaluation-time budget of one query (0 or None: unlimited)."""
+
+    def __init__(self, seconds: Optional[float]) -> None:
+        self.budget = seconds or 0.0
+        self.used = 0.0
+        self.armed_at: Optional[float] = None
+        self.expired = False
+        self._outer: Optional[QueryDeadline] = None
+        if self.budget:
+            watchdog.add(self)
+
+    def __enter__(self) -> "QueryDeadline":
+        if self.expired:
+            raise QueryTimeout()
+        self._outer = getattr(_current, "deadline", None)
+        _current.deadline = self
+        self.armed_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        self.used += time.perf_counter() - self.armed_at
+        self.armed_at = None
+        _current.deadline, self._outer = self._outer, None
+        return False
+
+    def check(self) -> None:
+        """Raise QueryTimeout if the budget is used up (called inside a section)."""
+        if self.budget and self.armed_at is not None \
+                and self.used + time.perf_counter() - self.armed_at > self.budget:
+            self.expired = True
+            raise QueryTimeout()
+
+    def overrun(self, now: float) -> float:
+        """Seconds the running section has gone past the budget (0 if none)."""
+        armed_at = self.armed_at
+        if not self.budget or armed_at is None:
+            return 0.0
+        return max(0.0, self.used + now - armed_at - self.budget)
+
+    def iterate(self, iterable: Iterable) -> Iterator:
+        """Yield from ``iterable``, producing each item inside the deadline."""
+        it = iter(iterable)
+        while True:
+            with self:
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                self.check()
+            yield item
+
+    def close(self) -> None:
+        if self.budget:
+            watchdog.discard(self)
+
+
+def current() -> Optional[QueryDeadline]:
+    """The deadline whose section the calling thread is in, if any."""
+    return getattr(_current, "deadline", None)
+
+
+def guard(query: Query) -> Query:
+    """A copy of ``query`` whose basic graph patterns check the current deadline."""
+    return Query(query.prologue, _guard(query.algebra))
+
+
+def _guard(node):
+    if not isinstance(node, CompValue):
+        return node
+    new = CompValue(node.name)
+    new.update(node)
+    for key, value in node.items():
+        if key in ("p", "p1", "p2") and isinstance(value, CompValue):
+            new[key] = _guard(value)
+    if node.name != "BGP":
+        return new
+    wrapper = CompValue("DeadlineCheck", p=new)
+    wrapper["_vars"] = new._vars
+    return wrapper
+
+
+def _eval_check(ctx, part):
+    if part.name != "DeadlineCheck":
+        raise NotImplementedError()
+    return _checked(ctx, part)
+
+
+def _checked(ctx, part):
+    deadline = current()
+    if deadline is None:
+        yield from evalPart(ctx, part.p)
+        return
+    # Also checked before the first solution: inside a join the pattern is
+    # evaluated once per outer solution and may match nothing.
+    deadline.check()
+    for row in evalPart(ctx, part.p):
+        deadline.check()
+        yield row
+
+
+class DeadlineWatchdog:
+    """Calls ``on_overrun(deadline)`` for a deadline overrun by more than ``grace`` seconds.
+
+    Inactive until ``enable``; one daemon thread polls every live deadline.
+    """
+
+    def __init__(self, interval: float = 0.25) -> None:
+        self.interval = interval
+        self.grace = 0.0
+        self.on_overrun: Optional[Callable[[QueryDeadline], None]] = None
+        self._deadlines: Set[QueryDeadline] = set()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def enable(self, grace: float, on_overrun: Callable[[QueryDeadline], None]) -> None:
+        with self._cond:
+            self.grace, self.on_overrun = grace, on_overrun
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="query-deadlines", daemon=True)
+                self._thread.start()
+
+    def add(self, deadline: QueryDeadline) -> None:
+        with self._cond:
+            if self.on_overrun is not None:
+                self._deadlines.add(deadline)
+                self._cond.notify()
+
+    def discard(self, deadline: QueryDeadline) -> None:
+        with self._cond:
+            self._deadlines.discard(deadline)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._deadlines:
+                    self._cond.wait()
+                deadlines = list(self._deadlines)
+            now = time.perf_counter()
+            for deadline in deadlines:
+                if deadline.overrun(now) > self.grace:
+                    self.on_overrun(deadline)
+            time.sleep(self.interval)
+
+
+watchdog = DeadlineWatchdog()
+
+
+def install() -> None:
+    """Register the DeadlineCheck evaluator with rdflib (idempotent)."""
+    CUSTOM_EVALS["query_deadline"] = _eval_check
+
+
+install()
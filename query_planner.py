@@ -0,0 +1,593 @@
+from __future__ import annotations
+
+import threading
+import time
+import weakref
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from rdflib import RDF, BNode, Graph, Literal, URIRef, Variable
+from rdflib.plugins.sparql import CUSTOM_EVALS
+from rdflib.plugins.sparql.evaluate import evalPart
+from rdflib.plugins.sparql.parserutils import CompValue
+from rdflib.plugins.sparql.sparql import Query
+
+from movie_view import MC
+from text_index import TEXT_MATCH
+
+# Statistics-driven rewriting of SPARQL algebra before evaluation.
+#
+# rdflib evaluates a basic graph pattern in the order its own reorderTriples
+# leaves it (most constants first, no cardinalities) and applies a group's
+# FILTER only after every OPTIONAL of the group has been joined. For the UI's
+# movie queries that means a scan of all ~1k movies, six OPTIONAL lookups per
+# movie, and only then FILTER(CONTAINS(LCASE(?title), "lorax")).
+#
+# GraphStats records, once per graph load, the triple count and the distinct
+# subjects/objects of each predicate and the size of each class. QueryPlanner
+# uses them to
+#
+#   - split a FILTER into its && conjuncts and push each one down to the
+#     lowest node that certainly binds all its variables: below OPTIONALs
+#     (into the left side of a LeftJoin), into either side of a Join, and
+#     into a BGP, which is cut right after the patterns that bind the filter's
+#     variables and lazily joined with the rest;
+#   - order each BGP greedily by estimated rows, given the variables already
+#     bound by the enclosing plan and the selectivity of pushed filters.
+#
+# The rewritten algebra is a new tree (the cached prepared query is never
+# modified). ``explain`` reports the chosen plan with estimated and, when
+# the query is run, actual rows per node.
+
+# Predicates whose fan-out is reported separately in the statistics.
+FANOUT_PREDICATES = (MC.hasActor, MC.hasDirector)
+
+# Fraction of rows assumed to pass a FILTER conjunct.
+FILTER_SELECTIVITY = 0.1
+# Rows assumed for a text-index probe (mc:textMatch), which has no triples of its own.
+TEXT_MATCH_ROWS = 10.0
+
+# Operators that produce a stream of solutions and can be wrapped by the EXPLAIN probe.
+_PATTERN_OPS = {"BGP", "Filter", "Join", "LeftJoin", "Union", "Minus", "Extend", "Graph"}
+
+
+class PredicateStats:
+    __slots__ = ("count", "subjects", "objects")
+
+    def __init__(self, count: int, subjects: int, objects: int) -> None:
+        self.count = count
+        self.subjects = subjects
+        self.objects = objects
+
+    def to_json(self) -> dict:
+        return {
+            "triples": self.count,
+            "subjects": self.subjects,
+            "objects": self.objects,
+            "per_subject": round(self.count / self.subjects, 2) if self.subjects else 0.0,
+            "per_object": round(self.count / self.objects, 2) if self.objects else 0.0,
+        }
+
+
+class GraphStats:
+    """Cardinalities collected in one pass over a graph."""
+
+    def __init__(self) -> None:
+        self.triples = 0
+        self.subjects = 0
+        self.objects = 0
+        self.predicates: Dict[object, PredicateStats] = {}
+        self.classes: Dict[object, int] = {}
+        self.build_seconds = 0.0
+
+    @classmethod
+    def build(cls, graph: Graph) -> "GraphStats":
+        start = time.perf_counter()
+        stats = cls()
+        subjects: Dict[object, Set[object]] = defaultdict(set)
+        objects: Dict[object, Set[object]] = defaultdict(set)
+        counts: Dict[object, int] = defaultdict(int)
+        classes: Dict[object, int] = defaultdict(int)
+        all_subjects: Set[object] = set()
+        all_objects: Set[object] = set()
+        for s, p, o in graph:
+            counts[p] += 1
+            subjects[p].add(s)
+            objects[p].add(o)
+            all_subjects.add(s)
+            all_objects.add(o)
+            if p == RDF.type:
+                classes[o] += 1
+        stats.triples = sum(counts.values())
+        stats.subjects = len(all_subjects)
+        stats.objects = len(all_objects)
+        stats.predicates = {p: PredicateStats(n, len(subjects[p]), len(objects[p])) for p, n in counts.items()}
+        stats.classes = dict(classes)
+        stats.build_seconds = time.perf_counter() - start
+        return stats
+
+    def fan_out(self, predicate) -> dict:
+        ps = self.predicates.get(predicate)
+        return ps.to_json() if ps is not None else PredicateStats(0, 0, 0).to_json()
+
+    def estimate(self, triple, bound: Set[object]) -> float:
+        """Estimated matches of one triple pattern when the variables in ``bound`` are bound."""
+        s, p, o = triple
+        bs, bp, bo = (not _is_var(t) or t in bound for t in triple)
+        if not bp:
+            n = float(self.triples)
+            if bs and bo:
+                return min(1.0, n / max(1, self.subjects * self.objects))
+            if bs:
+                return n / max(1, self.subjects)
+            if bo:
+                return n / max(1, self.objects)
+            return n
+        if _is_var(p):
+            # Bound by an earlier pattern: some predicate, no idea which.
+            n = self.triples / max(1, len(self.predicates))
+            return n / max(1, self.subjects) if bs else n
+        if p == TEXT_MATCH:
+            return 1.0 if bs else TEXT_MATCH_ROWS
+        ps = self.predicates.get(p)
+        if ps is None:
+            return 0.0
+        if p == RDF.type and not _is_var(o):
+            members = self.classes.get(o, 0)
+            return members / max(1, ps.subjects) if bs else float(members)
+        if bs and bo:
+            return min(1.0, ps.count / max(1, ps.subjects * ps.objects))
+        if bs:
+            return ps.count / ps.subjects
+        if bo:
+            return ps.count / ps.objects
+        return float(ps.count)
+
+    def to_json(self) -> dict:
+        top = sorted(self.predicates.items(), key=lambda item: -item[1].count)[:10]
+        return {
+            "triples": self.triples,
+            "subjects": self.subjects,
+            "objects": self.objects,
+            "predicates": len(self.predicates),
+            "classes": len(self.classes),
+            "fan_out": {_local(p): self.fan_out(p) for p in FANOUT_PREDICATES},
+            "top_predicates": {_local(p): ps.to_json() for p, ps in top},
+            "build_ms": round(self.build_seconds * 1000.0, 1),
+        }
+
+
+def _is_var(term) -> bool:
+    return isinstance(term, (Variable, BNode))
+
+
+def _local(term) -> str:
+    value = str(term)
+    return value[max(value.rfind("/"), value.rfind("#")) + 1:]
+
+
+def _pattern_vars(triples: Iterable) -> Set[object]:
+    return {t for triple in triples for t in triple if _is_var(t)}
+
+
+def expr_vars(expr) -> Set[Variable]:
+    """Every variable mentioned anywhere in an expression tree (EXISTS patterns included)."""
+    found: Set[Variable] = set()
+    stack = [expr]
+    while stack:
+        x = stack.pop()
+        if isinstance(x, Variable):
+            found.add(x)
+        elif isinstance(x, CompValue):
+            stack.extend(v for k, v in x.items() if k != "_vars")
+        elif isinstance(x, (list, tuple)):
+            stack.extend(x)
+    return found
+
+
+def certain_vars(node) -> Set[object]:
+    """Variables bound in every solution of ``node``."""
+    if not isinstance(node, CompValue):
+        return set()
+    name = node.name
+    if name == "BGP":
+        return _pattern_vars(node.triples)
+    if name == "Join":
+        return certain_vars(node.p1) | certain_vars(node.p2)
+    if name in ("LeftJoin", "Minus"):
+        return certain_vars(node.p1)
+    if name in ("Filter", "Extend", "Graph"):
+        return certain_vars(node.p)
+    if name == "Union":
+        return certain_vars(node.p1) & certain_vars(node.p2)
+    return set()
+
+
+def _conjuncts(expr) -> List[object]:
+    if isinstance(expr, CompValue) and expr.name == "ConditionalAndExpression":
+        return [expr.expr] + list(expr.other or [])
+    return [expr]
+
+
+def _copy(node: CompValue) -> CompValue:
+    new = CompValue(node.name)
+    new.update(node)
+    return new
+
+
+def _bgp(triples: Sequence) -> CompValue:
+    node = CompValue("BGP", triples=list(triples))
+    node["_vars"] = _pattern_vars(triples)
+    return node
+
+
+def _join(p1: CompValue, p2: CompValue) -> CompValue:
+    node = CompValue("Join", p1=p1, p2=p2, lazy=True)
+    node["_vars"] = set(p1._vars or ()) | set(p2._vars or ())
+    return node
+
+
+def _filter(p: CompValue, expr, template: CompValue) -> CompValue:
+    node = CompValue("Filter", p=p, expr=expr)
+    # evalFilter hides bindings made outside the filter except these.
+    node["_vars"] = set(template._vars or ()) | set(p._vars or ())
+    if template.no_isolated_scope:
+        node["no_isolated_scope"] = template.no_isolated_scope
+    return node
+
+
+class _Conjunct:
+    __slots__ = ("expr", "vars", "template")
+
+    def __init__(self, expr, template: CompValue) -> None:
+        self.expr = expr
+        self.vars = expr_vars(expr)
+        self.template = template
+
+
+class QueryPlanner:
+    """Rewrites prepared queries using one graph's statistics; results are memoized per query."""
+
+    def __init__(self, stats: GraphStats) -> None:
+        self.stats = stats
+        # prepared query -> {names bound up front -> rewritten query}
+        self._plans: "weakref.WeakKeyDictionary[Query, Dict[frozenset, Query]]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.rewrites = 0
+
+    def optimize(self, prepared: Query, bound: Iterable[str] = ()) -> Query:
+        """The rewritten form of ``prepared``; ``bound`` names the variables given as initBindings."""
+        bound = frozenset(Variable(v) for v in bound)
+        with self._lock:
+            plan = self._plans.get(prepared, {}).get(bound)
+        if plan is not None:
+            return plan
+        plan = Query(prepared.prologue, self.rewrite(prepared.algebra, set(bound)))
+        with self._lock:
+            self._plans.setdefault(prepared, {})[bound] = plan
+            self.rewrites += 1
+        return plan
+
+    # --- rewriting ---
+
+    def rewrite(self, node, bound: Set[object]):
+        """A rewritten copy of ``node`` when evaluated with ``bound`` already bound."""
+        if not isinstance(node, CompValue):
+            return node
+        name = node.name
+        if name == "Filter":
+            conjuncts = [_Conjunct(c, node) for c in _conjuncts(node.expr)]
+            return self._push(node.p, conjuncts, bound)
+        if name == "BGP":
+            return self._plan_bgp(node.triples, [], bound)
+        new = _copy(node)
+        if name == "LeftJoin" or (name == "Join" and node.lazy):
+            new["p1"] = self.rewrite(node.p1, bound)
+            new["p2"] = self.rewrite(node.p2, bound | certain_vars(node.p1))
+            return new
+        for key, value in node.items():
+            if key in ("p", "p1", "p2") and isinstance(value, CompValue):
+                new[key] = self.rewrite(value, bound)
+        return new
+
+    def _push(self, node, conjuncts: List[_Conjunct], bound: Set[object]):
+        """Rewrite ``node`` with ``conjuncts`` applied as low as their variables allow."""
+        if not isinstance(node, CompValue):
+            return self._wrap(node, conjuncts)
+        name = node.name
+        certain = certain_vars(node) | bound
+        local = [c for c in conjuncts if c.vars and c.vars <= certain]
+        rest = [c for c in conjuncts if c not in local]
+        if not local:
+            return self._wrap(self.rewrite(node, bound), rest)
+
+        if name == "BGP":
+            return self._wrap(self._plan_bgp(node.triples, local, bound), rest)
+        if name == "Filter":
+            inner = [_Conjunct(c, node) for c in _conjuncts(node.expr)]
+            return self._wrap(self._push(node.p, inner + local, bound), rest)
+        if name in ("LeftJoin", "Minus"):
+            new = _copy(node)
+            new["p1"] = self._push(node.p1, local, bound)
+            p2_bound = bound | certain_vars(node.p1) if name == "LeftJoin" else bound
+            new["p2"] = self.rewrite(node.p2, p2_bound)
+            return self._wrap(new, rest)
+        if name == "Join":
+            left_vars = certain_vars(node.p1)
+            to_left = [c for c in local if c.vars <= left_vars | bound]
+            to_right = [c for c in local if c not in to_left and c.vars <= certain_vars(node.p2) | bound]
+            new = _copy(node)
+            new["p1"] = self._push(node.p1, to_left, bound)
+            right_bound = bound | left_vars if node.lazy else bound
+            new["p2"] = self._push(node.p2, to_right, right_bound)
+            leftover = [c for c in local if c not in to_left and c not in to_right]
+            return self._wrap(new, leftover + rest)
+        if name == "Extend":
+            inner = [c for c in local if node.var not in c.vars]
+            new = _copy(node)
+            new["p"] = self._push(node.p, inner, bound)
+            return self._wrap(new, [c for c in local if c not in inner] + rest)
+        return self._wrap(self.rewrite(node, bound), conjuncts)
+
+    @staticmethod
+    def _wrap(node, conjuncts: List[_Conjunct]):
+        for c in conjuncts:
+            node = _filter(node, c.expr, c.template)
+        return node
+
+    def order_bgp(self, triples: Sequence, bound: Set[object],
+                  filters: Sequence[_Conjunct] = ()) -> Tuple[list, float]:
+        """Greedy join order for a BGP; returns (ordered triples, estimated rows)."""
+        remaining = list(triples)
+        ordered = []
+        bound = set(bound)
+        pending = list(filters)
+        rows = 1.0
+        while remaining:
+            # Stay connected: only patterns sharing a variable with what is
+            # bound (or with no variables) unless there are none.
+            connected = [t for t in remaining
+                         if not _pattern_vars([t]) or _pattern_vars([t]) & bound] or remaining
+            best = None
+            for t in connected:
+                after = bound | _pattern_vars([t])
+                est = rows * self.stats.estimate(t, bound)
+                for c in pending:
+                    if c.vars <= after and not c.vars <= bound:
+                        est *= FILTER_SELECTIVITY
+                key = (est, len(_pattern_vars([t]) - bound))
+                if best is None or key < best[0]:
+                    best = (key, t, est)
+            _, t, rows = best
+            remaining.remove(t)
+            ordered.append(t)
+            bound |= _pattern_vars([t])
+            pending = [c for c in pending if not c.vars <= bound]
+        return ordered, rows
+
+    def _plan_bgp(self, triples: Sequence, conjuncts: List[_Conjunct], bound: Set[object]):
+        ordered, _ = self.order_bgp(triples, bound, conjuncts)
+        if not conjuncts:
+            return _bgp(ordered)
+        # Cut the BGP after each pattern that completes a filter's variables.
+        node = None
+        segment: list = []
+        seen = set(bound)
+        pending = list(conjuncts)
+        for t in ordered:
+            segment.append(t)
+            seen |= _pattern_vars([t])
+            ready = [c for c in pending if c.vars <= seen]
+            if not ready:
+                continue
+            part = _bgp(segment)
+            node = part if node is None else _join(node, part)
+            for c in ready:
+                node = _filter(node, c.expr, c.template)
+            pending = [c for c in pending if c not in ready]
+            segment = []
+        if segment or node is None:
+            part = _bgp(segment)
+            node = part if node is None else _join(node, part)
+        return self._wrap(node, pending)
+
+    # --- estimates ---
+
+    def estimate(self, node, bound: Set[object]) -> Optional[float]:
+        """Estimated solutions of one evaluation of ``node`` with ``bound`` bound."""
+        if not isinstance(node, CompValue):
+            return None
+        name = node.name
+        if name == "BGP":
+            return self.order_bgp(node.triples, bound)[1] if node.triples else 1.0
+        if name == "Filter":
+            inner = self.estimate(node.p, bound)
+            return None if inner is None else inner * FILTER_SELECTIVITY ** len(_conjuncts(node.expr))
+        if name == "Join":
+            left = self.estimate(node.p1, bound)
+            right = self.estimate(node.p2, bound | certain_vars(node.p1))
+            return None if left is None or right is None else left * right
+        if name == "LeftJoin":
+            left = self.estimate(node.p1, bound)
+            right = self.estimate(node.p2, bound | certain_vars(node.p1))
+            return None if left is None else left * max(1.0, right or 0.0)
+        if name == "Union":
+            a, b = self.estimate(node.p1, bound), self.estimate(node.p2, bound)
+            return None if a is None or b is None else a + b
+        if name == "Slice":
+            inner = self.estimate(node.p, bound)
+            if inner is None or node.length is None:
+                return inner
+            return min(inner, float(node.length))
+        if isinstance(node.p, CompValue):
+            return self.estimate(node.p, bound)
+        return None
+
+    def stats_json(self) -> dict:
+        return {**self.stats.to_json(), "rewrites": self.rewrites}
+
+
+# --- EXPLAIN ---
+
+class _Probe:
+    __slots__ = ("rows", "calls", "seconds")
+
+    def __init__(self) -> None:
+        self.rows = 0
+        self.calls = 0
+        self.seconds = 0.0
+
+
+def _eval_probe(ctx, part):
+    if part.name != "PlanProbe":
+        raise NotImplementedError()
+    return _count(ctx, part)
+
+
+def _count(ctx, part):
+    probe = part.probe
+    probe.calls += 1
+    clock = time.perf_counter
+    start = clock()
+    it = iter(evalPart(ctx, part.p))
+    probe.seconds += clock() - start
+    while True:
+        start = clock()
+        try:
+            row = next(it)
+        except StopIteration:
+            probe.seconds += clock() - start
+            return
+        probe.seconds += clock() - start
+        probe.rows += 1
+        yield row
+
+
+def _instrument(node, probes: Dict[int, _Probe]):
+    """A copy of ``node`` with every pattern operator wrapped in a counting PlanProbe."""
+    if not isinstance(node, CompValue):
+        return node
+    new = _copy(node)
+    for key, value in node.items():
+        if key in ("p", "p1", "p2") and isinstance(value, CompValue):
+            new[key] = _instrument(value, probes)
+    if node.name not in _PATTERN_OPS:
+        return new
+    probe = _Probe()
+    wrapper = CompValue("PlanProbe", p=new, probe=probe)
+    wrapper["_vars"] = new._vars
+    probes[id(node)] = probe
+    return wrapper
+
+
+def describe_triple(triple, namespace_manager=None) -> str:
+    parts = []
+    for term in triple:
+        if isinstance(term, Variable):
+            parts.append("?" + term)
+        elif isinstance(term, URIRef) and namespace_manager is not None:
+            parts.append(term.n3(namespace_manager))
+        elif isinstance(term, (URIRef, Literal, BNode)):
+            parts.append(term.n3())
+        else:
+            parts.append(str(term))
+    return " ".join(parts)
+
+
+def describe_expr(expr, namespace_manager=None) -> str:
+    if isinstance(expr, Variable):
+        return "?" + expr
+    if isinstance(expr, (URIRef, Literal)):
+        return expr.n3(namespace_manager) if isinstance(expr, URIRef) and namespace_manager else expr.n3()
+    if isinstance(expr, CompValue):
+        name = expr.name
+        if name.startswith("Builtin_"):
+            args = [v for k, v in expr.items() if k not in ("_vars",) and not k.startswith("_")]
+            return f"{name[8:]}({', '.join(describe_expr(a, namespace_manager) for a in args)})"
+        if name == "RelationalExpression":
+            return f"{describe_expr(expr.expr, namespace_manager)} {expr.op} {describe_expr(expr.other, namespace_manager)}"
+        if name in ("ConditionalAndExpression", "ConditionalOrExpression"):
+            op = " && " if name.startswith("ConditionalAnd") else " || "
+            return "(" + op.join(describe_expr(e, namespace_manager) for e in [expr.expr] + list(expr.other or [])) + ")"
+        if name == "UnaryNot":
+            return "!" + describe_expr(expr.expr, namespace_manager)
+        if name == "Function":
+            args = ", ".join(describe_expr(a, namespace_manager) for a in expr.expr or [])
+            return f"{describe_expr(expr.iri, namespace_manager)}({args})"
+        return name
+    if isinstance(expr, (list, tuple)):
+        return ", ".join(describe_expr(e, namespace_manager) for e in expr)
+    return str(expr)
+
+
+def plan_tree(planner: QueryPlanner, node, bound: Set[object], probes=None, nsm=None):
+    """JSON description of a plan: operator, details, estimated rows, and probe counts if run."""
+    if not isinstance(node, CompValue):
+        return None
+    name = node.name
+    out: dict = {"op": name}
+    if name == "BGP":
+        out["patterns"] = [describe_triple(t, nsm) for t in node.triples]
+    elif name == "Filter" or (name == "LeftJoin" and node.expr.name != "TrueFilter"):
+        out["expr"] = describe_expr(node.expr, nsm)
+    elif name == "Extend":
+        out["bind"] = "?" + node.var
+    elif name == "Slice":
+        out["offset"], out["limit"] = node.start, node.length
+    elif name == "Join":
+        out["lazy"] = bool(node.lazy)
+    est = planner.estimate(node, bound)
+    if est is not None:
+        out["estimated_rows"] = round(est, 2)
+    if probes is not None and id(node) in probes:
+        probe = probes[id(node)]
+        out["actual_rows"] = probe.rows
+        out["calls"] = probe.calls
+        if probe.calls:
+            out["rows_per_call"] = round(probe.rows / probe.calls, 2)
+        out["ms"] = round(probe.seconds * 1000.0, 2)
+    children = []
+    if name == "LeftJoin" or (name == "Join" and node.lazy):
+        children = [plan_tree(planner, node.p1, bound, probes, nsm),
+                    plan_tree(planner, node.p2, bound | certain_vars(node.p1), probes, nsm)]
+    else:
+        for key in ("p", "p1", "p2"):
+            if isinstance(node.get(key), CompValue):
+                children.append(plan_tree(planner, node[key], bound, probes, nsm))
+    if children:
+        out["children"] = children
+    return out
+
+
+def explain(planner: QueryPlanner, graph: Graph, prepared: Query, bound: Iterable[str] = (),
+            rewrite: bool = True, analyze: bool = True, run=None) -> dict:
+    """EXPLAIN [ANALYZE] for a prepared query.
+
+    With ``analyze`` the (rewritten) plan is evaluated once with every
+    pattern operator counted; ``run(query)`` must evaluate a Query and return
+    the number of result rows (the caller decides timeouts and serialization).
+    """
+    plan = planner.optimize(prepared, bound) if rewrite else prepared
+    bound = {Variable(v) for v in bound}
+    nsm = graph.namespace_manager
+    out: dict = {"rewritten": rewrite}
+    if rewrite:
+        out["original"] = plan_tree(planner, prepared.algebra, bound, None, nsm)
+    if not analyze:
+        out["plan"] = plan_tree(planner, plan.algebra, bound, None, nsm)
+        return out
+    probes: Dict[int, _Probe] = {}
+    instrumented = Query(plan.prologue, _instrument(plan.algebra, probes))
+    start = time.perf_counter()
+    out["actual_rows"] = run(instrumented)
+    out["ms"] = round((time.perf_counter() - start) * 1000.0, 2)
+    out["plan"] = plan_tree(planner, plan.algebra, bound, probes, nsm)
+    return out
+
+
+def install() -> None:
+    """Register the EXPLAIN probe evaluator with rdflib (idempotent)."""
+    CUSTOM_EVALS["query_planner_probe"] = _eval_probe
+
+
+install()
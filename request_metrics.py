@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+
+# Request instrumentation for the SPARQL server.
+#
+# RequestTimer collects per-phase wall time for one request (parse/plan,
+# evaluation, serialization, socket writes) plus bytes written; Metrics
+# aggregates finished requests into Prometheus counters and histograms; and
+# SlowQueryLog appends an entry for every query over its threshold, optionally
+# with a cProfile capture of that query.
+#
+# Metrics live in process memory: with --processes N each pre-forked worker
+# reports only the requests it served itself.
+
+# Upper bounds (seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PHASES = ("parse", "eval", "serialize", "write")
+
+
+class RequestTimer:
+    """Wall-clock time per phase of a single request."""
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.bytes = 0
+        self.rows: Optional[int] = None
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def timed(self, phase: str, fn: Callable, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def iterate(self, phase: str, iterable: Iterable) -> Iterator:
+        """Yield from ``iterable``, charging the time spent producing each item to ``phase``."""
+        it = iter(iterable)
+        add = self.add
+        clock = time.perf_counter
+        while True:
+            start = clock()
+            try:
+                item = next(it)
+            except StopIteration:
+                add(phase, clock() - start)
+                return
+            add(phase, clock() - start)
+            yield item
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def to_dict(self) -> dict:
+        out = {f"{name}_ms": round(seconds * 1000.0, 2) for name, seconds in self.phases.items()}
+        out["bytes"] = self.bytes
+        if self.rows is not None:
+            out["rows"] = self.rows
+        return out
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.n += 1
+
+    def render(self, name: str, labels: str) -> List[str]:
+        sep = "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.n}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {self.n}")
+        return lines
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """Linear-interpolated percentile of an ascending sequence."""
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metrics:
+    """Thread-safe request counters and latency histograms, rendered as Prometheus text."""
+
+    def __init__(self, prefix: str = "sparql_server") -> None:
+        self.prefix = prefix
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self.requests: Dict[Tuple[str, str, int], int] = defaultdict(int)
+        self.latency: Dict[str, Histogram] = {}
+        self.phase_latency: Dict[Tuple[str, str], Histogram] = {}
+        self.bytes_sent: Dict[str, int] = defaultdict(int)
+        self.rows: Dict[str, int] = defaultdict(int)
+        self.slow_queries = 0
+        self.timeouts = 0
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+    def gauge(self, name: str, help_text: str, fn: Callable[[], float]) -> None:
+        """Register a value sampled at scrape time (graph size, cache sizes, ...)."""
+        self._gauges[name] = (help_text, fn)
+
+    def observe(self, endpoint: str, method: str, status: int, timer: RequestTimer) -> None:
+        elapsed = timer.elapsed()
+        with self._lock:
+            self.requests[(endpoint, method, status)] += 1
+            hist = self.latency.get(endpoint)
+            if hist is None:
+                hist = self.latency[endpoint] = Histogram()
+            hist.observe(elapsed)
+            for phase, seconds in timer.phases.items():
+                key = (endpoint, phase)
+                hist = self.phase_latency.get(key)
+                if hist is None:
+                    hist = self.phase_latency[key] = Histogram()
+                hist.observe(seconds)
+            self.bytes_sent[endpoint] += timer.bytes
+            if timer.rows:
+                self.rows[endpoint] += timer.rows
+
+    def count_slow_query(self) -> None:
+        with self._lock:
+            self.slow_queries += 1
+
+    def count_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def render(self) -> str:
+        p = self.prefix
+        out: List[str] = []
+        with self._lock:
+            out.append(f"# HELP {p}_requests_total HTTP requests served, by endpoint, method and status.")
+            out.append(f"# TYPE {p}_requests_total counter")
+            for (endpoint, method, status), n in sorted(self.requests.items()):
+                out.append(f'{p}_requests_total{{endpoint="{_escape(endpoint)}",method="{method}",'
+                           f'code="{status}"}} {n}')
+
+            out.append(f"# HELP {p}_request_duration_seconds Request latency, by endpoint.")
+            out.append(f"# TYPE {p}_request_duration_seconds histogram")
+            for endpoint, hist in sorted(self.latency.items()):
+                out.extend(hist.render(f"{p}_request_duration_seconds", f'endpoint="{_escape(endpoint)}"'))
+
+            out.append(f"# HELP {p}_phase_duration_seconds Time per request phase (parse, eval, serialize, write).")
+            out.append(f"# TYPE {p}_phase_duration_seconds histogram")
+            for (endpoint, phase), hist in sorted(self.phase_latency.items()):
+                out.extend(hist.render(f"{p}_phase_duration_seconds",
+                                       f'endpoint="{_escape(endpoint)}",phase="{phase}"'))
+
+            out.append(f"# HELP {p}_response_bytes_total Response body bytes written, by endpoint.")
+            out.append(f"# TYPE {p}_response_bytes_total counter")
+            for endpoint, n in sorted(self.bytes_sent.items()):
+                out.append(f'{p}_response_bytes_total{{endpoint="{_escape(endpoint)}"}} {n}')
+
+            out.append(f"# HELP {p}_result_rows_total Result rows streamed, by endpoint.")
+            out.append(f"# TYPE {p}_result_rows_total counter")
+            for endpoint, n in sorted(self.rows.items()):
+                out.append(f'{p}_result_rows_total{{endpoint="{_escape(endpoint)}"}} {n}')
+
+            out.append(f"# HELP {p}_slow_queries_total Queries over the slow-query threshold.")
+            out.append(f"# TYPE {p}_slow_queries_total counter")
+            out.append(f"{p}_slow_queries_total {self.slow_queries}")
+            out.append(f"# HELP {p}_query_timeouts_total Queries cancelled by the query timeout.")
+            out.append(f"# TYPE {p}_query_timeouts_total counter")
+            out.append(f"{p}_query_timeouts_total {self.timeouts}")
+
+        out.append(f"# HELP {p}_uptime_seconds Seconds since this process started serving.")
+        out.append(f"# TYPE {p}_uptime_seconds gauge")
+        out.append(f"{p}_uptime_seconds {time.time() - self.started:.1f}")
+        for name, (help_text, fn) in sorted(self._gauges.items()):
+            try:
+                value = fn()
+            except Exception:
+                continue
+            out.append(f"# HELP {p}_{name} {help_text}")
+            out.append(f"# TYPE {p}_{name} gauge")
+            out.append(f"{p}_{name} {value}")
+        return "\n".join(out) + "\n"
+
+
+class SlowQueryLog:
+    """JSON-lines log of queries slower than ``threshold`` seconds.
+
+    With ``profile_dir`` set, the first time a given query is logged it is run
+    once more under cProfile (``run_profiled``) and the ``.prof`` file plus the
+    top functions by cumulative time are saved next to the log entry. Each
+    distinct query is profiled at most once per process.
+    """
+
+    def __init__(self, threshold: float, path: Optional[str] = None,
+                 profile_dir: Optional[str] = None, profile_limit: int = 100) -> None:
+        self.threshold = threshold
+        self.path = path
+        self.profile_dir = profile_dir
+        self.profile_limit = profile_limit
+        self._profiled: set = set()
+        self._lock = threading.Lock()
+
+    def is_slow(self, seconds: float) -> bool:
+        return self.threshold is not None and self.threshold >= 0 and seconds >= self.threshold
+
+    def record(self, entry: dict) -> None:
+        line = json.dumps(entry, ensure_ascii=False)
+        if not self.path or self.path == "-":
+            print(f"⚠ slow query {line}")
+            return
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def should_profile(self, key: str) -> bool:
+        if not self.profile_dir:
+            return False
+        with self._lock:
+            if key in self._profiled or len(self._profiled) >= self.profile_limit:
+                return False
+            self._profiled.add(key)
+            return True
+
+    def forget_profile(self, key: str) -> None:
+        """Undo ``should_profile`` for ``key`` (its profile run was dropped)."""
+        with self._lock:
+            self._profiled.discard(key)
+
+    def run_profiled(self, key: str, fn: Callable[[], object], description: str = "") -> Optional[str]:
+        """Run ``fn`` under cProfile and save the profile; returns the .prof path.
+
+        ``description`` (typically the query text) heads the ``.txt`` summary.
+        """
+        os.makedirs(self.profile_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        base = os.path.join(self.profile_dir, f"slow-{stamp}-{abs(hash(key)) % 10**8:08d}")
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            fn()
+        finally:
+            profiler.disable()
+        profiler.dump_stats(base + ".prof")
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(25)
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write((description or key) + "\n\n" + text.getvalue())
+        return base + ".prof"
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import os
+import secrets
+import tempfile
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Server-side cursors over SELECT results.
+#
+# Paging with LIMIT/OFFSET re-evaluates the whole query for every page. In
+# cursor mode the server evaluates a query once, keeps its rows -- already
+# encoded as SPARQL JSON binding objects -- in a ResultBuffer, and serves
+# pages of it by token. A buffer is a byte blob plus an offsets array, so
+# it costs about the size of the JSON it will send. Once the buffers
+# together exceed the memory budget, the least recently used ones are
+# spilled to an anonymous temporary file (gone when closed, or when the
+# process dies) and paged back from it. A buffer that has not been read for
+# ``ttl`` seconds is dropped.
+#
+# Pages come from a frozen snapshot of the result: a graph reload or update
+# after the first page doesn't shift later pages. A buffer created with a
+# result key (graph version + query + bindings) is found again by that key
+# while it lives, so re-running the same query pages the existing buffer
+# instead of evaluating into a new one.
+
+_TOKEN_SEP = "-"
+
+
+class ResultBuffer:
+    """Append-only sequence of encoded rows, in memory or spilled to a file."""
+
+    def __init__(self, buffer_id: str, variables: Sequence[str], key: Optional[str] = None) -> None:
+        self.id = buffer_id
+        self.vars = list(variables)
+        self.key = key
+        self.offsets = array("Q", [0])
+        self.created = self.last_used = time.monotonic()
+        self._data = bytearray()
+        self._file = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets[-1]
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self._data) + self.offsets.itemsize * len(self.offsets)
+
+    @property
+    def spilled(self) -> bool:
+        return self._file is not None
+
+    def append(self, row: bytes) -> None:
+        with self._lock:
+            if self._file is None:
+                self._data += row
+            else:
+                self._file.seek(0, os.SEEK_END)
+                self._file.write(row)
+            self.offsets.append(self.offsets[-1] + len(row))
+
+    def spill(self, directory: Optional[str] = None) -> None:
+        """Move the row bytes to a temporary file (idempotent)."""
+        with self._lock:
+            if self._file is not None:
+                return
+            f = tempfile.TemporaryFile(prefix=f"cursor-{self.id}-", suffix=".rows", dir=directory)
+            try:
+                f.write(self._data)
+            except OSError:
+                f.close()
+                raise
+            self._file = f
+            self._data = bytearray()
+
+    def rows(self, start: int, count: int) -> List[bytes]:
+        start = max(0, start)
+        stop = min(len(self), start + max(0, count))
+        if start >= stop:
+            return []
+        offsets = self.offsets
+        with self._lock:
+            lo, hi = offsets[start], offsets[stop]
+            if self._file is None:
+                blob = bytes(self._data[lo:hi])
+            else:
+                self._file.seek(lo)
+                blob = self._file.read(hi - lo)
+        return [blob[offsets[i] - lo:offsets[i + 1] - lo] for i in range(start, stop)]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._data = bytearray()
+
+
+class CursorStore:
+    """Live ResultBuffers with a sliding TTL and a shared in-memory byte budget."""
+
+    def __init__(self, ttl: float = 300.0, memory_budget: int = 64 << 20,
+                 spill_dir: Optional[str] = None, max_cursors: int = 256) -> None:
+        self.ttl = ttl
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.max_cursors = max_cursors
+        self._buffers: "OrderedDict[str, ResultBuffer]" = OrderedDict()
+        self._by_key: Dict[str, ResultBuffer] = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.expired = 0
+        self.spills = 0
+
+    def create(self, variables: Sequence[str], rows: Iterable[bytes],
+               key: Optional[str] = None) -> ResultBuffer:
+        """Buffer every row of ``rows`` and register the result under a fresh id (and ``key``)."""
+        buffer = ResultBuffer(secrets.token_hex(8), variables, key)
+        try:
+            for row in rows:
+                buffer.append(row)
+                # A single result larger than the whole budget goes to disk as it grows.
+                if not buffer.spilled and buffer.memory_bytes > self.memory_budget:
+                    buffer.spill(self.spill_dir)
+                    self._count_spill()
+        except BaseException:
+            buffer.close()
+            raise
+        with self._lock:
+            self._buffers[buffer.id] = buffer
+            if key is not None:
+                self._by_key[key] = buffer
+            self.created += 1
+            doomed = self._expire_locked()
+            while len(self._buffers) > self.max_cursors:
+                doomed.append(self._drop_locked(next(iter(self._buffers))))
+            to_spill = self._over_budget_locked()
+        for old in doomed:
+            old.close()
+        for victim in to_spill:
+            victim.spill(self.spill_dir)
+            self._count_spill()
+        return buffer
+
+    def get(self, buffer_id: str) -> Optional[ResultBuffer]:
+        with self._lock:
+            doomed = self._expire_locked()
+            buffer = self._buffers.get(buffer_id)
+            if buffer is not None:
+                buffer.last_used = time.monotonic()
+                self._buffers.move_to_end(buffer_id)
+        for old in doomed:
+            old.close()
+        return buffer
+
+    def find(self, key: str) -> Optional[ResultBuffer]:
+        """The live buffer created under ``key``, if any (counts as a use)."""
+        with self._lock:
+            buffer = self._by_key.get(key)
+        buffer = self.get(buffer.id) if buffer is not None else None
+        if buffer is not None:
+            with self._lock:
+                self.reused += 1
+        return buffer
+
+    def _drop_locked(self, buffer_id: str) -> ResultBuffer:
+        buffer = self._buffers.pop(buffer_id)
+        if buffer.key is not None and self._by_key.get(buffer.key) is buffer:
+            del self._by_key[buffer.key]
+        return buffer
+
+    def _expire_locked(self) -> List[ResultBuffer]:
+        now = time.monotonic()
+        doomed = [self._drop_locked(b.id) for b in list(self._buffers.values())
+                  if now - b.last_used > self.ttl]
+        self.expired += len(doomed)
+        return doomed
+
+    def _over_budget_locked(self) -> List[ResultBuffer]:
+        # Least recently used first; the OrderedDict is kept in use order.
+        total = sum(b.memory_bytes for b in self._buffers.values() if not b.spilled)
+        victims = []
+        for b in self._buffers.values():
+            if total <= self.memory_budget:
+                break
+            if not b.spilled:
+                victims.append(b)
+                total -= b.memory_bytes
+        return victims
+
+    def _count_spill(self) -> None:
+        with self._lock:
+            self.spills += 1
+
+    def close(self) -> None:
+        with self._lock:
+            buffers = list(self._buffers.values())
+            self._buffers.clear()
+            self._by_key.clear()
+        for b in buffers:
+            b.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            buffers = list(self._buffers.values())
+            return {
+                "cursors": len(buffers),
+                "rows": sum(len(b) for b in buffers),
+                "memory_bytes": sum(b.memory_bytes for b in buffers if not b.spilled),
+                "spilled_bytes": sum(b.nbytes for b in buffers if b.spilled),
+                "memory_budget": self.memory_budget,
+                "ttl_s": self.ttl,
+                "created": self.created,
+                "reused": self.reused,
+                "expired": self.expired,
+                "spills": self.spills,
+            }
+
+
+def encode_token(buffer_id: str, offset: int, page_size: int) -> str:
+    return f"{buffer_id}{_TOKEN_SEP}{offset}{_TOKEN_SEP}{page_size}"
+
+
+def decode_token(token: str) -> Tuple[str, int, int]:
+    """(buffer id, offset, page size) from a cursor token; ValueError if malformed."""
+    parts = token.split(_TOKEN_SEP)
+    if len(parts) != 3 or not parts[0]:
+        raise ValueError("malformed cursor token")
+    offset, page_size = int(parts[1]), int(parts[2])
+    if offset < 0 or page_size <= 0:
+        raise ValueError("malformed cursor token")
+    return parts[0], offset, page_size
@@ -0,0 +1,547 @@
+from __future__ import annotations
+
+import io
+import json
+import struct
+import sys
+from array import array
+from json.encoder import encode_basestring
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+from xml.sax.saxutils import escape, quoteattr
+
+from rdflib import BNode, Graph, Literal, URIRef
+from rdflib.plugins.sparql.evaluate import evalQuery
+from rdflib.plugins.sparql.sparql import Query
+
+from compression import parse_qvalues
+
+try:
+    import pyarrow  # optional: pip install pyarrow
+except ImportError:
+    pyarrow = None
+
+
+# Incremental SPARQL result serializers.
+#
+# Graph.query() wraps results in a Result object whose iterator keeps every
+# row it hands out, so the server evaluates through evalQuery() directly and
+# consumes the lazy bindings generator once, encoding each row as it arrives.
+
+JSON_TYPE = "application/sparql-results+json"
+NTRIPLES_TYPE = "application/n-triples"
+CSV_TYPE = "text/csv; charset=utf-8"
+TSV_TYPE = "text/tab-separated-values; charset=utf-8"
+XML_TYPE = "application/sparql-results+xml"
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+COLUMNAR_TYPE = "application/x-sparql-columnar"
+
+# Rows per batch in the columnar formats.
+BATCH_ROWS = 4096
+
+
+def evaluate(graph: Graph, prepared: Query, bindings: Optional[Mapping] = None) -> Mapping[str, Any]:
+    """Evaluate a prepared query without materializing its solutions."""
+    return evalQuery(graph, prepared, initBindings=dict(bindings or {}))
+
+
+def encode_term(value) -> str:
+    """SPARQL 1.1 JSON term object for ``value``, as a JSON string."""
+    if isinstance(value, URIRef):
+        return '{"type":"uri","value":' + encode_basestring(value) + '}'
+    if isinstance(value, Literal):
+        out = '{"type":"literal","value":' + encode_basestring(value)
+        if value.language:
+            out += ',"xml:lang":' + encode_basestring(value.language)
+        elif value.datatype is not None:
+            out += ',"datatype":' + encode_basestring(value.datatype)
+        return out + '}'
+    if isinstance(value, BNode):
+        return '{"type":"bnode","value":' + encode_basestring(value) + '}'
+    # Variables or anything else rdflib might hand back: keep it a literal.
+    return '{"type":"literal","value":' + encode_basestring(str(value)) + '}'
+
+
+class TermEncoder:
+    """Per-response memo of encoded terms.
+
+    Actors, countries and datatypes repeat across thousands of rows; each
+    distinct term is encoded once and its fragment (JSON by default, or
+    whatever ``encode`` produces) reused.
+    """
+
+    def __init__(self, max_entries: int = 100_000, encode: Callable[[object], str] = encode_term) -> None:
+        self.max_entries = max_entries
+        self.encode = encode
+        self.memo: Dict[object, str] = {}
+        self.hits = 0
+
+    def __call__(self, value) -> str:
+        memo = self.memo
+        encoded = memo.get(value)
+        if encoded is not None:
+            self.hits += 1
+            return encoded
+        encoded = self.encode(value)
+        if len(memo) >= self.max_entries:
+            memo.clear()
+        memo[value] = encoded
+        return encoded
+
+
+def json_rows(res: Mapping[str, Any], stats: Optional[dict] = None) -> Iterator[str]:
+    """Yield each SELECT solution of ``res`` as a compact SPARQL JSON binding object."""
+    if stats is None:
+        stats = {}
+    stats["rows"] = 0
+    variables = list(res.get("vars_") or [])
+    keys = [(var, encode_basestring(str(var)) + ":") for var in variables]
+    encode = TermEncoder()
+    rows = 0
+    for row in res["bindings"]:
+        if not row:
+            continue
+        # FrozenBindings.get() goes through several Python-level checks per
+        # lookup; its backing dict answers most of them directly.
+        values = getattr(row, "_d", row)
+        parts = []
+        for var, key in keys:
+            value = values.get(var)
+            if value is None and values is not row:
+                value = row.get(var)  # may still come from initBindings
+            if value is not None:
+                parts.append(key + encode(value))
+        rows += 1
+        stats["rows"] = rows
+        yield "{" + ",".join(parts) + "}"
+
+
+def stream_json(res: Mapping[str, Any], indent: Optional[int] = None,
+                stats: Optional[dict] = None) -> Iterator[str]:
+    """Yield the SPARQL 1.1 JSON results document for ``res`` piece by piece.
+
+    The first piece is the head (no evaluation needed); after that one piece
+    per solution, then the closing brackets. ``stats['rows']`` counts rows.
+    """
+    if stats is None:
+        stats = {}
+    stats["rows"] = 0
+    nl = "\n" if indent else ""
+    pad = " " * indent if indent else ""
+
+    if res["type_"] == "ASK":
+        yield json.dumps({"head": {}, "boolean": bool(res["askAnswer"])}, indent=indent)
+        return
+
+    names = [str(v) for v in res.get("vars_") or []]
+    yield f'{{{nl}{pad}"head": {json.dumps({"vars": names})},{nl}{pad}"results": {{"bindings": [{nl}'
+
+    row_sep = "," + nl + pad + pad
+    lead = pad + pad
+    for row in json_rows(res, stats):
+        yield lead + row
+        lead = row_sep
+
+    yield f"{nl}{pad}]}}{nl}}}{nl}"
+
+
+def json_page(variables: Sequence[str], rows: Sequence[bytes], cursor: Mapping[str, Any]) -> bytes:
+    """A SPARQL JSON results document for already-encoded ``rows``, plus a ``cursor`` member."""
+    head = json.dumps({"vars": list(variables)})
+    return (b'{"head": ' + head.encode("utf-8") + b',"results": {"bindings": ['
+            + b",".join(rows) + b']},"cursor": ' + json.dumps(cursor).encode("utf-8") + b"}")
+
+
+def stream_ntriples(res: Mapping[str, Any], stats: Optional[dict] = None) -> Iterator[str]:
+    if stats is None:
+        stats = {}
+    stats["rows"] = 0
+    for s, p, o in res["graph"]:
+        stats["rows"] += 1
+        yield f"{s.n3()} {p.n3()} {o.n3()} .\n"
+
+
+def _solutions(res: Mapping[str, Any], stats: dict) -> Iterator[List[object]]:
+    """Each non-empty solution of ``res`` as a list of terms (None when unbound), in ``vars_`` order."""
+    stats["rows"] = 0
+    variables = list(res.get("vars_") or [])
+    rows = 0
+    for row in res["bindings"]:
+        if not row:
+            continue
+        values = getattr(row, "_d", row)
+        out = []
+        for var in variables:
+            value = values.get(var)
+            if value is None and values is not row:
+                value = row.get(var)
+            out.append(value)
+        rows += 1
+        stats["rows"] = rows
+        yield out
+
+
+def csv_term(value) -> str:
+    # SPARQL 1.1 CSV: IRIs and literals as plain strings, quoted when needed.
+    text = f"_:{value}" if isinstance(value, BNode) else str(value)
+    if any(c in text for c in ',"\r\n'):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def tsv_term(value) -> str:
+    # SPARQL 1.1 TSV: terms in Turtle syntax; tabs and line breaks escaped.
+    return value.n3().replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def xml_term(value) -> str:
+    if isinstance(value, URIRef):
+        return "<uri>" + escape(value) + "</uri>"
+    if isinstance(value, BNode):
+        return "<bnode>" + escape(value) + "</bnode>"
+    if isinstance(value, Literal):
+        if value.language:
+            return f"<literal xml:lang={quoteattr(value.language)}>{escape(value)}</literal>"
+        if value.datatype is not None:
+            return f"<literal datatype={quoteattr(value.datatype)}>{escape(value)}</literal>"
+        return "<literal>" + escape(value) + "</literal>"
+    return "<literal>" + escape(str(value)) + "</literal>"
+
+
+def stream_csv(res: Mapping[str, Any], stats: Optional[dict] = None, tsv: bool = False) -> Iterator[str]:
+    """SPARQL 1.1 CSV (or, with ``tsv``, TSV) results: a header line, then one line per solution."""
+    if stats is None:
+        stats = {}
+    names = [str(v) for v in res.get("vars_") or []]
+    if tsv:
+        sep, end, encode = "\t", "\n", TermEncoder(encode=tsv_term)
+        yield sep.join("?" + name for name in names) + end
+    else:
+        sep, end, encode = ",", "\r\n", TermEncoder(encode=csv_term)
+        yield sep.join(names) + end
+    for row in _solutions(res, stats):
+        yield sep.join("" if value is None else encode(value) for value in row) + end
+
+
+def stream_xml(res: Mapping[str, Any], stats: Optional[dict] = None) -> Iterator[str]:
+    """SPARQL Query Results XML Format, one <result> element per solution."""
+    if stats is None:
+        stats = {}
+    stats["rows"] = 0
+    head = '<?xml version="1.0"?>\n<sparql xmlns="http://www.w3.org/2005/sparql-results#">\n'
+    if res["type_"] == "ASK":
+        yield head + f"<head/>\n<boolean>{'true' if res['askAnswer'] else 'false'}</boolean>\n</sparql>\n"
+        return
+    names = [str(v) for v in res.get("vars_") or []]
+    opens = [f"<binding name={quoteattr(name)}>" for name in names]
+    yield (head + "<head>" + "".join(f"<variable name={quoteattr(name)}/>" for name in names)
+           + "</head>\n<results>\n")
+    encode = TermEncoder(encode=xml_term)
+    for row in _solutions(res, stats):
+        yield "<result>" + "".join(opens[i] + encode(value) + "</binding>"
+                                   for i, value in enumerate(row) if value is not None) + "</result>\n"
+    yield "</results>\n</sparql>\n"
+
+
+# Columnar binary results (COLUMNAR_TYPE), all integers little-endian:
+#
+#   "SRC1" | u16 variable count | per variable: u16 length, UTF-8 name
+#   then per batch of up to BATCH_ROWS solutions:
+#     "D" | u32 new terms | per term: u8 kind, u32 length, UTF-8 value,
+#                           and for typed/language literals u32 length, UTF-8 datatype/lang
+#     "B" | u32 rows | per variable: rows x u32 term id (0 = unbound)
+#   "E" | u64 total rows
+#
+# Term ids number the terms in order of first appearance, from 1, across the
+# whole response: a "D" frame only carries the terms the next batch introduces.
+COLUMNAR_MAGIC = b"SRC1"
+TERM_URI, TERM_BNODE, TERM_LITERAL, TERM_TYPED, TERM_LANG = range(5)
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+
+
+def _pack_text(text: str) -> bytes:
+    data = text.encode("utf-8")
+    return _U32.pack(len(data)) + data
+
+
+def _pack_term(value) -> bytes:
+    if isinstance(value, URIRef):
+        return bytes((TERM_URI,)) + _pack_text(value)
+    if isinstance(value, BNode):
+        return bytes((TERM_BNODE,)) + _pack_text(value)
+    if isinstance(value, Literal) and value.language:
+        return bytes((TERM_LANG,)) + _pack_text(value) + _pack_text(value.language)
+    if isinstance(value, Literal) and value.datatype is not None:
+        return bytes((TERM_TYPED,)) + _pack_text(value) + _pack_text(value.datatype)
+    return bytes((TERM_LITERAL,)) + _pack_text(str(value))
+
+
+def _ids_bytes(ids: array) -> bytes:
+    if sys.byteorder != "little":
+        ids = array("I", ids)
+        ids.byteswap()
+    return ids.tobytes()
+
+
+def stream_columnar(res: Mapping[str, Any], stats: Optional[dict] = None,
+                    batch_rows: int = BATCH_ROWS) -> Iterator[bytes]:
+    """Dictionary-encoded, column-major results in batches (format above)."""
+    if stats is None:
+        stats = {}
+    names = [str(v) for v in res.get("vars_") or []]
+    header = [COLUMNAR_MAGIC, _U16.pack(len(names))]
+    for name in names:
+        data = name.encode("utf-8")
+        header += [_U16.pack(len(data)), data]
+    yield b"".join(header)
+
+    ids: Dict[object, int] = {}
+    new_terms: List[bytes] = []
+    columns = [array("I") for _ in names]
+    total = 0
+
+    def batch() -> bytes:
+        out = [b"D", _U32.pack(len(new_terms))] + new_terms
+        out += [b"B", _U32.pack(len(columns[0]) if columns else 0)]
+        out += [_ids_bytes(column) for column in columns]
+        new_terms.clear()
+        for column in columns:
+            del column[:]
+        return b"".join(out)
+
+    pending = 0
+    for row in _solutions(res, stats):
+        for column, value in zip(columns, row):
+            if value is None:
+                column.append(0)
+                continue
+            term_id = ids.get(value)
+            if term_id is None:
+                term_id = ids[value] = len(ids) + 1
+                new_terms.append(_pack_term(value))
+            column.append(term_id)
+        pending += 1
+        total += 1
+        if pending >= batch_rows:
+            yield batch()
+            pending = 0
+    if pending:
+        yield batch()
+    yield b"E" + _U64.pack(total)
+
+
+def read_columnar(data: bytes) -> Tuple[List[str], List[List[object]]]:
+    """Decode a COLUMNAR_TYPE body into (variable names, rows of rdflib terms or None)."""
+    if data[:4] != COLUMNAR_MAGIC:
+        raise ValueError("not a columnar SPARQL result")
+    pos = 4
+
+    def u32() -> int:
+        nonlocal pos
+        value = _U32.unpack_from(data, pos)[0]
+        pos += 4
+        return value
+
+    def text() -> str:
+        nonlocal pos
+        n = u32()
+        value = data[pos:pos + n].decode("utf-8")
+        pos += n
+        return value
+
+    (count,) = _U16.unpack_from(data, pos)
+    pos += 2
+    names = []
+    for _ in range(count):
+        (n,) = _U16.unpack_from(data, pos)
+        names.append(data[pos + 2:pos + 2 + n].decode("utf-8"))
+        pos += 2 + n
+    terms: List[object] = [None]
+    rows: List[List[object]] = []
+    while pos < len(data):
+        frame = data[pos:pos + 1]
+        pos += 1
+        if frame == b"D":
+            for _ in range(u32()):
+                kind = data[pos]
+                pos += 1
+                value = text()
+                if kind == TERM_URI:
+                    terms.append(URIRef(value))
+                elif kind == TERM_BNODE:
+                    terms.append(BNode(value))
+                elif kind == TERM_TYPED:
+                    terms.append(Literal(value, datatype=URIRef(text())))
+                elif kind == TERM_LANG:
+                    terms.append(Literal(value, lang=text()))
+                else:
+                    terms.append(Literal(value))
+        elif frame == b"B":
+            n = u32()
+            cols = []
+            for _ in names:
+                ids = array("I")
+                ids.frombytes(data[pos:pos + 4 * n])
+                if sys.byteorder != "little":
+                    ids.byteswap()
+                cols.append(ids)
+                pos += 4 * n
+            rows.extend([terms[col[i]] for col in cols] for i in range(n))
+        elif frame == b"E":
+            if _U64.unpack_from(data, pos)[0] != len(rows):
+                raise ValueError("row count mismatch")
+            break
+        else:
+            raise ValueError(f"unknown frame {frame!r}")
+    return names, rows
+
+
+def stream_arrow(res: Mapping[str, Any], stats: Optional[dict] = None,
+                 batch_rows: int = BATCH_ROWS) -> Iterator[bytes]:
+    """Arrow IPC stream: one dictionary-encoded string column per variable.
+
+    Like CSV, cells are the terms' lexical forms (IRIs as IRIs, literals as
+    their value); unbound is null.
+    """
+    if stats is None:
+        stats = {}
+    names = [str(v) for v in res.get("vars_") or []]
+    schema = pyarrow.schema([pyarrow.field(name, pyarrow.dictionary(pyarrow.int32(), pyarrow.string()))
+                             for name in names])
+    sink = io.BytesIO()
+    writer = pyarrow.ipc.new_stream(sink, schema)
+
+    def drain() -> bytes:
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    columns: List[List[Optional[str]]] = [[] for _ in names]
+
+    def batch() -> None:
+        arrays = [pyarrow.array(column, type=pyarrow.string()).dictionary_encode() for column in columns]
+        writer.write_batch(pyarrow.record_batch(arrays, schema=schema))
+        for column in columns:
+            column.clear()
+
+    pending = 0
+    for row in _solutions(res, stats):
+        for column, value in zip(columns, row):
+            column.append(None if value is None else str(value))
+        pending += 1
+        if pending >= batch_rows:
+            batch()
+            pending = 0
+            yield drain()
+    if pending:
+        batch()
+    writer.close()
+    yield drain()
+
+
+# name -> (content type, media types it answers to). JSON first: it wins ties
+# and is the answer to */*.
+FORMATS: Dict[str, Tuple[str, Tuple[str, ...]]] = {
+    "json": (JSON_TYPE, (JSON_TYPE, "application/json")),
+    "xml": (XML_TYPE, (XML_TYPE,)),
+    "csv": (CSV_TYPE, ("text/csv",)),
+    "tsv": (TSV_TYPE, ("text/tab-separated-values",)),
+    "columnar": (COLUMNAR_TYPE, (COLUMNAR_TYPE,)),
+}
+if pyarrow is not None:
+    FORMATS["arrow"] = (ARROW_TYPE, (ARROW_TYPE,))
+
+
+def negotiate_format(accept: Optional[str]) -> Optional[str]:
+    """The FORMATS name that best matches an Accept header (JSON if there is none), or None if nothing does."""
+    if not accept:
+        return "json"
+    weights = parse_qvalues(accept)
+    best, best_q = None, 0.0
+    for name, (_, media_types) in FORMATS.items():
+        q = max((weights.get(media, weights.get(media.split("/")[0] + "/*", weights.get("*/*", 0.0)))
+                 for media in media_types), default=0.0)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def serialize(res: Mapping[str, Any], indent: Optional[int] = None,
+              stats: Optional[dict] = None, fmt: str = "json") -> Tuple[str, Iterator[Union[str, bytes]]]:
+    """Pick the serializer for a query result; returns (content type, chunks).
+
+    Graph results are always N-Triples. CSV, TSV and the binary formats have
+    no boolean form, so ASK results in those come back as JSON.
+    """
+    if res["type_"] in ("CONSTRUCT", "DESCRIBE"):
+        return NTRIPLES_TYPE, stream_ntriples(res, stats)
+    if fmt == "xml":
+        return XML_TYPE, stream_xml(res, stats)
+    if res["type_"] == "SELECT":
+        if fmt in ("csv", "tsv"):
+            return FORMATS[fmt][0], stream_csv(res, stats, tsv=fmt == "tsv")
+        if fmt == "columnar":
+            return COLUMNAR_TYPE, stream_columnar(res, stats)
+        if fmt == "arrow" and pyarrow is not None:
+            return ARROW_TYPE, stream_arrow(res, stats)
+    return JSON_TYPE, stream_json(res, indent, stats)
+
+
+def _legacy_rows(variables, rows):
+    # The encoder this module replaced: n3() per term, no datatype/lang, json.dumps per row.
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+    for row in rows:
+        binding = {}
+        for var in variables:
+            value = row.get(var)
+            if value is not None:
+                binding[str(var)] = {
+                    "type": "uri" if hasattr(value, 'n3') and value.n3().startswith('<') else "literal",
+                    "value": str(value),
+                }
+        yield dumps(binding)
+
+
+def main(argv=None) -> int:
+    import argparse
+    import os
+    import time
+
+    from graph_snapshot import load_source
+
+    ap = argparse.ArgumentParser(description="Micro-benchmark of the SPARQL JSON row encoder.")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--query", default="SELECT ?s ?p ?o WHERE { ?s ?p ?o }")
+    args = ap.parse_args(argv)
+
+    g = Graph()
+    for path in ("factbook_data.owl", "movies_from_dbpedia.owl", "ontology.owl"):
+        if os.path.exists(path):
+            load_source(g, path)
+    from rdflib.plugins.sparql import prepareQuery
+    res = evaluate(g, prepareQuery(args.query))
+    variables = list(res["vars_"])
+    rows = [row for row in res["bindings"] if row]
+    print(f"{len(rows)} rows x {len(variables)} vars, best of {args.repeat}")
+
+    def best(fn):
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            for _ in fn():
+                pass
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    before = best(lambda: _legacy_rows(variables, rows))
+    after = best(lambda: stream_json({"type_": "SELECT", "vars_": variables, "bindings": iter(rows)}))
+    for label, seconds in (("before (n3 + dict + json.dumps)", before), ("after (type dispatch + memo)", after)):
+        print(f"  {label:34s} {len(rows) / seconds:12,.0f} rows/s  ({seconds * 1000.0:.1f} ms)")
+    print(f"  speedup {before / after:.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
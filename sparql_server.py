@@ -1,9 +1,37 @@
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+import gc
+import itertools
+import collections
 import json
+import queue
+import signal
+import threading
 import urllib.parse
 from rdflib import Graph
 import traceback
 import os
+import time
+
+from graph_snapshot import describe, load_sources
+from stream_ingest import BATCH_SIZE, describe_progress, ingest_source
+from query_cache import PARSE_LOCK, PreparedQueryCache, ResultCache, etag_for, etag_matches, normalize_query, parse_bindings, result_key
+from request_metrics import Metrics, RequestTimer, SlowQueryLog
+from sparql_results import FORMATS, JSON_TYPE, evaluate, json_page, json_rows, negotiate_format, serialize
+from result_cursor import CursorStore, decode_token, encode_token
+from text_index import TextIndex, register_index
+import compact_store  # noqa: F401  (registers the 'Compact' store plugin)
+from movie_view import MovieView
+from country_index import CountryIndex
+from facet_index import FACETS, FacetIndex
+from inference import materialize, refresh, with_inferred
+from query_planner import GraphStats, QueryPlanner, explain
+from query_deadline import QueryDeadline, QueryTimeout, guard, watchdog
+import compression
+from compression import PrecompressedBody, StreamCompressor
+from graph_reload import FileWatcher, describe_diff, reload_sources
+from update_log import UpdateBatcher, UpdateLog, apply_updates
+from rdflib.plugins.sparql import prepareUpdate
 
 HTML_INTERFACE = """<!DOCTYPE html>
 <html lang="en">
@@ -66,6 +94,7 @@ LIMIT 20</textarea>
                 <div class="example-query" onclick="loadExample(3)">Find movies having a actor</div>
                 <div class="example-query" onclick="loadExample(4)">Search movies by title keyword</div>
                 <div class="example-query" onclick="loadExample(5)">Find country that a movie was made in</div>
+                <div class="example-query" onclick="loadExample(6)">Keyword search (text index)</div>
             </div>
             <div id="results"></div>
         </div>
@@ -77,43 +106,94 @@ LIMIT 20</textarea>
             `PREFIX mc: <http://www.semanticweb.org/lenovo/ontologies/2025/11/untitled-ontology-5#>\nPREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>\n\nSELECT ?title\n       (GROUP_CONCAT(DISTINCT REPLACE(STR(COALESCE(?actor, "")), "http://dbpedia.org/resource/", ""); separator=", ") AS ?actors)\n       (GROUP_CONCAT(DISTINCT REPLACE(STR(COALESCE(?director, "")), "http://dbpedia.org/resource/", ""); separator=", ") AS ?directors)\n       (SAMPLE(REPLACE(STR(COALESCE(?country, "")), "http://dbpedia.org/resource/", "")) AS ?country)\n       (SAMPLE(?runtime) AS ?runtime)\n       (SAMPLE(?releaseDate) AS ?releaseDate)\n       (SAMPLE(?imdbId) AS ?imdbId)\nWHERE {\n  ?movie rdf:type mc:Movie .\n  ?movie mc:title ?title .\n  OPTIONAL { ?movie mc:hasActor ?actor }\n  OPTIONAL { ?movie mc:hasDirector ?director }\n  OPTIONAL { ?movie mc:producedInCountry ?country }\n  OPTIONAL { ?movie mc:runtimeMinutes ?runtime }\n  OPTIONAL { ?movie mc:releaseDate ?releaseDate }\n  OPTIONAL { ?movie mc:imdbId ?imdbId }\n  FILTER(CONTAINS(LCASE(?title), "robocop"))\n}\nGROUP BY ?movie ?title\nLIMIT 20`,
             `PREFIX mc: <http://www.semanticweb.org/lenovo/ontologies/2025/11/untitled-ontology-5#>\nPREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>\n\nSELECT ?title\n       (GROUP_CONCAT(DISTINCT REPLACE(STR(?actor), "http://dbpedia.org/resource/", ""); separator=", ") AS ?actors)\n       (GROUP_CONCAT(DISTINCT REPLACE(STR(COALESCE(?director, "")), "http://dbpedia.org/resource/", ""); separator=", ") AS ?directors)\n       (SAMPLE(REPLACE(STR(COALESCE(?country, "")), "http://dbpedia.org/resource/", "")) AS ?country)\n       (SAMPLE(?runtime) AS ?runtime)\n       (SAMPLE(?releaseDate) AS ?releaseDate)\n       (SAMPLE(?imdbId) AS ?imdbId)\nWHERE {\n  ?movie rdf:type mc:Movie .\n  ?movie mc:title ?title .\n  ?movie mc:hasActor ?actor .\n  OPTIONAL { ?movie mc:hasDirector ?director }\n  OPTIONAL { ?movie mc:producedInCountry ?country }\n  OPTIONAL { ?movie mc:runtimeMinutes ?runtime }\n  OPTIONAL { ?movie mc:releaseDate ?releaseDate }\n  OPTIONAL { ?movie mc:imdbId ?imdbId }\n  FILTER(CONTAINS(LCASE(STR(?actor)), "jackie_chan"))\n}\nGROUP BY ?movie ?title\nLIMIT 20`,
             `PREFIX mc: <http://www.semanticweb.org/lenovo/ontologies/2025/11/untitled-ontology-5#>\nPREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>\n\nSELECT ?title\n       (GROUP_CONCAT(DISTINCT REPLACE(STR(COALESCE(?director, "")), "http://dbpedia.org/resource/", ""); separator=", ") AS ?directors)\n       (GROUP_CONCAT(DISTINCT REPLACE(STR(COALESCE(?actor, "")), "http://dbpedia.org/resource/", ""); separator=", ") AS ?actors)\n       (SAMPLE(REPLACE(STR(COALESCE(?country, "")), "http://dbpedia.org/resource/", "")) AS ?country)\n       (SAMPLE(?runtime) AS ?runtime)\n       (SAMPLE(?releaseDate) AS ?releaseDate)\n       (SAMPLE(?imdbId) AS ?imdbId)\nWHERE {\n  ?movie rdf:type mc:Movie .\n  ?movie mc:title ?title .\n  OPTIONAL { ?movie mc:hasDirector ?director }\n  OPTIONAL { ?movie mc:hasActor ?actor }\n  OPTIONAL { ?movie mc:producedInCountry ?country }\n  OPTIONAL { ?movie mc:runtimeMinutes ?runtime }\n  OPTIONAL { ?movie mc:releaseDate ?releaseDate }\n  OPTIONAL { ?movie mc:imdbId ?imdbId }\n  FILTER(CONTAINS(LCASE(?title), "bob"))\n}\nGROUP BY ?movie ?title\nLIMIT 20`,
-            `PREFIX mc: <http://www.semanticweb.org/lenovo/ontologies/2025/11/untitled-ontology-5#>\nPREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>\n\nSELECT ?movieTitle\n       (REPLACE(STR(?countryUri), "http://dbpedia.org/resource/", "") AS ?country)\n       ?capital ?population ?areaKm2 ?description\nWHERE {\n  ?movie rdf:type mc:Movie .\n  ?movie mc:title ?movieTitle .\n  ?movie mc:producedInCountry ?countryUri .\n  \n  OPTIONAL {\n    ?factbookCountry owl:sameAs ?countryUri .\n    ?factbookCountry mc:capital ?capital .\n    ?factbookCountry mc:population ?population .\n    ?factbookCountry mc:areaKm2 ?areaKm2 .\n    ?factbookCountry mc:description ?description .\n  }\n  \n  FILTER(CONTAINS(LCASE(?movieTitle), "lorax"))\n}\nLIMIT 20`
+            `PREFIX mc: <http://www.semanticweb.org/lenovo/ontologies/2025/11/untitled-ontology-5#>\nPREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>\n\nSELECT ?movieTitle\n       (REPLACE(STR(?countryUri), "http://dbpedia.org/resource/", "") AS ?country)\n       ?capital ?population ?areaKm2 ?description\nWHERE {\n  ?movie rdf:type mc:Movie .\n  ?movie mc:title ?movieTitle .\n  ?movie mc:producedInCountry ?countryUri .\n  \n  OPTIONAL {\n    ?factbookCountry owl:sameAs ?countryUri .\n    ?factbookCountry mc:capital ?capital .\n    ?factbookCountry mc:population ?population .\n    ?factbookCountry mc:areaKm2 ?areaKm2 .\n    ?factbookCountry mc:description ?description .\n  }\n  \n  FILTER(CONTAINS(LCASE(?movieTitle), "lorax"))\n}\nLIMIT 20`,
+            `PREFIX mc: <http://www.semanticweb.org/lenovo/ontologies/2025/11/untitled-ontology-5#>\nPREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>\n\nSELECT ?title\n       (GROUP_CONCAT(DISTINCT REPLACE(STR(COALESCE(?director, "")), "http://dbpedia.org/resource/", ""); separator=", ") AS ?directors)\n       (GROUP_CONCAT(DISTINCT REPLACE(STR(COALESCE(?actor, "")), "http://dbpedia.org/resource/", ""); separator=", ") AS ?actors)\n       (SAMPLE(REPLACE(STR(COALESCE(?country, "")), "http://dbpedia.org/resource/", "")) AS ?country)\nWHERE {\n  ?movie mc:textMatch "jackie_chan" .\n  ?movie rdf:type mc:Movie .\n  ?movie mc:title ?title .\n  OPTIONAL { ?movie mc:hasDirector ?director }\n  OPTIONAL { ?movie mc:hasActor ?actor }\n  OPTIONAL { ?movie mc:producedInCountry ?country }\n}\nGROUP BY ?movie ?title\nLIMIT 20`
         ];
         
         function loadExample(i) { document.getElementById('queryInput').value = examples[i]; }
         
+        // Results arrive a page at a time through a server-side cursor; further
+        // pages are appended to the table as it scrolls into view.
+        const PAGE_SIZE = 200;
+        let nextCursor = null, loading = false, shownRows = 0, resultVars = [];
+        const pager = new IntersectionObserver(entries => {
+            if (entries.some(e => e.isIntersecting)) loadMore();
+        });
+        
+        function esc(v) {
+            return String(v).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+        }
+        
+        async function fetchPage(body) {
+            const response = await fetch('/sparql', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/x-www-form-urlencoded' },
+                body: body
+            });
+            if (!response.ok) throw new Error(await response.text());
+            return response.json();
+        }
+        
+        function appendRows(data) {
+            const tbody = document.getElementById('resultRows');
+            let html = '';
+            data.results.bindings.forEach(b => {
+                html += '<tr>';
+                resultVars.forEach(v => html += `<td>${b[v] ? esc(b[v].value) : '-'}</td>`);
+                html += '</tr>';
+            });
+            tbody.insertAdjacentHTML('beforeend', html);
+            shownRows += data.results.bindings.length;
+            const total = data.cursor ? data.cursor.total : shownRows;
+            nextCursor = data.cursor ? data.cursor.next : null;
+            document.getElementById('resultCount').textContent =
+                nextCursor ? `✅ Found ${total} result(s), showing ${shownRows}` : `✅ Found ${total} result(s)`;
+            document.getElementById('moreButton').style.display = nextCursor ? '' : 'none';
+        }
+        
+        async function loadMore() {
+            if (!nextCursor || loading) return;
+            loading = true;
+            try {
+                appendRows(await fetchPage('cursor=' + encodeURIComponent(nextCursor)));
+            } catch (error) {
+                nextCursor = null;
+                document.getElementById('moreButton').style.display = 'none';
+                document.getElementById('results').insertAdjacentHTML('beforeend',
+                    `<div class="error">❌ Error:\n${esc(error.message)}</div>`);
+            } finally {
+                loading = false;
+            }
+        }
+        
         async function runQuery() {
             const query = document.getElementById('queryInput').value.trim();
             const resultsDiv = document.getElementById('results');
+            pager.disconnect();
+            nextCursor = null;
             if (!query) { resultsDiv.innerHTML = '<div class="error">❌ Please enter a query.</div>'; return; }
             resultsDiv.innerHTML = '<div class="success">⏳ Executing query...</div>';
             try {
-                const response = await fetch('/sparql', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/x-www-form-urlencoded' },
-                    body: 'query=' + encodeURIComponent(query)
-                });
-                if (!response.ok) throw new Error(await response.text());
-                const data = await response.json();
-                if (!data.results.bindings.length) {
-                    resultsDiv.innerHTML = '<div class="success">✅ Query OK but returned no results.</div>';
+                const data = await fetchPage('query=' + encodeURIComponent(query) + '&page_size=' + PAGE_SIZE);
+                if (!data.results || !data.results.bindings.length) {
+                    resultsDiv.innerHTML = data.results ? '<div class="success">✅ Query OK but returned no results.</div>'
+                        : `<div class="success">✅ ${esc(JSON.stringify(data))}</div>`;
                     return;
                 }
-                let html = `<div class="success">✅ Found ${data.results.bindings.length} result(s)</div><div class="table-wrapper"><table><thead><tr>`;
-                data.head.vars.forEach(v => html += `<th>${v}</th>`);
-                html += '</tr></thead><tbody>';
-                data.results.bindings.forEach(b => {
-                    html += '<tr>';
-                    data.head.vars.forEach(v => html += `<td>${b[v] ? b[v].value : '-'}</td>`);
-                    html += '</tr>';
-                });
-                html += '</tbody></table></div>';
+                resultVars = data.head.vars;
+                shownRows = 0;
+                let html = '<div class="success" id="resultCount"></div><div class="table-wrapper"><table><thead><tr>';
+                resultVars.forEach(v => html += `<th>${esc(v)}</th>`);
+                html += '</tr></thead><tbody id="resultRows"></tbody></table></div>';
+                html += '<div class="controls"><button id="moreButton" onclick="loadMore()">⬇ Load more</button></div>';
                 resultsDiv.innerHTML = html;
+                appendRows(data);
+                pager.observe(document.getElementById('moreButton'));
             } catch (error) {
-                resultsDiv.innerHTML = `<div class="error">❌ Error:\\n${error.message}</div>`;
+                resultsDiv.innerHTML = `<div class="error">❌ Error:\n${esc(error.message)}</div>`;
             }
         }
-        function clearResults() { document.getElementById('results').innerHTML = ''; }
+        function clearResults() { pager.disconnect(); nextCursor = null; document.getElementById('results').innerHTML = ''; }
         
         // Get triple count
         fetch('/stats').then(r => r.json()).then(data => {
@@ -124,8 +204,188 @@ LIMIT 20</textarea>
 </html>
 """
 
-print("Loading OWL files...")
-g = Graph()
+# The page never changes while the process runs: it is compressed once and
+# browsers may reuse it for UI_MAX_AGE seconds (then revalidate by ETag).
+UI_PAGE = PrecompressedBody(HTML_INTERFACE.encode('utf-8'), 'text/html; charset=utf-8')
+UI_MAX_AGE = 300
+
+TEMPLATE_PREFIXES = """PREFIX mc: <http://www.semanticweb.org/lenovo/ontologies/2025/11/untitled-ontology-5#>
+PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+PREFIX owl: <http://www.w3.org/2002/07/owl#>
+"""
+
+# The UI's canned example queries with the FILTER keyword lifted into ?keyword, so
+# clients can POST template=<id>&bindings={"keyword": "..."} and reuse one cached plan.
+QUERY_TEMPLATES = {
+    'movies-by-country': {
+        'name': "Find movies in a country",
+        'defaults': {'keyword': 'united_states'},
+        'sparql': TEMPLATE_PREFIXES + """
+SELECT ?title
+       (SAMPLE(REPLACE(STR(?country), "http://dbpedia.org/resource/", "")) AS ?country)
+       (GROUP_CONCAT(DISTINCT REPLACE(STR(COALESCE(?director, "")), "http://dbpedia.org/resource/", ""); separator=", ") AS ?directors)
+       (GROUP_CONCAT(DISTINCT REPLACE(STR(COALESCE(?actor, "")), "http://dbpedia.org/resource/", ""); separator=", ") AS ?actors)
+       (SAMPLE(?runtime) AS ?runtime)
+       (SAMPLE(?releaseDate) AS ?releaseDate)
+       (SAMPLE(?imdbId) AS ?imdbId)
+WHERE {
+  ?movie rdf:type mc:Movie .
+  ?movie mc:title ?title .
+  ?movie mc:producedInCountry ?country .
+  OPTIONAL { ?movie mc:hasDirector ?director }
+  OPTIONAL { ?movie mc:hasActor ?actor }
+  OPTIONAL { ?movie mc:runtimeMinutes ?runtime }
+  OPTIONAL { ?movie mc:releaseDate ?releaseDate }
+  OPTIONAL { ?movie mc:imdbId ?imdbId }
+  FILTER(CONTAINS(LCASE(STR(?country)), ?keyword))
+}
+GROUP BY ?movie ?title
+LIMIT 20""",
+    },
+    'movies-by-director': {
+        'name': "Find movies directed by a director",
+        'defaults': {'keyword': 'bob'},
+        'sparql': TEMPLATE_PREFIXES + """
+SELECT ?title
+       (SAMPLE(REPLACE(STR(?director), "http://dbpedia.org/resource/", "")) AS ?director)
+       (GROUP_CONCAT(DISTINCT REPLACE(STR(COALESCE(?actor, "")), "http://dbpedia.org/resource/", ""); separator=", ") AS ?actors)
+       (SAMPLE(REPLACE(STR(COALESCE(?country, "")), "http://dbpedia.org/resource/", "")) AS ?country)
+       (SAMPLE(?runtime) AS ?runtime)
+       (SAMPLE(?releaseDate) AS ?releaseDate)
+       (SAMPLE(?imdbId) AS ?imdbId)
+WHERE {
+  ?movie rdf:type mc:Movie .
+  ?movie mc:title ?title .
+  ?movie mc:hasDirector ?director .
+  OPTIONAL { ?movie mc:hasActor ?actor }
+  OPTIONAL { ?movie mc:producedInCountry ?country }
+  OPTIONAL { ?movie mc:runtimeMinutes ?runtime }
+  OPTIONAL { ?movie mc:releaseDate ?releaseDate }
+  OPTIONAL { ?movie mc:imdbId ?imdbId }
+  FILTER(CONTAINS(LCASE(STR(?director)), ?keyword))
+}
+GROUP BY ?movie ?title
+LIMIT 20""",
+    },
+    'actors-in-movie': {
+        'name': "Find actors who acted in a movie",
+        'defaults': {'keyword': 'robocop'},
+        'sparql': TEMPLATE_PREFIXES + """
+SELECT ?title
+       (GROUP_CONCAT(DISTINCT REPLACE(STR(COALESCE(?actor, "")), "http://dbpedia.org/resource/", ""); separator=", ") AS ?actors)
+       (GROUP_CONCAT(DISTINCT REPLACE(STR(COALESCE(?director, "")), "http://dbpedia.org/resource/", ""); separator=", ") AS ?directors)
+       (SAMPLE(REPLACE(STR(COALESCE(?country, "")), "http://dbpedia.org/resource/", "")) AS ?country)
+       (SAMPLE(?runtime) AS ?runtime)
+       (SAMPLE(?releaseDate) AS ?releaseDate)
+       (SAMPLE(?imdbId) AS ?imdbId)
+WHERE {
+  ?movie rdf:type mc:Movie .
+  ?movie mc:title ?title .
+  OPTIONAL { ?movie mc:hasActor ?actor }
+  OPTIONAL { ?movie mc:hasDirector ?director }
+  OPTIONAL { ?movie mc:producedInCountry ?country }
+  OPTIONAL { ?movie mc:runtimeMinutes ?runtime }
+  OPTIONAL { ?movie mc:releaseDate ?releaseDate }
+  OPTIONAL { ?movie mc:imdbId ?imdbId }
+  FILTER(CONTAINS(LCASE(?title), ?keyword))
+}
+GROUP BY ?movie ?title
+LIMIT 20""",
+    },
+    'movies-by-actor': {
+        'name': "Find movies having a actor",
+        'defaults': {'keyword': 'jackie_chan'},
+        'sparql': TEMPLATE_PREFIXES + """
+SELECT ?title
+       (GROUP_CONCAT(DISTINCT REPLACE(STR(?actor), "http://dbpedia.org/resource/", ""); separator=", ") AS ?actors)
+       (GROUP_CONCAT(DISTINCT REPLACE(STR(COALESCE(?director, "")), "http://dbpedia.org/resource/", ""); separator=", ") AS ?directors)
+       (SAMPLE(REPLACE(STR(COALESCE(?country, "")), "http://dbpedia.org/resource/", "")) AS ?country)
+       (SAMPLE(?runtime) AS ?runtime)
+       (SAMPLE(?releaseDate) AS ?releaseDate)
+       (SAMPLE(?imdbId) AS ?imdbId)
+WHERE {
+  ?movie rdf:type mc:Movie .
+  ?movie mc:title ?title .
+  ?movie mc:hasActor ?actor .
+  OPTIONAL { ?movie mc:hasDirector ?director }
+  OPTIONAL { ?movie mc:producedInCountry ?country }
+  OPTIONAL { ?movie mc:runtimeMinutes ?runtime }
+  OPTIONAL { ?movie mc:releaseDate ?releaseDate }
+  OPTIONAL { ?movie mc:imdbId ?imdbId }
+  FILTER(CONTAINS(LCASE(STR(?actor)), ?keyword))
+}
+GROUP BY ?movie ?title
+LIMIT 20""",
+    },
+    'movies-by-title': {
+        'name': "Search movies by title keyword",
+        'defaults': {'keyword': 'bob'},
+        'sparql': TEMPLATE_PREFIXES + """
+SELECT ?title
+       (GROUP_CONCAT(DISTINCT REPLACE(STR(COALESCE(?director, "")), "http://dbpedia.org/resource/", ""); separator=", ") AS ?directors)
+       (GROUP_CONCAT(DISTINCT REPLACE(STR(COALESCE(?actor, "")), "http://dbpedia.org/resource/", ""); separator=", ") AS ?actors)
+       (SAMPLE(REPLACE(STR(COALESCE(?country, "")), "http://dbpedia.org/resource/", "")) AS ?country)
+       (SAMPLE(?runtime) AS ?runtime)
+       (SAMPLE(?releaseDate) AS ?releaseDate)
+       (SAMPLE(?imdbId) AS ?imdbId)
+WHERE {
+  ?movie rdf:type mc:Movie .
+  ?movie mc:title ?title .
+  OPTIONAL { ?movie mc:hasDirector ?director }
+  OPTIONAL { ?movie mc:hasActor ?actor }
+  OPTIONAL { ?movie mc:producedInCountry ?country }
+  OPTIONAL { ?movie mc:runtimeMinutes ?runtime }
+  OPTIONAL { ?movie mc:releaseDate ?releaseDate }
+  OPTIONAL { ?movie mc:imdbId ?imdbId }
+  FILTER(CONTAINS(LCASE(?title), ?keyword))
+}
+GROUP BY ?movie ?title
+LIMIT 20""",
+    },
+    'country-facts': {
+        'name': "Find country that a movie was made in",
+        'defaults': {'keyword': 'lorax'},
+        'sparql': TEMPLATE_PREFIXES + """
+SELECT ?movieTitle
+       (REPLACE(STR(?countryUri), "http://dbpedia.org/resource/", "") AS ?country)
+       ?capital ?population ?areaKm2 ?description
+WHERE {
+  ?movie rdf:type mc:Movie .
+  ?movie mc:title ?movieTitle .
+  ?movie mc:producedInCountry ?countryUri .
+
+  OPTIONAL {
+    ?factbookCountry owl:sameAs ?countryUri .
+    ?factbookCountry mc:capital ?capital .
+    ?factbookCountry mc:population ?population .
+    ?factbookCountry mc:areaKm2 ?areaKm2 .
+    ?factbookCountry mc:description ?description .
+  }
+
+  FILTER(CONTAINS(LCASE(?movieTitle), ?keyword))
+}
+LIMIT 20""",
+    },
+    'keyword-search': {
+        'name': "Keyword search over titles, actors, directors and countries (text index)",
+        'defaults': {'keyword': 'jackie_chan'},
+        'sparql': TEMPLATE_PREFIXES + """
+SELECT ?title
+       (GROUP_CONCAT(DISTINCT REPLACE(STR(COALESCE(?director, "")), "http://dbpedia.org/resource/", ""); separator=", ") AS ?directors)
+       (GROUP_CONCAT(DISTINCT REPLACE(STR(COALESCE(?actor, "")), "http://dbpedia.org/resource/", ""); separator=", ") AS ?actors)
+       (SAMPLE(REPLACE(STR(COALESCE(?country, "")), "http://dbpedia.org/resource/", "")) AS ?country)
+WHERE {
+  ?movie mc:textMatch ?keyword .
+  ?movie rdf:type mc:Movie .
+  ?movie mc:title ?title .
+  OPTIONAL { ?movie mc:hasDirector ?director }
+  OPTIONAL { ?movie mc:hasActor ?actor }
+  OPTIONAL { ?movie mc:producedInCountry ?country }
+}
+GROUP BY ?movie ?title
+LIMIT 20""",
+    },
+}
 
 owl_files = [
     'factbook_data.owl',
@@ -133,117 +393,1290 @@ owl_files = [
     'ontology.owl'
 ]
 
-for owl_file in owl_files:
-    if os.path.exists(owl_file):
-        print(f"Loading {owl_file}...")
+# Further RDF/XML, N-Triples or N-Quads dumps (--data), streamed in by load_graph().
+data_files = []
+
+# What is served: a graph, its version and the structures derived from it,
+# replaced as a whole by publish() so a request that reads it once sees one
+# consistent version of all of them.
+ServedGraph = collections.namedtuple(
+    'ServedGraph', 'graph version text_index movie_view country_index planner facet_index')
+
+# Replaced by load_graph() before the server starts.
+served = None
+
+# Write-ahead log of /update batches, replayed on top of the OWL files at startup.
+update_log = None
+update_batcher = None
+
+# Inferred triples (inference.Materialized) served alongside the asserted ones, or None without --infer.
+inference = None
+
+# Reorder patterns and push filters down using the served graph's statistics (--no-rewrite turns it off).
+rewrite_queries = True
+
+def load_graph(store='default', wal=None, infer=False, stream=False, batch_size=BATCH_SIZE):
+    """Load owl_files and data_files (plus the update log at `wal`) into a new Graph on `store` and serve it.
+    
+    store is an rdflib store plugin name: 'default' (rdflib's Memory store) or
+    'Compact' (compact_store.CompactStore, integer-encoded and several times
+    smaller in RAM). With infer, the RDFS/OWL entailments of the ontology are
+    materialized into a store of their own and served with the graph (see inference.py).
+    
+    data_files are always streamed into the store in batches of `batch_size`
+    triples (see stream_ingest.py); with stream, so are the OWL files, instead
+    of being parsed whole in worker processes.
+    """
+    global update_log, graph_epoch, inference
+    print(f"Loading OWL files ({store} store)...")
+    graph = Graph(store=store)
+    load_start = time.perf_counter()
+    present = [owl_file for owl_file in owl_files if os.path.exists(owl_file)]
+    print(f"Loading {', '.join(present + data_files)}...")
+    
+    def progress(stats):
+        print(f"  ↻ {describe_progress(stats)}", flush=True)
+    
+    if stream:
+        loads = [ingest_source(graph, path, batch_size=batch_size, progress=progress) for path in present]
+    else:
+        # Files without a fresh snapshot are parsed in parallel worker processes.
+        loads = load_sources(graph, present)
+    loads += [ingest_source(graph, path, batch_size=batch_size, progress=progress) for path in data_files]
+    present += data_files
+    warm_start = all(loaded.from_snapshot for loaded in loads)
+    for loaded in loads:
+        if loaded.error is None:
+            print(f"✓ Loaded {loaded.path} ({describe(loaded)})")
+        else:
+            print(f"✗ Error loading {loaded.path}: {loaded.error}")
+    
+    print(f"Total triples loaded: {len(graph)} "
+          f"({'warm' if warm_start else 'cold'} start, {(time.perf_counter() - load_start) * 1000.0:.1f} ms)")
+    graph_epoch = load_epoch([p for p in present] + ([wal] if wal else []))
+    if wal:
+        update_log = UpdateLog(wal)
+        replay_start = time.perf_counter()
+        batches, added, removed = update_log.replay(graph)
+        if batches:
+            print(f"✓ Replayed {batches} update batch(es) from {wal}: +{added} / -{removed} triples "
+                  f"({(time.perf_counter() - replay_start) * 1000.0:.1f} ms)")
+    if infer:
+        inference = materialize(graph, present + ([wal] if wal else []))
+        graph = with_inferred(graph, inference)
+        print(f"✓ Inferred {len(inference.triples)} triples "
+              f"({'cached' if inference.from_cache else 'computed'}, {inference.seconds * 1000.0:.1f} ms)")
+    publish(graph, build_derived(graph))
+    return graph
+
+def apply_update_batch(updates):
+    """Apply a batch of prepared updates copy-on-write, log it, then publish it.
+    
+    Runs on the single update-writer thread; reload_lock keeps it from
+    interleaving with a source file reload.
+    """
+    with reload_lock:
+        started = time.perf_counter()
+        snapshot = current_snapshot()
+        base, version = snapshot.graph, snapshot.version
+        new_graph, results, added, removed = apply_updates(base, updates)
+        if added or removed:
+            # Write-ahead: the batch is durable before anyone can read it.
+            if update_log is not None:
+                update_log.append(added, removed)
+            reinfer(new_graph)
+            version = publish(new_graph, build_derived(new_graph))
+        print(f"✓ Applied {len(updates)} update(s): +{len(added)} / -{len(removed)} triples, "
+              f"graph version {version} ({(time.perf_counter() - started) * 1000.0:.1f} ms)")
+        return [(result, version, len(updates)) for result in results]
+
+def build_derived(graph):
+    """Build the in-memory structures derived from a graph (text index, movie view, countries, planner, facets)."""
+    index = TextIndex.build(graph)
+    register_index(graph, index)
+    view = MovieView.build(graph)
+    countries = CountryIndex.build(graph, view)
+    planner = QueryPlanner(GraphStats.build(graph))
+    facets = FacetIndex.build(view)
+    print(f"Text index: {len(index.terms)} terms, {len(index.postings)} trigrams "
+          f"({index.build_seconds * 1000.0:.1f} ms)")
+    print(f"Movie view: {len(view.records)} movies ({view.build_seconds * 1000.0:.1f} ms)")
+    print(f"Country index: {len(countries.records)} countries, {countries.same_as.links} sameAs links "
+          f"({countries.build_seconds * 1000.0:.1f} ms)")
+    print(f"Planner statistics: {len(planner.stats.predicates)} predicates, {len(planner.stats.classes)} classes "
+          f"({planner.stats.build_seconds * 1000.0:.1f} ms)")
+    print(f"Facet index: {sum(len(values) for values in facets.bitsets.values())} values over {len(facets.records)} movies "
+          f"({facets.build_seconds * 1000.0:.1f} ms)")
+    return index, view, countries, planner, facets
+
+def reinfer(graph):
+    """Bring the inferred triples of a changed, not yet published graph up to date (with --infer)."""
+    global inference
+    if inference is not None:
+        inference = refresh(graph, inference)
+        print(f"↻ Re-inferred {len(inference.triples)} triples ({inference.seconds * 1000.0:.1f} ms)")
+
+reload_lock = threading.Lock()
+
+def reload_files(paths=None, force=False):
+    """Re-read changed source files and publish the patched graph; returns a per-file report.
+    
+    The diff is applied to a copy of the served graph, so requests already
+    running keep evaluating against the graph they started with.
+    """
+    paths = [p for p in (paths or owl_files) if os.path.exists(p)]
+    with reload_lock:
+        started = time.perf_counter()
+        new_graph, diffs = reload_sources(current_snapshot().graph, paths, [p for p in owl_files + data_files if os.path.exists(p)],
+                                          force=force)
+        report = {
+            'files': {d.path: {'changed': d.changed, 'added': len(d.added), 'removed': len(d.removed),
+                               'ms': round(d.seconds * 1000.0, 1)} for d in diffs},
+        }
+        for d in diffs:
+            print(f"{'↻' if d.changed else '·'} {d.path}: {describe_diff(d)}")
+        if new_graph is not None:
+            reinfer(new_graph)
+            report['graph_version'] = publish(new_graph, build_derived(new_graph))
+            print(f"✓ Reloaded: {len(new_graph)} triples, graph version {report['graph_version']} "
+                  f"({(time.perf_counter() - started) * 1000.0:.1f} ms)")
+        report['triples'] = len(current_snapshot().graph)
+        report['ms'] = round((time.perf_counter() - started) * 1000.0, 1)
+        return report
+
+class BackgroundQueue:
+    """Runs deferred work (slow-query profiles) on one daemon thread; work beyond `maxsize` is dropped."""
+    
+    def __init__(self, maxsize=4, name='background'):
+        self.name = name
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.done = 0
+        self.dropped = 0
+    
+    def submit(self, fn):
+        """Queue fn() unless the queue is full; returns whether it was queued."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            try:
+                self._queue.put_nowait(fn)
+            except queue.Full:
+                self.dropped += 1
+                return False
+            return True
+    
+    def _run(self):
+        while True:
+            fn = self._queue.get()
+            try:
+                fn()
+            except Exception as e:
+                print(f"✗ {self.name} task failed: {e}")
+            with self._lock:
+                self.done += 1
+    
+    def stats(self):
+        with self._lock:
+            return {'queued': self._queue.qsize(), 'done': self.done, 'dropped': self.dropped}
+
+# Slow-query profiles (see SlowQueryLog) re-run the query; never on a request thread.
+profile_queue = BackgroundQueue(name='slow-query-profiler')
+
+def call_with_timeout(fn, seconds):
+    """Run fn() under a QueryDeadline of `seconds`; the guarded queries it evaluates raise QueryTimeout once it is used up."""
+    deadline = QueryDeadline(seconds)
+    try:
+        with deadline:
+            return fn()
+    finally:
+        deadline.close()
+
+query_cache = PreparedQueryCache(maxsize=256)
+result_cache = ResultCache(maxsize=512, max_bytes=64 << 20)
+# Evaluated SELECT results paged by token (/sparql?page_size=N, then ?cursor=...).
+cursor_store = CursorStore(ttl=300.0, memory_budget=64 << 20)
+MAX_PAGE_SIZE = 10000
+
+def parse_page_size(value):
+    page_size = int(value)
+    if not 0 < page_size <= MAX_PAGE_SIZE:
+        raise ValueError(f"page_size must be between 1 and {MAX_PAGE_SIZE}")
+    return page_size
+
+# served.version is bumped whenever the served graph changes; cached results and ETags are keyed on it.
+graph_version_lock = threading.Lock()
+# Identifies what the process loaded at startup, so versions (and ETags) from
+# before a restart on changed files can't be mistaken for current ones.
+graph_epoch = ''
+
+def load_epoch(paths):
+    stamp = []
+    for path in paths:
         try:
-            g.parse(owl_file, format='xml')
-            print(f"✓ Loaded {owl_file}")
-        except Exception as e:
-            print(f"✗ Error loading {owl_file}: {e}")
+            st = os.stat(path)
+            stamp.append((path, st.st_mtime_ns, st.st_size))
+        except OSError:
+            stamp.append((path, None, None))
+    return etag_for(repr(stamp)).strip('"')[:8]
+
+def publish(graph, derived):
+    """Atomically make `graph` and its derived structures the ones served; returns the new version."""
+    global served
+    with graph_version_lock:
+        served = ServedGraph(graph, (served.version if served is not None else 0) + 1, *derived)
+        result_cache.clear()
+        return served.version
+
+def current_snapshot():
+    """The served ServedGraph; read it once per request and use only that."""
+    return served
+
+# /stats is rebuilt and compressed at most every STATS_MAX_AGE seconds (or when
+# the graph changes); clients may cache it that long.
+STATS_MAX_AGE = 2
+stats_lock = threading.Lock()
+stats_cached = None  # (graph version, time.monotonic() when built, PrecompressedBody)
+
+def server_stats():
+    snapshot = current_snapshot()
+    graph = snapshot.graph
+    return {
+        'triples': len(graph),
+        'store': type(getattr(graph.store, 'asserted', graph.store)).__name__,
+        'graph_version': snapshot.version,
+        'query_cache': query_cache.stats(),
+        'result_cache': result_cache.stats(),
+        'cursors': cursor_store.stats(),
+        'text_index': snapshot.text_index.stats(),
+        'movie_view': snapshot.movie_view.stats(),
+        'country_index': snapshot.country_index.stats(),
+        'planner': {**snapshot.planner.stats_json(), 'enabled': rewrite_queries},
+        'facet_index': snapshot.facet_index.stats(),
+        'inference': inference.stats() if inference is not None else None,
+        'slow_query_profiles': profile_queue.stats(),
+        'updates': {
+            'log': update_log.stats() if update_log is not None else None,
+            'batcher': update_batcher.stats() if update_batcher is not None else None,
+        },
+    }
+
+def stats_snapshot():
+    global stats_cached
+    with stats_lock:
+        now = time.monotonic()
+        version = current_snapshot().version
+        if stats_cached is None or stats_cached[0] != version or now - stats_cached[1] >= STATS_MAX_AGE:
+            body = json.dumps(server_stats()).encode('utf-8')
+            stats_cached = (version, now, PrecompressedBody(body, 'application/json'))
+        return stats_cached[2]
+
+def prepare_query(snapshot, query, bindings):
+    """Parse `query` (through the prepared-query cache) and apply the planner's rewrite for `snapshot`.
+    
+    The result checks the evaluating thread's QueryDeadline as it runs (see query_deadline.guard).
+    """
+    prepared = query_cache.get(query, init_ns=dict(snapshot.graph.namespaces()))
+    return guard(snapshot.planner.optimize(prepared, bindings) if rewrite_queries else prepared)
+
+metrics = Metrics()
+metrics.gauge('graph_triples', "Triples in the loaded graph.", lambda: len(current_snapshot().graph))
+metrics.gauge('graph_version', "Version of the loaded graph (bumped on every change).",
+              lambda: current_snapshot().version)
+metrics.gauge('query_cache_entries', "Prepared queries held in the LRU.", lambda: query_cache.stats()['size'])
+metrics.gauge('result_cache_bytes', "Bytes of encoded responses held in the result cache.",
+              lambda: result_cache.stats()['bytes'])
+
+# Request paths reported as their own metrics label; anything else is 'other'
+# so arbitrary URLs can't blow up the label set.
+METRIC_ENDPOINTS = {'/': '/', '/index.html': '/', '/stats': '/stats', '/sparql': '/sparql',
+                    '/templates': '/templates', '/movies': '/movies', '/country': '/country', '/facets': '/facets', '/explain': '/explain', '/metrics': '/metrics',
+                    '/reload': '/reload', '/update': '/update'}
+
+def endpoint_label(path):
+    return METRIC_ENDPOINTS.get(urllib.parse.urlsplit(path).path, 'other')
+
+class ChunkedWriter:
+    """Buffers response bytes into HTTP/1.1 chunks (or a raw stream for HTTP/1.0 clients).
+    
+    With a compressor the body is encoded on the way out; every flush is a
+    sync flush, so the client can decode whatever it has received. With
+    keep_limit the bytes as sent are kept (in `kept`) until they exceed it.
+    """
 
-print(f"Total triples loaded: {len(g)}")
+    def __init__(self, wfile, chunked=True, buffer_size=64 * 1024, compressor=None, keep_limit=None):
+        self.wfile = wfile
+        self.chunked = chunked
+        self.buffer_size = buffer_size
+        self.compressor = compressor
+        self.keep_limit = keep_limit
+        self.kept = [] if keep_limit is not None else None
+        self.buffer = []
+        self.buffered = 0
+        self.bytes_in = 0
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        self.bytes_in += len(data)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def take(self):
+        data = b''.join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        return data
+
+    def flush(self):
+        if not self.buffered:
+            return
+        data = self.take()
+        if self.compressor is not None:
+            data = self.compressor.compress(data) + self.compressor.flush()
+        self.emit(data)
+
+    def emit(self, data):
+        if not data:
+            return
+        if self.chunked:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        else:
+            self.wfile.write(data)
+        self.wfile.flush()
+        self.bytes_written += len(data)
+        if self.kept is not None:
+            self.kept.append(data)
+            if self.bytes_written > self.keep_limit:
+                self.kept = None
+
+    def close(self):
+        if self.compressor is not None:
+            self.emit(self.compressor.compress(self.take()) + self.compressor.finish())
+        else:
+            self.flush()
+        if self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
+            self.wfile.flush()
 
 class SPARQLHandler(BaseHTTPRequestHandler):
+    # Chunked transfer encoding and persistent connections need HTTP/1.1; every
+    # response therefore carries a Content-Length or is chunked.
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out as separate writes; with Nagle on, a kept-alive
+    # connection waits out the client's delayed ACK (~40 ms) before the body.
+    disable_nagle_algorithm = True
+    # Socket read/write timeout, so a stalled client can't pin a worker either.
+    timeout = 60
+    # Set per request by instrumented().
+    timer = None
+    status = None
+    # Responses sent on this connection, for keepalive_max.
+    responses_on_connection = 0
+    
+    def instrumented(self, method, route):
+        """Run a route with a fresh RequestTimer and record it in the metrics and access log."""
+        self.timer = RequestTimer()
+        self.status = None
+        try:
+            route()
+        finally:
+            endpoint = endpoint_label(self.path)
+            metrics.observe(endpoint, method, self.status or 0, self.timer)
+            access_log = getattr(self.server, 'access_log', None)
+            if access_log is not None:
+                access_log.write({
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'client': self.client_address[0],
+                    'method': method,
+                    'endpoint': endpoint,
+                    'status': self.status,
+                    'ms': round(self.timer.elapsed() * 1000.0, 2),
+                    **self.timer.to_dict(),
+                })
+    
+    def handle(self):
+        """Serve requests on one connection until the client closes it, it idles
+        for keepalive_timeout seconds, or it has made keepalive_max requests."""
+        self.close_connection = True
+        self.responses_on_connection = 0
+        self.handle_one_request()
+        while not self.close_connection:
+            # An idle connection holds a worker thread; don't wait on it for long.
+            self.connection.settimeout(getattr(self.server, 'keepalive_timeout', 5.0))
+            self.handle_one_request()
+    
+    def parse_request(self):
+        # A request line arrived: the rest of the request gets the full timeout.
+        self.connection.settimeout(self.timeout)
+        return super().parse_request()
+    
+    def send_error(self, code, message=None, explain=None):
+        # BaseHTTPRequestHandler closes the connection after an error response.
+        self.close_connection = True
+        super().send_error(code, message, explain)
+    
+    def send_response(self, code, message=None):
+        self.status = code
+        self.responses_on_connection += 1
+        super().send_response(code, message)
+        if not self.close_connection:
+            remaining = getattr(self.server, 'keepalive_max', 100) - self.responses_on_connection
+            if remaining <= 0:
+                # Say so on the last response, or the client may send its next
+                # request down a connection we are about to close.
+                self.send_header('Connection', 'close')
+                return
+            if self.request_version == 'HTTP/1.0':
+                self.send_header('Connection', 'keep-alive')
+            self.send_header('Keep-Alive', f"timeout={getattr(self.server, 'keepalive_timeout', 5.0):g}, max={remaining}")
     
     def send_cors_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match')
+        self.send_header('Access-Control-Expose-Headers', 'ETag')
+    
+    def send_body(self, status, content_type, body, headers=None):
+        """Send a complete response, compressed if the client accepts it and it is worth it."""
+        if compression.compressible(content_type) and len(body) >= compression.MIN_SIZE \
+                and 'Content-Encoding' not in (headers or {}):
+            headers = {**(headers or {}), 'Vary': 'Accept-Encoding'}
+            encoding = compression.negotiate(self.headers.get('Accept-Encoding'))
+            if encoding:
+                body = compression.compress(body, encoding)
+                headers['Content-Encoding'] = encoding
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_cors_headers()
+        self.end_headers()
+        self.wfile.write(body)
+        if self.timer is not None:
+            self.timer.bytes += len(body)
+    
+    def send_not_modified(self, headers):
+        self.send_response(304)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_cors_headers()
+        self.end_headers()
+    
+    def send_precompressed(self, asset, cache_control):
+        """Serve a PrecompressedBody in the client's preferred encoding, honouring If-None-Match."""
+        encoding, body = asset.select(self.headers.get('Accept-Encoding'))
+        headers = {'ETag': asset.etag_for(encoding), 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+        if etag_matches(self.headers.get('If-None-Match'), headers['ETag']):
+            self.send_not_modified(headers)
+            return
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        self.send_body(200, asset.content_type, body, headers)
     
     def do_OPTIONS(self):
+        self.instrumented('OPTIONS', self.route_options)
+    
+    def do_GET(self):
+        self.instrumented('GET', self.route_get)
+    
+    def do_POST(self):
+        self.instrumented('POST', self.route_post)
+    
+    def route_options(self):
         self.send_response(200)
+        self.send_header('Content-Length', '0')
         self.send_cors_headers()
         self.end_headers()
     
-    def do_GET(self):
+    def route_get(self):
         if self.path == '/' or self.path == '/index.html':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.send_cors_headers()
-            self.end_headers()
-            self.wfile.write(HTML_INTERFACE.encode('utf-8'))
+            self.send_precompressed(UI_PAGE, f'public, max-age={UI_MAX_AGE}')
         elif self.path == '/stats':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_cors_headers()
-            self.end_headers()
-            self.wfile.write(json.dumps({'triples': len(g)}).encode('utf-8'))
+            self.send_precompressed(stats_snapshot(), f'max-age={STATS_MAX_AGE}')
+        elif self.path == '/movies' or self.path.startswith('/movies?'):
+            self.handle_movies(urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query))
+        elif self.path == '/country' or self.path.startswith('/country?'):
+            self.handle_country(urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query))
+        elif self.path == '/facets' or self.path.startswith('/facets?'):
+            self.handle_facets(urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query))
+        elif self.path.startswith('/sparql?'):
+            self.handle_sparql(urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query))
+        elif self.path.startswith('/explain?'):
+            self.handle_explain(urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query))
+        elif self.path == '/templates':
+            self.send_body(200, 'application/json', json.dumps(QUERY_TEMPLATES).encode('utf-8'))
+        elif self.path == '/metrics':
+            self.send_body(200, 'text/plain; version=0.0.4; charset=utf-8', metrics.render().encode('utf-8'))
         else:
             self.send_error(404, "File not found")
     
-    def do_POST(self):
+    def route_post(self):
         if self.path == '/sparql':
             try:
                 content_length = int(self.headers['Content-Length'])
                 post_data = self.rfile.read(content_length).decode('utf-8')
-                params = urllib.parse.parse_qs(post_data)
-                query = params.get('query', [''])[0]
-                
-                if not query:
-                    self.send_error(400, "No query provided")
+            except (TypeError, ValueError):
+                self.send_error(400, "Invalid request body")
+                return
+            self.handle_sparql(urllib.parse.parse_qs(post_data))
+        elif self.path == '/explain':
+            try:
+                post_data = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+            except (TypeError, ValueError):
+                self.send_error(400, "Invalid request body")
+                return
+            self.handle_explain(urllib.parse.parse_qs(post_data))
+        elif self.path == '/update':
+            self.handle_update()
+        elif self.path == '/reload' or self.path.startswith('/reload?'):
+            self.handle_reload(urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query))
+        else:
+            self.send_error(404, "Endpoint not found")
+    
+    def is_admin_client(self):
+        return self.client_address[0] in ('127.0.0.1', '::1') or getattr(self.server, 'allow_remote_admin', False)
+    
+    def handle_update(self):
+        """POST /update: SPARQL 1.1 Update, as a form field `update=` or an application/sparql-update body."""
+        if not self.is_admin_client():
+            self.send_error(403, "Updates are only allowed from localhost")
+            return
+        if update_batcher is None:
+            self.send_error(503, "Updates are disabled (they need a single server process)")
+            return
+        try:
+            body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        except (TypeError, ValueError):
+            self.send_error(400, "Invalid request body")
+            return
+        if (self.headers.get('Content-Type') or '').split(';')[0].strip() == 'application/sparql-update':
+            text = body
+        else:
+            text = urllib.parse.parse_qs(body).get('update', [''])[0]
+        if not text.strip():
+            self.send_error(400, "No update provided")
+            return
+        
+        graph = current_snapshot().graph
+        try:
+            with PARSE_LOCK:
+                prepared = prepareUpdate(text, initNs=dict(graph.namespaces()))
+        except Exception as e:
+            self.send_body(400, 'text/plain', f"Update parse error: {e}".encode('utf-8'))
+            return
+        
+        print(f"\n--- Executing update ---\n{text}\n")
+        try:
+            result, version, batch_size = update_batcher.submit(prepared)
+        except Exception as e:
+            # The batch as a whole failed (e.g. the WAL write or fsync); nothing was published.
+            error_msg = f"Update error: {str(e)}\n\nTraceback:\n{traceback.format_exc()}"
+            print(f"✗ {error_msg}")
+            self.send_body(500, 'text/plain', error_msg.encode('utf-8'))
+            return
+        if result.error is not None:
+            print(f"✗ Update failed: {result.error}")
+            self.send_body(400, 'text/plain', f"Update failed: {result.error}".encode('utf-8'))
+            return
+        self.send_body(200, 'application/json', json.dumps({
+            'added': result.added,
+            'removed': result.removed,
+            'graph_version': version,
+            'batch_size': batch_size,
+        }).encode('utf-8'))
+    
+    def handle_reload(self, params):
+        """POST /reload[?file=movies_from_dbpedia.owl][&force=1]: apply source file changes live."""
+        if not self.is_admin_client():
+            self.send_error(403, "Reload is only allowed from localhost")
+            return
+        files = params.get('file', [])
+        unknown = [f for f in files if f not in owl_files]
+        if unknown:
+            self.send_error(400, f"Unknown source file: {', '.join(unknown)}")
+            return
+        try:
+            report = reload_files(files or None, force=params.get('force', ['0'])[0] in ('1', 'true'))
+        except Exception as e:
+            print(f"✗ Reload failed: {e}")
+            self.send_body(500, 'text/plain', f"Reload failed: {e}".encode('utf-8'))
+            return
+        self.send_body(200, 'application/json', json.dumps(report).encode('utf-8'))
+    
+    def handle_movies(self, params):
+        """Filter the materialized movie view: /movies?actor=...&country=...&limit=20&offset=0."""
+        args = {name: values[0] for name, values in params.items()}
+        view = current_snapshot().movie_view
+        try:
+            limit = int(args.get('limit') or 20)
+            offset = int(args.get('offset') or 0)
+            if 'id' in args:
+                record = view.get(args['id'])
+                matches = [record] if record is not None else []
+            else:
+                matches = list(view.filter(args))
+        except ValueError as e:
+            self.send_error(400, f"Invalid parameter: {e}")
+            return
+        
+        page = matches[offset:offset + limit] if limit >= 0 else matches[offset:]
+        self.send_body(200, 'application/json', json.dumps({
+            'total': len(matches),
+            'offset': offset,
+            'movies': [record.to_json() for record in page],
+        }).encode('utf-8'), {'Cache-Control': 'no-cache'})
+    
+    def handle_facets(self, params):
+        """Drill down through the facet index.
+        
+        /facets                                  movie counts per country, director, actor, year, runtime
+        /facets?country=France&year=1995         counts and movies for France AND 1995
+        /facets?country=France,Japan&facet=year  France OR Japan, counting only the year facet
+        
+        Counts for a facet ignore that facet's own selection; top=N values per
+        facet (0 for all), limit/offset page the matching movies.
+        """
+        index = current_snapshot().facet_index
+        selection = {}
+        for name in FACETS:
+            values = [v.strip() for item in params.get(name, []) for v in item.split(',') if v.strip()]
+            if values:
+                selection[name] = values
+        facets = [f.strip() for item in params.get('facet', []) for f in item.split(',') if f.strip()]
+        try:
+            top = int(params.get('top', ['10'])[0] or 10)
+            limit = int(params.get('limit', ['20'])[0] or 20)
+            offset = max(0, int(params.get('offset', ['0'])[0] or 0))
+            body = index.query(selection, facets or tuple(FACETS), top=top, limit=limit, offset=offset)
+        except ValueError as e:
+            self.send_error(400, f"Invalid parameter: {e}")
+            return
+        
+        self.send_body(200, 'application/json', json.dumps(body).encode('utf-8'), {'Cache-Control': 'no-cache'})
+    
+    def handle_country(self, params):
+        """Pre-joined Factbook country records.
+        
+        /country                     every country
+        /country?id=France           one country, by any sameAs IRI, local name or name
+        /country?movie=lorax         the countries of movies whose title contains "lorax"
+        """
+        args = {name: values[0] for name, values in params.items()}
+        snapshot = current_snapshot()
+        countries, view = snapshot.country_index, snapshot.movie_view
+        if 'id' in args:
+            record = countries.get(args['id'])
+            if record is None:
+                self.send_error(404, f"Unknown country: {args['id']}")
+                return
+            body = record.to_json()
+        elif 'movie' in args:
+            try:
+                limit = int(args.get('limit') or 20)
+            except ValueError as e:
+                self.send_error(400, f"Invalid parameter: {e}")
+                return
+            movies = list(view.filter({'title': args['movie']}))
+            body = {
+                'total': len(movies),
+                'movies': [{
+                    'movie': movie.iri,
+                    'title': movie.title,
+                    'countries': [record.to_json() for record in countries.for_movie(movie)],
+                    'unmatched': [c for c in movie.countries if countries.get(c) is None],
+                } for movie in movies[:limit]],
+            }
+        else:
+            body = {'total': len(countries.records), 'countries': [r.to_json() for r in countries.records]}
+        self.send_body(200, 'application/json', json.dumps(body).encode('utf-8'), {'Cache-Control': 'no-cache'})
+    
+    def handle_sparql(self, params):
+        started = []
+        # Pin one graph (and its planner) for the whole request; a reload
+        # publishing a new one mid-query doesn't affect it.
+        snapshot = current_snapshot()
+        graph, version = snapshot.graph, snapshot.version
+        try:
+            query = params.get('query', [''])[0]
+            template_id = params.get('template', [''])[0]
+            try:
+                bindings = parse_bindings(params.get('bindings', [''])[0])
+                indent = int(params.get('indent', ['0'])[0]) or None
+                page_size = parse_page_size(params['page_size'][0]) if params.get('page_size', [''])[0] else None
+                fmt = params.get('format', [''])[0] or negotiate_format(self.headers.get('Accept'))
+                if fmt is not None and fmt not in FORMATS:
+                    raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+            except ValueError as e:
+                self.send_error(400, f"Invalid parameter: {e}")
+                return
+            if fmt is None:
+                self.send_error(406, "Acceptable result types: " + ", ".join(ct for ct, _ in FORMATS.values()))
+                return
+            
+            if 'cursor' in params:
+                self.handle_cursor_page(params['cursor'][0], page_size)
+                return
+            
+            if template_id:
+                template = QUERY_TEMPLATES.get(template_id)
+                if template is None:
+                    self.send_error(404, f"Unknown template: {template_id}")
                     return
-                
+                query = template['sparql']
+                bindings = {**parse_bindings(json.dumps(template['defaults'])), **bindings}
+            
+            if not query:
+                self.send_error(400, "No query provided")
+                return
+            
+            # Cursor pages are SPARQL JSON; other formats always stream the whole result.
+            if page_size is not None and fmt == 'json' and self.start_cursor(snapshot, query, template_id, bindings, page_size):
+                return
+            
+            encoding = compression.negotiate(self.headers.get('Accept-Encoding'))
+            # Each encoding is its own cache entry (and ETag): the cache holds bytes as sent.
+            key = result_key(f"{graph_epoch}.{version}", query, bindings,
+                             variant=f"format={fmt};indent={indent};encoding={encoding}")
+            etag = etag_for(key)
+            cache_headers = {
+                'ETag': etag,
+                # Clients may keep the body but must revalidate; the tag changes with the graph.
+                'Cache-Control': 'no-cache',
+                'Vary': 'Accept, Accept-Encoding',
+            }
+            if etag_matches(self.headers.get('If-None-Match'), etag):
+                self.send_not_modified(cache_headers)
+                return
+            
+            cached = result_cache.get(key)
+            if cached is not None:
+                content_type, body = cached
+                print(f"✓ Served cached result ({len(body)} bytes{f', {encoding}' if encoding else ''})")
+                if encoding:
+                    cache_headers['Content-Encoding'] = encoding
+                self.send_body(200, content_type, body, cache_headers)
+                return
+            
+            if template_id:
+                print(f"\n--- Executing template {template_id} with {dict((str(k), str(v)) for k, v in bindings.items())} ---\n")
+            else:
                 print(f"\n--- Executing query ---\n{query}\n")
-                results = g.query(query)
-                
-                result_data = {
-                    "head": {"vars": []},
-                    "results": {"bindings": []}
-                }
-                
-                if results:
-                    result_list = list(results)
-                    if result_list:
-                        result_data["head"]["vars"] = [str(var) for var in results.vars]
-                        for row in result_list:
-                            binding = {}
-                            for var in results.vars:
-                                value = row[var]
-                                if value is not None:
-                                    binding[str(var)] = {
-                                        "type": "uri" if hasattr(value, 'n3') and value.n3().startswith('<') else "literal",
-                                        "value": str(value)
-                                    }
-                            result_data["results"]["bindings"].append(binding)
-                
-                print(f"✓ Query returned {len(result_data['results']['bindings'])} results")
-                
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.send_cors_headers()
-                self.end_headers()
-                self.wfile.write(json.dumps(result_data, indent=2).encode('utf-8'))
-                
-            except Exception as e:
-                error_msg = f"Query error: {str(e)}\n\nTraceback:\n{traceback.format_exc()}"
-                print(f"✗ {error_msg}")
-                
-                self.send_response(500)
-                self.send_header('Content-type', 'text/plain')
-                self.send_cors_headers()
-                self.end_headers()
-                self.wfile.write(error_msg.encode('utf-8'))
+            timeout = getattr(self.server, 'query_timeout', None)
+            prepared = self.timer.timed('parse', prepare_query, snapshot, query, bindings)
+            deadline = QueryDeadline(timeout)
+            try:
+                stats = self.stream_results(graph, prepared, bindings, key, fmt, indent, encoding, cache_headers,
+                                            started, deadline)
+            except QueryTimeout:
+                print(f"✗ Query timed out after {timeout}s")
+                metrics.count_timeout()
+                self.log_slow_query(snapshot, query, template_id, bindings, timed_out=True)
+                if started:
+                    # Headers are out; all we can do is cut the stream short.
+                    self.close_connection = True
+                else:
+                    self.send_body(503, 'text/plain', f"Query timed out after {timeout} seconds".encode('utf-8'))
+                return
+            finally:
+                deadline.close()
+            
+            phases = self.timer.phases
+            sent = f"{stats['bytes']} bytes" + (f" {encoding}, {stats['raw_bytes']} raw" if encoding else "")
+            print(f"✓ Query returned {stats['rows']} results ({sent}) in "
+                  f"{self.timer.elapsed() * 1000.0:.1f} ms: " +
+                  ", ".join(f"{name} {phases.get(name, 0.0) * 1000.0:.1f} ms"
+                            for name in ('parse', 'eval', 'serialize', 'write')))
+            self.log_slow_query(snapshot, query, template_id, bindings)
+            
+        except Exception as e:
+            error_msg = f"Query error: {str(e)}\n\nTraceback:\n{traceback.format_exc()}"
+            print(f"✗ {error_msg}")
+            if started:
+                self.close_connection = True
+            else:
+                self.send_body(500, 'text/plain', error_msg.encode('utf-8'))
+    
+    def handle_explain(self, params):
+        """GET/POST /explain?query=... (or template=&bindings=): the chosen plan with estimated and actual rows.
+
+        analyze=0 only plans the query; rewrite=0 explains it as written.
+        """
+        snapshot = current_snapshot()
+        graph, version = snapshot.graph, snapshot.version
+        query = params.get('query', [''])[0]
+        template_id = params.get('template', [''])[0]
+        try:
+            bindings = parse_bindings(params.get('bindings', [''])[0])
+        except ValueError as e:
+            self.send_error(400, f"Invalid parameter: {e}")
+            return
+        if template_id:
+            template = QUERY_TEMPLATES.get(template_id)
+            if template is None:
+                self.send_error(404, f"Unknown template: {template_id}")
+                return
+            query = template['sparql']
+            bindings = {**parse_bindings(json.dumps(template['defaults'])), **bindings}
+        if not query:
+            self.send_error(400, "No query provided")
+            return
+        analyze = params.get('analyze', ['1'])[0] not in ('0', 'false')
+        rewrite = params.get('rewrite', ['1'])[0] not in ('0', 'false')
+
+        try:
+            prepared = query_cache.get(query, init_ns=dict(graph.namespaces()))
+        except Exception as e:
+            self.send_body(400, 'text/plain', f"Query parse error: {e}".encode('utf-8'))
+            return
+
+        def run(plan):
+            res = evaluate(graph, guard(plan), bindings)
+            if res.get('type_') == 'SELECT':
+                return sum(1 for _ in res['bindings'])
+            if res.get('type_') == 'ASK':
+                return int(bool(res['askAnswer']))
+            return len(res['graph'])
+
+        timeout = getattr(self.server, 'query_timeout', None)
+        try:
+            report = call_with_timeout(
+                lambda: explain(snapshot.planner, graph, prepared, bindings, rewrite=rewrite, analyze=analyze, run=run), timeout)
+        except QueryTimeout:
+            metrics.count_timeout()
+            self.send_body(503, 'text/plain', f"Query timed out after {timeout} seconds".encode('utf-8'))
+            return
+        report = {'graph_version': version, **report}
+        self.send_body(200, 'application/json', json.dumps(report, indent=2).encode('utf-8'),
+                       {'Cache-Control': 'no-store'})
+
+    def start_cursor(self, snapshot, query, template_id, bindings, page_size):
+        """Evaluate a SELECT once into a cursor buffer and send its first page.
+        
+        Returns False for other query forms, which are answered as usual. A
+        live buffer for the same graph version, query and bindings is paged
+        again instead of evaluating a new one. With --processes N the buffer
+        lives in the worker that evaluated it, so later pages need the same
+        (kept-alive) connection.
+        """
+        graph = snapshot.graph
+        key = result_key(f"{graph_epoch}.{snapshot.version}", query, bindings)
+        buffer = cursor_store.find(key)
+        if buffer is not None:
+            print(f"✓ Reusing cursor {buffer.id}: {len(buffer)} rows")
+            self.send_cursor_page(buffer, 0, page_size)
+            return True
+        timer = self.timer
+        prepared = timer.timed('parse', prepare_query, snapshot, query, bindings)
+        if prepared.algebra.name != 'SelectQuery':
+            return False
+        print(f"\n--- Executing query into a cursor ({page_size} rows per page) ---\n{query}\n")
+        timeout = getattr(self.server, 'query_timeout', None)
+        stats = {}
+        
+        def fill():
+            with deadline:
+                res = evaluate(graph, prepared, bindings)
+            res = dict(res, bindings=deadline.iterate(res['bindings']))
+            rows = (row.encode('utf-8') for row in json_rows(res, stats))
+            return cursor_store.create([str(v) for v in res.get('vars_') or []], rows, key)
+        
+        deadline = QueryDeadline(timeout)
+        try:
+            buffer = timer.timed('eval', fill)
+        except QueryTimeout:
+            print(f"✗ Query timed out after {timeout}s")
+            metrics.count_timeout()
+            self.log_slow_query(snapshot, query, template_id, bindings, timed_out=True)
+            self.send_body(503, 'text/plain', f"Query timed out after {timeout} seconds".encode('utf-8'))
+            return True
+        finally:
+            deadline.close()
+        print(f"✓ Cursor {buffer.id}: {len(buffer)} rows ({buffer.nbytes} bytes) in {timer.elapsed() * 1000.0:.1f} ms")
+        self.send_cursor_page(buffer, 0, page_size)
+        self.log_slow_query(snapshot, query, template_id, bindings)
+        return True
+    
+    def handle_cursor_page(self, token, page_size=None):
+        """GET/POST /sparql?cursor=<token>[&page_size=N]: the next page of an evaluated result."""
+        try:
+            buffer_id, offset, token_page_size = decode_token(token)
+            # Tokens are client-supplied: their page size gets the same bounds as page_size=.
+            page_size = page_size or parse_page_size(token_page_size)
+        except ValueError as e:
+            self.send_error(400, f"Invalid parameter: {e}")
+            return
+        buffer = cursor_store.get(buffer_id)
+        if buffer is None:
+            self.send_error(410, "Cursor expired or unknown; re-run the query")
+            return
+        self.send_cursor_page(buffer, offset, page_size)
+    
+    def send_cursor_page(self, buffer, offset, page_size):
+        rows = self.timer.timed('serialize', buffer.rows, offset, page_size)
+        end = offset + len(rows)
+        cursor = {
+            'id': buffer.id,
+            'offset': offset,
+            'total': len(buffer),
+            'next': encode_token(buffer.id, end, page_size) if end < len(buffer) else None,
+            'ttl_s': cursor_store.ttl,
+        }
+        self.timer.rows = len(rows)
+        self.send_body(200, JSON_TYPE, json_page(buffer.vars, rows, cursor), {'Cache-Control': 'no-store'})
+    
+    def log_slow_query(self, snapshot, query, template_id, bindings, timed_out=False):
+        slow_log = getattr(self.server, 'slow_query_log', None)
+        elapsed = self.timer.elapsed()
+        if slow_log is None or not (timed_out or slow_log.is_slow(elapsed)):
+            return
+        metrics.count_slow_query()
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'client': self.client_address[0],
+            'ms': round(elapsed * 1000.0, 1),
+            'timed_out': timed_out,
+            'template': template_id or None,
+            'bindings': {str(k): v.n3() for k, v in bindings.items()},
+            'query': normalize_query(query),
+            **self.timer.to_dict(),
+        }
+        key = result_key(0, query, bindings)
+        if not slow_log.should_profile(key):
+            slow_log.record(entry)
+            return
+        timeout = getattr(self.server, 'query_timeout', None)
+        
+        def profile_and_record():
+            # Re-run once under the profiler, off the request's connection thread.
+            prepared = prepare_query(snapshot, query, bindings)
+            graph = snapshot.graph
+            
+            def run():
+                for _ in serialize(evaluate(graph, prepared, bindings))[1]:
+                    pass
+            
+            try:
+                entry['profile'] = call_with_timeout(lambda: slow_log.run_profiled(key, run, entry['query']), timeout)
+            except QueryTimeout:
+                entry['profile'] = None
+            slow_log.record(entry)
+        
+        if not profile_queue.submit(profile_and_record):
+            # The profiler is busy; log the query now and let a later run of it be profiled.
+            slow_log.forget_profile(key)
+            slow_log.record(entry)
+    
+    def stream_results(self, graph, prepared, bindings, key, fmt, indent, encoding, headers, started, deadline):
+        """Evaluate and write the results in format `fmt` as they are produced (compressed with
+        `encoding`, if any); returns row/byte counts. Only evaluation counts against `deadline`."""
+        timer = self.timer
+        with deadline:
+            res = timer.timed('eval', evaluate, graph, prepared, bindings)
+        if 'bindings' in res:
+            # SELECT solutions are produced lazily while serializing; charge
+            # the time spent pulling them to evaluation.
+            res = dict(res, bindings=timer.iterate('eval', deadline.iterate(res['bindings'])))
+        stats = {}
+        content_type, chunks = serialize(res, indent=indent, stats=stats, fmt=fmt)
+        
+        loop_start = time.perf_counter()
+        eval_before = timer.phases.get('eval', 0.0)
+        # Pull the head and the first solution before committing to a 200, so
+        # errors raised while starting evaluation still produce a 500.
+        pending = [next(chunks), next(chunks, '')]
+        
+        chunked = self.request_version != 'HTTP/1.0'
+        if not chunked:
+            # Without chunking the end of the body is the end of the connection.
+            self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-type', content_type)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
         else:
-            self.send_error(404, "Endpoint not found")
+            self.send_header('Connection', 'close')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_cors_headers()
+        self.end_headers()
+        started.append(True)
+        
+        # The bytes as sent (compressed, if so) are what the result cache keeps.
+        writer = ChunkedWriter(self.wfile, chunked=chunked,
+                               compressor=StreamCompressor(encoding) if encoding else None,
+                               keep_limit=result_cache.max_entry_bytes)
+        write_seconds = 0.0
+        clock = time.perf_counter
+        for i, chunk in enumerate(itertools.chain(pending, chunks)):
+            data = chunk if isinstance(chunk, bytes) else chunk.encode('utf-8')
+            t = clock()
+            writer.write(data)
+            if i == 1:
+                # Get the first row on the wire right away.
+                writer.flush()
+            write_seconds += clock() - t
+        t = clock()
+        writer.close()
+        write_seconds += clock() - t
+        
+        timer.add('write', write_seconds)
+        timer.add('serialize', max(0.0, clock() - loop_start - write_seconds
+                                   - (timer.phases.get('eval', 0.0) - eval_before)))
+        timer.bytes += writer.bytes_written
+        timer.rows = stats['rows']
+        
+        if writer.kept is not None:
+            result_cache.put(key, (content_type, b''.join(writer.kept)))
+        stats['bytes'] = writer.bytes_written
+        stats['raw_bytes'] = writer.bytes_in
+        return stats
     
     def log_message(self, format, *args):
         pass
 
-def run_server(port=8888):
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that hands each connection to a bounded pool of worker threads."""
+
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, workers=8, query_timeout=None,
+                 slow_query_log=None, access_log=None):
+        super().__init__(server_address, handler_class)
+        self.slow_query_log = slow_query_log
+        self.access_log = access_log
+        self.workers = workers
+        self.query_timeout = query_timeout
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sparql-worker') if workers > 0 else None
+
+    def process_request(self, request, client_address):
+        if self.pool is None:
+            return super().process_request(request, client_address)
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+# A query this long past its timeout without reaching a deadline check ends
+# its pre-forked worker, which the parent replaces (see query_deadline).
+HARD_TIMEOUT_GRACE = 10.0
+
+def end_overrun_worker(deadline):
+    print(f"✗ Worker {os.getpid()}: a query is {deadline.overrun(time.perf_counter()):.1f}s past its timeout; "
+          f"exiting so it is replaced", flush=True)
+    os._exit(3)
+
+def serve_prefork(httpd, processes, child_init=None):
+    """Fork `processes` workers that share the listening socket and the loaded graph.
+    
+    child_init, if given, runs in each worker right after the fork (threads
+    started before forking don't exist in the children).
+    """
+    # Move everything loaded so far out of the collector's reach, so GC passes in the
+    # children don't touch (and un-share) the graph's pages.
+    gc.freeze()
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                watchdog.enable(HARD_TIMEOUT_GRACE, end_overrun_worker)
+                if child_init is not None:
+                    child_init()
+                httpd.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            except Exception:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        children.add(pid)
+
+    for _ in range(processes):
+        spawn()
+    try:
+        while children:
+            pid, status = os.wait()
+            children.discard(pid)
+            if not stopping:
+                print(f"✗ Worker {pid} exited ({status}), restarting")
+                spawn()
+    except KeyboardInterrupt:
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in list(children):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+
+class AccessLog:
+    """One JSON line per request, to a file or stdout ('-')."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, entry):
+        line = json.dumps(entry)
+        if self.path == '-':
+            print(line)
+            return
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+def start_watcher(interval):
+    watched = [p for p in owl_files if os.path.exists(p)]
+    return FileWatcher(watched, lambda paths: reload_files(paths), interval=interval).start()
+
+def run_server(port=8888, workers=8, processes=1, query_timeout=30.0,
+               slow_query_ms=1000.0, slow_query_log=None, profile_dir=None, access_log=None,
+               watch=0, allow_remote_admin=False, update_batch=64, update_linger_ms=5.0,
+               cursor_ttl=300.0, cursor_memory_mb=64.0, cursor_dir=None, rewrite=True,
+               keepalive_timeout=5.0, keepalive_max=100):
+    global update_batcher, rewrite_queries
     server_address = ('0.0.0.0', port)
-    httpd = HTTPServer(server_address, SPARQLHandler)
+    slow_log = SlowQueryLog(slow_query_ms / 1000.0, slow_query_log, profile_dir) if slow_query_ms >= 0 else None
+    httpd = PooledHTTPServer(server_address, SPARQLHandler, workers=workers, query_timeout=query_timeout,
+                             slow_query_log=slow_log, access_log=AccessLog(access_log) if access_log else None)
+    httpd.allow_remote_admin = allow_remote_admin
+    httpd.keepalive_timeout = keepalive_timeout
+    httpd.keepalive_max = keepalive_max
+    cursor_store.ttl = cursor_ttl
+    cursor_store.memory_budget = int(cursor_memory_mb * (1 << 20))
+    cursor_store.spill_dir = cursor_dir
+    rewrite_queries = rewrite
+    if processes == 1:
+        # Pre-forked workers each hold a private copy of the graph, so an update
+        # would only reach one of them; /update answers 503 in that mode.
+        update_batcher = UpdateBatcher(apply_update_batch, max_batch=update_batch,
+                                       linger=update_linger_ms / 1000.0)
+    mode = f"{workers} worker thread(s)" if workers > 0 else "single-threaded"
+    if processes > 1:
+        mode = f"{processes} processes x {mode}"
     print(f"\n{'='*60}")
     print(f"SPARQL Server running at http://localhost:{port}")
+    print(f"Mode: {mode}, query timeout: {query_timeout or 'none'}s")
+    print(f"Keep-alive: {keepalive_timeout:g}s idle, {keepalive_max} requests per connection; "
+          f"compression: {', '.join(compression.supported())}")
+    if slow_log is not None:
+        print(f"Slow queries (>= {slow_query_ms:g} ms) -> {slow_query_log or 'stdout'}"
+              f"{f', profiles in {profile_dir}' if profile_dir else ''}")
+    print(f"Metrics: http://localhost:{port}/metrics")
+    print(f"Query rewriting: {'on' if rewrite else 'off'} (plans at http://localhost:{port}/explain?query=...)")
+    if watch:
+        print(f"Watching {', '.join(owl_files)} for changes every {watch:g}s (or POST /reload)")
     print(f"{'='*60}\n")
     
     try:
-        httpd.serve_forever()
+        if processes > 1:
+            # Each worker holds its own copy of the graph after the fork, so each
+            # watches the files itself; POST /reload only reaches one worker.
+            serve_prefork(httpd, processes, child_init=(lambda: start_watcher(watch)) if watch else None)
+        else:
+            if watch:
+                start_watcher(watch)
+            httpd.serve_forever()
     except KeyboardInterrupt:
+        pass
+    finally:
         print("\n\nServer stopped.")
-        httpd.shutdown()
+        httpd.server_close()
+        cursor_store.close()
 
 if __name__ == '__main__':
-    import sys
-    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8888
-    run_server(port)
+    import argparse
+    parser = argparse.ArgumentParser(description="SPARQL HTTP server over the OWL movie/factbook data.")
+    parser.add_argument('port', nargs='?', type=int, default=8888)
+    parser.add_argument('--workers', type=int, default=8,
+                        help="worker threads per process (0 = handle requests on the accept thread)")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="pre-forked worker processes sharing the loaded graph (POSIX only)")
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help="per-query timeout in seconds (0 disables it); with --processes, a worker "
+                             f"whose query runs {HARD_TIMEOUT_GRACE:g}s past it is restarted")
+    parser.add_argument('--keepalive-timeout', type=float, default=5.0,
+                        help="seconds an idle persistent connection is kept open (default 5)")
+    parser.add_argument('--keepalive-max', type=int, default=100,
+                        help="requests served on one persistent connection before it is closed (default 100)")
+    parser.add_argument('--store', choices=['default', 'Compact'], default='default',
+                        help="triple store: rdflib's Memory store, or the integer-encoded Compact store")
+    parser.add_argument('--data', action='append', default=[], metavar='FILE',
+                        help="also serve this RDF/XML, N-Triples or N-Quads file (.gz too), streamed in "
+                             "batches; repeatable. Pre-build its snapshot with stream_ingest.py")
+    parser.add_argument('--stream-ingest', action='store_true',
+                        help="stream the OWL files into the store in batches too, instead of parsing each whole")
+    parser.add_argument('--ingest-batch', type=int, default=BATCH_SIZE,
+                        help=f"triples per batch when streaming a source in (default {BATCH_SIZE})")
+    parser.add_argument('--infer', action='store_true',
+                        help="materialize RDFS/OWL entailments (inverse properties, class hierarchy, sameAs) after loading")
+    parser.add_argument('--no-rewrite', action='store_true',
+                        help="evaluate queries as written, without statistics-based pattern reordering and filter pushdown")
+    parser.add_argument('--watch', type=float, default=0, metavar='SECONDS',
+                        help="poll the OWL files this often and apply their changes live (0 = off)")
+    parser.add_argument('--allow-remote-admin', action='store_true',
+                        help="accept POST /reload from hosts other than localhost")
+    parser.add_argument('--wal', default=None,
+                        help="write-ahead log for /update batches, replayed at startup, e.g. updates.wal "
+                             "(default: none, updates are kept in memory only)")
+    parser.add_argument('--update-batch', type=int, default=64,
+                        help="most /update requests applied as one batch (default 64)")
+    parser.add_argument('--update-linger-ms', type=float, default=5.0,
+                        help="how long a batch waits for more updates after its first one (default 5 ms)")
+    parser.add_argument('--cursor-ttl', type=float, default=300.0,
+                        help="seconds an unread /sparql cursor is kept (default 300)")
+    parser.add_argument('--cursor-memory-mb', type=float, default=64.0,
+                        help="in-memory budget for cursor results; beyond it they spill to disk (default 64)")
+    parser.add_argument('--cursor-dir', default=None,
+                        help="directory for spilled cursor results (default: the system temp dir)")
+    parser.add_argument('--slow-query-ms', type=float, default=1000.0,
+                        help="log /sparql requests at least this slow (negative disables the log)")
+    parser.add_argument('--slow-query-log', default=None,
+                        help="append slow queries to this JSON-lines file (default: stdout)")
+    parser.add_argument('--profile-slow', metavar='DIR', default=None,
+                        help="re-run each distinct slow query once under cProfile and save the profile in DIR")
+    parser.add_argument('--access-log', default=None,
+                        help="write one JSON line per request (path, or '-' for stdout)")
+    args = parser.parse_args()
+    if args.processes > 1 and not hasattr(os, 'fork'):
+        parser.error("--processes needs os.fork()")
+    if args.ingest_batch < 1:
+        parser.error("--ingest-batch must be at least 1")
+    missing = [path for path in args.data if not os.path.exists(path)]
+    if missing:
+        parser.error(f"no such data file: {', '.join(missing)}")
+    data_files.extend(args.data)
+    load_graph(args.store, wal=args.wal, infer=args.infer, stream=args.stream_ingest, batch_size=args.ingest_batch)
+    run_server(args.port, workers=args.workers, processes=args.processes, query_timeout=args.timeout,
+               slow_query_ms=args.slow_query_ms, slow_query_log=args.slow_query_log,
+               profile_dir=args.profile_slow, access_log=args.access_log,
+               watch=args.watch, allow_remote_admin=args.allow_remote_admin,
+               update_batch=args.update_batch, update_linger_ms=args.update_linger_ms,
+               cursor_ttl=args.cursor_ttl, cursor_memory_mb=args.cursor_memory_mb, cursor_dir=args.cursor_dir,
+               rewrite=not args.no_rewrite, keepalive_timeout=args.keepalive_timeout,
+               keepalive_max=args.keepalive_max)
@@ -0,0 +1,327 @@
+from __future__ import annotations
+
+import argparse
+import gzip
+import io
+import os
+import resource
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, List, Optional, Sequence, Tuple
+
+from rdflib import Graph
+from rdflib.exceptions import ParserError
+from rdflib.parser import InputSource
+from rdflib.plugins.parsers.nquads import NQuadsParser
+from rdflib.plugins.parsers.ntriples import W3CNTriplesParser
+from rdflib.plugins.parsers.rdfxml import create_parser
+
+from graph_snapshot import SnapshotWriter, SourceLoad, _cache_for, describe, load_snapshot_file
+
+# Streaming ingest of large RDF dumps.
+#
+# Graph.parse() reads a whole file into one graph before anything else can
+# happen, so loading a dump costs the parser's state plus every triple, and a
+# snapshot of it (graph_snapshot.encode_graph) needs that whole graph again.
+# Here a source is read READ_SIZE bytes or one line at a time and handed on in
+# batches of at most ``batch_size`` triples -- to the store with addN, to a
+# SnapshotWriter, or both -- so the overhead on top of the store stays
+# bounded whatever the size of the dump.
+#
+#   RDF/XML     rdflib's SAX handler fed incrementally through expat
+#   N-Triples   rdflib's line parser, one line at a time
+#   N-Quads     the same; graph names are dropped, as the server serves one graph
+#
+# Any of them may be gzipped (.gz). The RDF/XML handler keeps the rdf:ID and
+# rdf:nodeID values it has seen (to check uniqueness and resolve references),
+# which is small for DBpedia extracts, where subjects are rdf:about IRIs.
+#
+#   python stream_ingest.py films.nt.gz            pre-build the snapshot the server will load
+#   python stream_ingest.py films.nt.gz --load     ... and load it into a graph, to check the count
+
+BATCH_SIZE = 50_000
+READ_SIZE = 1 << 20
+PROGRESS_EVERY = 2.0
+
+FORMATS = {
+    ".owl": "xml",
+    ".rdf": "xml",
+    ".xml": "xml",
+    ".nt": "nt",
+    ".ntriples": "nt",
+    ".nq": "nquads",
+    ".nquads": "nquads",
+}
+
+Triple = Tuple[object, object, object]
+
+
+def detect_format(path: str) -> str:
+    """"xml", "nt" or "nquads", from the file extension (ignoring a trailing .gz)."""
+    name = path[:-3] if path.endswith(".gz") else path
+    fmt = FORMATS.get(os.path.splitext(name)[1].lower())
+    if fmt is None:
+        raise ValueError(f"can't tell the RDF format of {path} (use one of {', '.join(sorted(FORMATS))})")
+    return fmt
+
+
+@dataclass
+class IngestStats:
+    path: str
+    format: str
+    size: int
+    triples: int = 0
+    batches: int = 0
+    bytes_read: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.triples / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def percent(self) -> float:
+        return 100.0 * self.bytes_read / self.size if self.size else 100.0
+
+
+def describe_progress(stats: IngestStats) -> str:
+    return (f"{os.path.basename(stats.path)}: {stats.triples:,} triples, {stats.percent:.0f}% read, "
+            f"{stats.rate:,.0f} triples/s")
+
+
+class _Collector:
+    """Sink for the rdflib parsers: triples pile up in ``pending`` until taken."""
+
+    def __init__(self) -> None:
+        self.pending: List[Triple] = []
+        self.namespaces: List[Tuple[str, str]] = []
+        # NQuadsParser adds to sink.get_context(name) or sink.default_context.
+        self.default_context = self
+
+    def add(self, triple: Triple) -> None:
+        self.pending.append(triple)
+
+    def triple(self, s, p, o) -> None:
+        self.pending.append((s, p, o))
+
+    def get_context(self, identifier) -> "_Collector":
+        return self
+
+    def bind(self, prefix, namespace, override: bool = False) -> None:
+        if prefix:
+            self.namespaces.append((prefix, str(namespace)))
+
+    def take(self) -> List[Triple]:
+        batch, self.pending = self.pending, []
+        return batch
+
+
+def _feed_xml(f: BinaryIO, base: str, sink: _Collector) -> Iterator[None]:
+    parser = create_parser(InputSource(base), sink)
+    while True:
+        chunk = f.read(READ_SIZE)
+        if not chunk:
+            break
+        parser.feed(chunk)
+        yield
+    parser.close()
+    yield
+
+
+def _feed_lines(f: BinaryIO, fmt: str, sink: _Collector) -> Iterator[None]:
+    parser = NQuadsParser() if fmt == "nquads" else W3CNTriplesParser()
+    parser.sink = sink
+    parser.skolemize = False
+    text = io.TextIOWrapper(f, encoding="utf-8", newline="")
+    try:
+        for lineno, line in enumerate(text, 1):
+            parser.line = line.rstrip("\r\n")
+            try:
+                parser.parseline()
+            except ParserError as e:
+                raise ParserError(f"line {lineno}: {e}: {line.strip()[:200]!r}") from None
+            yield
+    finally:
+        text.detach()  # the caller closes the file
+
+
+def iter_batches(path: str, fmt: Optional[str] = None, batch_size: int = BATCH_SIZE,
+                 stats: Optional[IngestStats] = None,
+                 namespaces: Optional[List[Tuple[str, str]]] = None) -> Iterator[List[Triple]]:
+    """The triples of ``path`` in lists of at most ``batch_size``, read incrementally.
+
+    ``stats`` (if given) is kept current as the file is read; prefixes the
+    source declares are appended to ``namespaces``.
+    """
+    fmt = fmt or detect_format(path)
+    sink = _Collector()
+    with open(path, "rb") as raw:
+        f = gzip.GzipFile(fileobj=raw) if path.endswith(".gz") else raw
+        steps = (_feed_xml(f, Path(path).absolute().as_uri(), sink) if fmt == "xml"
+                 else _feed_lines(f, fmt, sink))
+        for _ in steps:
+            if len(sink.pending) < batch_size:
+                continue
+            pending = sink.take()
+            if stats is not None:
+                stats.bytes_read = raw.tell()
+            for i in range(0, len(pending), batch_size):
+                yield pending[i:i + batch_size]
+        if stats is not None:
+            stats.bytes_read = raw.tell()
+        if sink.pending:
+            yield sink.take()
+    if namespaces is not None:
+        namespaces.extend(sink.namespaces)
+
+
+def ingest(path: str, on_batch: Callable[[List[Triple]], object], fmt: Optional[str] = None,
+           batch_size: int = BATCH_SIZE, progress: Optional[Callable[[IngestStats], object]] = None,
+           progress_every: float = PROGRESS_EVERY,
+           namespaces: Optional[List[Tuple[str, str]]] = None) -> IngestStats:
+    """Stream ``path`` into ``on_batch`` a batch at a time; ``progress`` is called every ``progress_every`` s."""
+    stats = IngestStats(path, fmt or detect_format(path), os.path.getsize(path))
+    start = last = time.perf_counter()
+    for batch in iter_batches(path, stats.format, batch_size, stats, namespaces):
+        on_batch(batch)
+        stats.triples += len(batch)
+        stats.batches += 1
+        now = time.perf_counter()
+        stats.seconds = now - start
+        if progress is not None and now - last >= progress_every:
+            progress(stats)
+            last = now
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def ingest_source(g: Graph, path: str, cache_dir: Optional[str] = None, use_snapshot: bool = True,
+                  fmt: Optional[str] = None, batch_size: int = BATCH_SIZE,
+                  progress: Optional[Callable[[IngestStats], object]] = None) -> SourceLoad:
+    """Add one source to ``g`` like graph_snapshot.load_source, streaming it when it must be parsed.
+
+    A fresh snapshot is mapped in as usual. Otherwise the source is streamed
+    into ``g`` in batches and, with ``use_snapshot``, into a new snapshot at
+    the same time. Errors are reported in the SourceLoad rather than raised;
+    the triples of a failed source that were already added stay in ``g``.
+    """
+    start = time.perf_counter()
+    cache = _cache_for(path, cache_dir)
+    if use_snapshot:
+        snap = cache.fresh_snapshot(path)
+        if snap is not None:
+            try:
+                return SourceLoad(path, load_snapshot_file(g, snap), True, time.perf_counter() - start)
+            except (OSError, ValueError, EOFError):
+                pass  # corrupt snapshot: stream the source below
+
+    writer = SnapshotWriter(cache.cache_dir if os.path.isdir(cache.cache_dir) else None) if use_snapshot else None
+    namespaces: List[Tuple[str, str]] = []
+    before = len(g)
+
+    def add(batch: List[Triple]) -> None:
+        # Parsed terms are valid already: skip Graph.addN's per-triple checks.
+        g.store.addN((s, p, o, g) for s, p, o in batch)
+        if writer is not None:
+            writer.add(batch)
+
+    try:
+        stats = ingest(path, add, fmt, batch_size, progress, namespaces=namespaces)
+        for prefix, ns in namespaces:
+            g.bind(prefix, ns, override=False)
+            if writer is not None:
+                writer.bind(prefix, ns)
+        if writer is not None:
+            try:
+                cache.store_with(path, writer.write)
+            except OSError as e:
+                print(f"  (could not write snapshot for {os.path.basename(path)}: {e})")
+    except Exception as e:
+        return SourceLoad(path, len(g) - before, False, time.perf_counter() - start, error=f"{type(e).__name__}: {e}")
+    finally:
+        if writer is not None:
+            writer.close()
+    return SourceLoad(path, stats.triples, False, time.perf_counter() - start, parse_seconds=stats.seconds)
+
+
+def prebuild(path: str, cache_dir: Optional[str] = None, fmt: Optional[str] = None,
+             batch_size: int = BATCH_SIZE, force: bool = False,
+             progress: Optional[Callable[[IngestStats], object]] = None) -> Optional[IngestStats]:
+    """Stream ``path`` into its snapshot only; None if the snapshot was fresh already."""
+    cache = _cache_for(path, cache_dir)
+    if not force and cache.fresh_snapshot(path) is not None:
+        return None
+    os.makedirs(cache.cache_dir, exist_ok=True)
+    writer = SnapshotWriter(cache.cache_dir)
+    namespaces: List[Tuple[str, str]] = []
+    try:
+        stats = ingest(path, writer.add, fmt, batch_size, progress, namespaces=namespaces)
+        for prefix, ns in namespaces:
+            writer.bind(prefix, ns)
+        cache.store_with(path, writer.write)
+    finally:
+        writer.close()
+    return stats
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024.0
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    ap = argparse.ArgumentParser(
+        description="Stream RDF/XML, N-Triples or N-Quads dumps (optionally .gz) into graph snapshots.")
+    ap.add_argument("files", nargs="+")
+    ap.add_argument("--cache-dir", default=None, help="snapshot directory (default: .graph_cache next to each file)")
+    ap.add_argument("--format", choices=sorted(set(FORMATS.values())), default=None,
+                    help="source format (default: from the extension)")
+    ap.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                    help=f"triples per batch (default {BATCH_SIZE})")
+    ap.add_argument("--force", action="store_true", help="rebuild snapshots that are still fresh")
+    ap.add_argument("--load", action="store_true",
+                    help="also load the files into a graph (through the snapshots) and report its size")
+    ap.add_argument("--store", choices=["default", "Compact"], default="default",
+                    help="rdflib store plugin for --load (default: Memory)")
+    args = ap.parse_args(argv)
+    if args.batch_size < 1:
+        ap.error("--batch-size must be at least 1")
+
+    def progress(stats: IngestStats) -> None:
+        print(f"  {describe_progress(stats)}", flush=True)
+
+    status = 0
+    graph = Graph(store=args.store) if args.load else None
+    for path in args.files:
+        if args.load:
+            loaded = ingest_source(graph, path, args.cache_dir, fmt=args.format, batch_size=args.batch_size,
+                                   progress=progress)
+            if loaded.error is not None:
+                print(f"✗ {path}: {loaded.error}")
+                status = 1
+                continue
+            print(f"✓ {path}: {describe(loaded)}"
+                  + (f", {loaded.triples / loaded.parse_seconds:,.0f} triples/s" if loaded.parse_seconds else ""))
+            continue
+        try:
+            stats = prebuild(path, args.cache_dir, args.format, args.batch_size, args.force, progress)
+        except Exception as e:
+            print(f"✗ {path}: {type(e).__name__}: {e}")
+            status = 1
+            continue
+        if stats is None:
+            print(f"✓ {path}: snapshot is fresh (--force to rebuild)")
+        else:
+            print(f"✓ {path}: {stats.triples:,} triples in {stats.batches} batches, {stats.seconds:.1f} s, "
+                  f"{stats.rate:,.0f} triples/s")
+    if graph is not None:
+        print(f"Graph: {len(graph):,} triples")
+    print(f"Peak RSS {_peak_rss_mb():.1f} MB")
+    return status
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
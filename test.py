@@ -1,11 +1,50 @@
 from __future__ import annotations
 
+import argparse
+import contextlib
+import gzip
+import http.client
+import io
+import json
 import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import threading
 import time
-from dataclasses import dataclass
-from typing import List, Sequence
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import urllib.error
+import urllib.parse
+import urllib.request
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Sequence
 
-from rdflib import Graph
+import rdflib
+from rdflib import RDF, XSD, BNode, Graph, Literal, URIRef
+from rdflib.plugins.sparql import prepareQuery, prepareUpdate
+from rdflib.plugins.sparql.evaluate import evalPart
+from rdflib.plugins.sparql.parserutils import CompValue
+from rdflib.plugins.sparql.sparql import QueryContext
+
+from graph_snapshot import describe, load_source, load_sources
+from inference import materialize, with_inferred
+from load_test import example_queries
+from query_cache import parse_bindings
+from query_planner import GraphStats, QueryPlanner
+from query_deadline import DeadlineWatchdog, QueryDeadline, QueryTimeout, guard
+from request_metrics import percentile
+from result_cursor import CursorStore
+from sparql_results import (COLUMNAR_TYPE, CSV_TYPE, TSV_TYPE, XML_TYPE, evaluate, negotiate_format,
+                            read_columnar, stream_columnar)
+from update_log import UpdateBatcher, UpdateLog, apply_updates
+import compact_store  # noqa: F401  (registers the 'Compact' store plugin)
+import compression
+import sparql_server
+import text_index  # noqa: F401  (registers mc:textMatch / mc:textContains)
 
 
 PREFIXES = """\
@@ -34,31 +73,38 @@ def _strip_dbpedia(uri_or_lit: str) -> str:
     return uri_or_lit.replace("http://dbpedia.org/resource/", "")
 
 
-def load_graph() -> Graph:
-    g = Graph()
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    cwd = os.getcwd()
+def resolve(path: str) -> str:
+    if os.path.isabs(path):
+        return path
+    if os.path.exists(os.path.join(os.getcwd(), path)):
+        return os.path.join(os.getcwd(), path)
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
 
-    def resolve(path: str) -> str:
-        if os.path.isabs(path):
-            return path
-        if os.path.exists(os.path.join(cwd, path)):
-            return os.path.join(cwd, path)
-        return os.path.join(base_dir, path)
 
+def load_graph(store: str = "default") -> Graph:
+    g = Graph(store=store)
+    start = time.perf_counter()
+    present = []
     for fname in OWL_FILES:
         fpath = resolve(fname)
         print(f"Loading {fpath} …")
         if not os.path.exists(fpath):
             print(f"  ✗ Not found: {fname}")
             continue
-        try:
-            g.parse(fpath, format="xml")
-            print(f"  ✓ Loaded {fname}")
-        except Exception as e:
-            # Keep going so tests can still run with partial data.
-            print(f"  ✗ Failed to load {fname}: {e}")
-    print(f"Total triples loaded: {len(g)}")
+        present.append(fpath)
+    # Stale files are parsed in parallel; a failure is reported per file and
+    # the tests still run with partial data.
+    loads = load_sources(g, present)
+    warm = all(loaded.from_snapshot for loaded in loads)
+    for loaded in loads:
+        fname = os.path.basename(loaded.path)
+        if loaded.error is None:
+            print(f"  ✓ Loaded {fname} ({describe(loaded)})")
+        else:
+            print(f"  ✗ Failed to load {fname}: {loaded.error}")
+    elapsed_ms = (time.perf_counter() - start) * 1000.0
+    print(f"Total triples loaded: {len(g)} into {type(g.store).__name__} "
+          f"({'warm' if warm else 'cold'} start, {elapsed_ms:.1f} ms)")
     return g
 
 
@@ -225,6 +271,35 @@ LIMIT 20
 """,
     ))
 
+    q.append(TestQuery(
+        "Keyword search through the text index (mc:textMatch jackie_chan)",
+        PREFIXES
+        + """
+SELECT DISTINCT ?movie ?title
+WHERE {
+  ?movie mc:textMatch "jackie_chan" .
+  ?movie rdf:type mc:Movie .
+  ?movie mc:title ?title .
+}
+LIMIT 20
+""",
+    ))
+
+    q.append(TestQuery(
+        "Indexed CONTAINS filter (mc:textContains on actor, jackie_chan)",
+        PREFIXES
+        + """
+SELECT DISTINCT ?movie ?title ?actor
+WHERE {
+  ?movie rdf:type mc:Movie .
+  ?movie mc:title ?title .
+  ?movie mc:hasActor ?actor .
+  FILTER(mc:textContains(?actor, "jackie_chan"))
+}
+LIMIT 20
+""",
+    ))
+
     # --- Extra ontology sanity checks (generated) ---
 
     q.append(TestQuery(
@@ -313,8 +388,1012 @@ LIMIT 20
     return q
 
 
-def main() -> int:
-    g = load_graph()
+# --- Benchmark mode ---
+
+DBPEDIA = "http://dbpedia.org/resource/"
+MC_PRODUCED_IN = URIRef("http://www.semanticweb.org/lenovo/ontologies/2025/11/untitled-ontology-5#producedInCountry")
+MOVIES_FILE = "movies_from_dbpedia.owl"
+
+
+def scale_graph(g: Graph, factor: int) -> int:
+    """Add ``factor - 1`` renamed copies of the movie data to ``g``; returns triples added.
+
+    Every dbpedia IRI (movies, actors, directors) gets a ``__rN`` suffix in copy
+    N, so keyword filters keep matching and selectivity stays constant while the
+    graph grows. Countries are shared with the Factbook data and keep their IRIs.
+    """
+    if factor <= 1:
+        return 0
+    movies = Graph()
+    load_source(movies, resolve(MOVIES_FILE))
+    countries = set(movies.objects(None, MC_PRODUCED_IN))
+
+    def rename(term, suffix: str):
+        if isinstance(term, URIRef) and term.startswith(DBPEDIA) and term not in countries:
+            return URIRef(term + suffix)
+        return term
+
+    before = len(g)
+    for n in range(1, factor):
+        suffix = f"__r{n}"
+        g.addN((rename(s, suffix), p, rename(o, suffix), g) for s, p, o in movies)
+    return len(g) - before
+
+
+@dataclass
+class QueryBench:
+    name: str
+    rows: int
+    iterations: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    mean_ms: float
+    rows_per_sec: float
+    peak_kib: float
+    error: Optional[str] = None
+
+
+def bench_query(g: Graph, tq: TestQuery, warmup: int, iterations: int) -> QueryBench:
+    def once() -> int:
+        return len(list(g.query(tq.sparql)))
+
+    try:
+        for _ in range(warmup):
+            once()
+        times: List[float] = []
+        rows = 0
+        for _ in range(iterations):
+            start = time.perf_counter()
+            rows = once()
+            times.append(time.perf_counter() - start)
+        # One extra traced run: tracemalloc slows allocation down too much to
+        # leave it on while timing.
+        tracemalloc.start()
+        try:
+            once()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    except Exception as e:
+        return QueryBench(tq.name, 0, 0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, error=str(e))
+
+    times.sort()
+    mean = sum(times) / len(times)
+    return QueryBench(
+        name=tq.name,
+        rows=rows,
+        iterations=iterations,
+        p50_ms=percentile(times, 50) * 1000.0,
+        p95_ms=percentile(times, 95) * 1000.0,
+        p99_ms=percentile(times, 99) * 1000.0,
+        mean_ms=mean * 1000.0,
+        rows_per_sec=rows / mean if mean > 0 else 0.0,
+        peak_kib=peak / 1024.0,
+    )
+
+
+def compare_to_baseline(report: dict, baseline: dict, threshold: float, min_delta_ms: float) -> List[str]:
+    """Queries whose p50 got slower than the baseline by more than ``threshold`` (a fraction).
+
+    Differences under ``min_delta_ms`` are ignored so sub-millisecond queries
+    don't flap on timer noise.
+    """
+    if baseline.get("meta", {}).get("scale") != report["meta"]["scale"]:
+        print(f"  ! baseline was recorded at scale {baseline.get('meta', {}).get('scale')}, "
+              f"this run is scale {report['meta']['scale']}")
+    previous: Dict[str, dict] = {q["name"]: q for q in baseline.get("queries", [])}
+    regressions = []
+    for q in report["queries"]:
+        old = previous.get(q["name"])
+        if old is None or q["error"] or old.get("error"):
+            continue
+        delta = q["p50_ms"] - old["p50_ms"]
+        if delta > min_delta_ms and q["p50_ms"] > old["p50_ms"] * (1.0 + threshold):
+            regressions.append(f"{q['name']}: p50 {old['p50_ms']:.1f} -> {q['p50_ms']:.1f} ms "
+                               f"(+{delta / old['p50_ms'] * 100.0 if old['p50_ms'] else 0.0:.0f}%)")
+        if q["rows"] != old["rows"]:
+            print(f"  ! {q['name']}: row count changed {old['rows']} -> {q['rows']}")
+    return regressions
+
+
+def run_benchmark(args: argparse.Namespace) -> int:
+    g = load_graph(args.store)
+    if args.scale > 1:
+        start = time.perf_counter()
+        added = scale_graph(g, args.scale)
+        print(f"Scaled movie data {args.scale}x: +{added} triples, {len(g)} total "
+              f"({(time.perf_counter() - start) * 1000.0:.0f} ms)")
+
+    suite = [tq for tq in query_suite() if not args.filter or args.filter.lower() in tq.name.lower()]
+    results: List[QueryBench] = []
+    print("=" * 80)
+    print(f"{'query':60s} {'rows':>5s} {'p50':>8s} {'p95':>8s} {'p99':>8s} {'rows/s':>10s} {'peak':>9s}")
+    for tq in suite:
+        r = bench_query(g, tq, args.warmup, args.iterations)
+        results.append(r)
+        if r.error:
+            print(f"{tq.name[:60]:60s} [ERROR] {r.error}")
+            continue
+        print(f"{tq.name[:60]:60s} {r.rows:5d} {r.p50_ms:7.1f}ms {r.p95_ms:7.1f}ms {r.p99_ms:7.1f}ms "
+              f"{r.rows_per_sec:10,.0f} {r.peak_kib:7.0f}KiB")
+
+    report = {
+        "meta": {
+            "triples": len(g),
+            "scale": args.scale,
+            "store": args.store,
+            "warmup": args.warmup,
+            "iterations": args.iterations,
+            "python": platform.python_version(),
+            "rdflib": rdflib.__version__,
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "queries": [asdict(r) for r in results],
+    }
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.json}")
+
+    status = 1 if any(r.error for r in results) else 0
+    if args.baseline:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}; writing this run as the baseline.")
+            with open(args.baseline, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            return status
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"✗ {len(regressions)} regression(s) beyond {args.threshold * 100.0:.0f}% vs {args.baseline}:")
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print(f"✓ No regressions beyond {args.threshold * 100.0:.0f}% vs {args.baseline}")
+    return status
+
+
+# --- Checks ---
+#
+# Pass/fail checks of behaviour the query suite only prints. Each returns
+# nothing and raises AssertionError (or anything else) on failure.
+
+CHECKS: List = []
+
+
+def check(fn):
+    CHECKS.append(fn)
+    return fn
+
+
+def result_rows(g: Graph, sparql: str) -> List[tuple]:
+    result = g.query(sparql)
+    if result.type == "ASK":
+        return [(result.askAnswer,)]
+    rows = [tuple(row) for row in result]
+    if "LIMIT" in sparql:
+        # Which rows survive a LIMIT depends on store iteration order.
+        return [(len(rows),)]
+    return sorted(rows, key=repr)
+
+
+PARITY_UPDATES = [
+    # Past the fold threshold (a sixteenth of the base), then removals of
+    # both folded and freshly added triples, re-adds of removed ones, a
+    # no-op insert of triples already present and a second fold with
+    # removals pending.
+    "INSERT { ?m rdf:type mc:Country } WHERE { ?m rdf:type mc:Movie }",
+    "DELETE { ?m rdf:type mc:Country } WHERE { ?m rdf:type mc:Movie ; mc:runtimeMinutes ?r FILTER(?r < 100) }",
+    "DELETE { ?m mc:producedInCountry ?c } WHERE { ?m mc:producedInCountry ?c ; mc:runtimeMinutes ?r FILTER(?r > 120) }",
+    "INSERT DATA { <urn:x:a> mc:title \"A\" . <urn:x:b> mc:title \"B\" }",
+    "INSERT { ?m mc:producedInCountry ?c } WHERE { ?m mc:producedInCountry ?c }",
+    "DELETE DATA { <urn:x:a> mc:title \"A\" }",
+    "INSERT { ?m rdf:type mc:Country } WHERE { ?m rdf:type mc:Movie ; mc:runtimeMinutes ?r FILTER(?r < 90) }",
+    "INSERT { ?m rdfs:label ?t } WHERE { ?m mc:title ?t }",
+    "DELETE WHERE { <urn:x:b> ?p ?o }",
+]
+
+
+# One query per bound-term shape (the full scan is covered by comparing the
+# triple sets), so every index and both halves of the store (base arrays and
+# pending delta) are hit after each update.
+PARITY_QUERIES = [
+    "SELECT ?p ?o WHERE { <http://dbpedia.org/resource/Avatar_(2009_film)> ?p ?o }",
+    "SELECT ?o WHERE { ?s mc:producedInCountry ?o }",
+    "SELECT ?s WHERE { ?s rdf:type mc:Country }",
+    "SELECT ?s ?p WHERE { ?s ?p <urn:x:b> }",
+    "SELECT ?s ?p WHERE { ?s ?p \"B\" }",
+    "ASK { <urn:x:a> mc:title \"A\" }",
+    "SELECT ?c (COUNT(?m) AS ?n) WHERE { ?m mc:producedInCountry ?c } GROUP BY ?c",
+    "SELECT ?m ?d WHERE { ?m rdf:type mc:Movie ; rdf:type mc:Country ; mc:hasDirector ?d }",
+]
+
+
+@check
+def check_compact_parity() -> None:
+    """The Compact store answers every query like Memory, before and after a run of updates."""
+    # Fold at a sixteenth of the base instead of the 4096-key floor, which
+    # this graph's updates would never reach.
+    threshold, compact_store.MERGE_THRESHOLD = compact_store.MERGE_THRESHOLD, 0
+    try:
+        _compact_parity()
+    finally:
+        compact_store.MERGE_THRESHOLD = threshold
+
+
+def _compact_parity() -> None:
+    memory, compact = Graph(), Graph(store="Compact")
+    sources = [resolve(f) for f in OWL_FILES if os.path.exists(resolve(f))]
+    load_sources(memory, sources)
+    load_sources(compact, sources)
+    last = len(PARITY_UPDATES)
+    for step, update in enumerate([None] + PARITY_UPDATES):
+        if update is not None:
+            memory.update(PREFIXES + update)
+            compact.update(PREFIXES + update)
+        assert len(memory) == len(compact), f"step {step}: {len(memory)} != {len(compact)} triples"
+        assert set(memory) == set(compact), f"step {step}: triples differ"
+        queries = [PREFIXES + q for q in PARITY_QUERIES]
+        if step == last:
+            queries += [tq.sparql for tq in query_suite()]
+        for sparql in queries:
+            assert result_rows(memory, sparql) == result_rows(compact, sparql), \
+                f"step {step}: results differ for\n{sparql}"
+    # One fold for the initial load, then one per update that crossed the threshold.
+    assert compact.store.merges >= 3, "updates never folded the delta twice"
+    copy = compact.store.copy()
+    compact.update(PREFIXES + PARITY_UPDATES[-1].replace("<urn:x:b>", "?s"))
+    assert len(copy) == len(memory), "copy() changed along with the original"
+
+
+MC = "http://www.semanticweb.org/lenovo/ontologies/2025/11/untitled-ontology-5#"
+
+
+def write_movies(path: str, ids: Sequence[int]) -> None:
+    """A small RDF/XML source: one mc:Movie with an mc:title per id."""
+    g = Graph()
+    for i in ids:
+        movie = URIRef(f"urn:x:movie/{i}")
+        g.add((movie, RDF.type, URIRef(MC + "Movie")))
+        g.add((movie, URIRef(MC + "title"), Literal(f"Movie {i}")))
+    g.serialize(path, format="xml")
+
+
+@contextlib.contextmanager
+def serving(paths: Sequence[str], workers: int = 2, wal: Optional[str] = None, infer: bool = False,
+            **settings):
+    """Run sparql_server in this process over the source files ``paths``; yields its base URL.
+
+    With ``wal``, /update is enabled and logged there; ``infer`` is --infer.
+    ``settings`` are set on the server (keepalive_max, ...). The server's
+    console output is swallowed while it runs.
+    """
+    saved = (sparql_server.owl_files, sparql_server.data_files, sparql_server.update_log,
+             sparql_server.update_batcher, sparql_server.inference)
+    httpd = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            sparql_server.owl_files, sparql_server.data_files = list(paths), []
+            sparql_server.update_log = sparql_server.inference = None
+            sparql_server.load_graph(wal=wal, infer=infer)
+            if wal:
+                sparql_server.update_batcher = UpdateBatcher(sparql_server.apply_update_batch)
+            httpd = sparql_server.PooledHTTPServer(("127.0.0.1", 0), sparql_server.SPARQLHandler,
+                                                   workers=workers, query_timeout=30.0)
+            for name, value in settings.items():
+                setattr(httpd, name, value)
+            threading.Thread(target=httpd.serve_forever, daemon=True).start()
+            yield f"http://127.0.0.1:{httpd.server_address[1]}"
+        finally:
+            if httpd is not None:
+                httpd.shutdown()
+                httpd.server_close()
+            sparql_server.cursor_store.close()
+            (sparql_server.owl_files, sparql_server.data_files, sparql_server.update_log,
+             sparql_server.update_batcher, sparql_server.inference) = saved
+
+
+def fetch(url: str, data: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None):
+    """(status, headers, body) of one request; error statuses are returned, not raised."""
+    request = urllib.request.Request(url, data=data, headers=headers or {})
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def sparql_url(base: str, query: str, **params) -> str:
+    return f"{base}/sparql?" + urllib.parse.urlencode({"query": query, **params})
+
+
+MOVIE_TITLES = f"SELECT ?m ?t WHERE {{ ?m a <{MC}Movie> ; <{MC}title> ?t }} ORDER BY ?m"
+
+
+def movie_ids(base: str) -> List[int]:
+    status, _, body = fetch(sparql_url(base, MOVIE_TITLES))
+    assert status == 200, f"query answered {status}"
+    bindings = json.loads(body)["results"]["bindings"]
+    return sorted(int(b["m"]["value"].rsplit("/", 1)[1]) for b in bindings)
+
+
+@check
+def check_parallel_queries() -> None:
+    """Distinct queries parsed and evaluated at the same time all succeed (rdflib's parser is not thread-safe)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        movies = os.path.join(tmp, "movies.owl")
+        write_movies(movies, range(0, 30))
+        with serving([movies], workers=8) as base:
+            # Every query is new to the prepared-query cache, so each one is parsed.
+            urls = [sparql_url(base, f"SELECT ?m ?t WHERE {{ ?m <{MC}title> ?t FILTER(STRLEN(?t) > {i}) }}")
+                    for i in range(64)]
+            with ThreadPoolExecutor(max_workers=16) as pool:
+                answers = list(pool.map(fetch, urls))
+    failed = [(status, body[:120]) for status, _, body in answers if status >= 500]
+    assert not failed, f"{len(failed)} of {len(urls)} failed, e.g. {failed[0]}"
+    assert all(status == 200 for status, _, _ in answers)
+
+
+@check
+def check_keepalive_latency() -> None:
+    """Responses on a kept-alive connection don't wait out the client's delayed ACK (Nagle)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        movies = os.path.join(tmp, "movies.owl")
+        write_movies(movies, range(0, 10))
+        with serving([movies]) as base:
+            conn = http.client.HTTPConnection(urllib.parse.urlsplit(base).netloc, timeout=30)
+            try:
+                times = []
+                for _ in range(20):
+                    start = time.perf_counter()
+                    conn.request("GET", "/stats")
+                    response = conn.getresponse()
+                    response.read()
+                    times.append(time.perf_counter() - start)
+            finally:
+                conn.close()
+    # With Nagle on, each response took ~40 ms: the body waited for the ACK of the headers.
+    median = sorted(times)[len(times) // 2]
+    assert median < 0.02, f"median kept-alive response took {median * 1000.0:.0f} ms"
+
+
+@check
+def check_keepalive_close() -> None:
+    """The last response keepalive_max allows on a connection says Connection: close, then the server closes it."""
+    with tempfile.TemporaryDirectory() as tmp:
+        movies = os.path.join(tmp, "movies.owl")
+        write_movies(movies, range(0, 10))
+        with serving([movies], keepalive_max=3) as base:
+            conn = http.client.HTTPConnection(urllib.parse.urlsplit(base).netloc, timeout=30)
+            try:
+                headers = []
+                for _ in range(3):
+                    conn.request("GET", "/stats")
+                    response = conn.getresponse()
+                    response.read()
+                    headers.append((response.getheader("Connection"), response.getheader("Keep-Alive")))
+                # http.client drops its socket once it has read a closing response.
+                closed = conn.sock is None
+            finally:
+                conn.close()
+    assert [h[1].split("max=")[1] for h in headers[:2]] == ["2", "1"], f"Keep-Alive headers {headers}"
+    assert headers[2][0] == "close", f"last response: {headers[2]}"
+    assert closed, "client kept the connection open after the last response"
+
+
+@check
+def check_query_deadline() -> None:
+    """ORDER BY / GROUP BY over a large join time out cooperatively; the store stays usable."""
+    g = Graph(store="Compact")
+    g.store.addN((URIRef(f"urn:x:s{i}"), URIRef(f"urn:x:p{i % 7}"), Literal(i), g) for i in range(400))
+    for sparql in ["SELECT ?a ?b WHERE { ?a ?p ?x . ?b ?q ?y } ORDER BY ?b ?a",
+                   "SELECT ?a (COUNT(?b) AS ?n) WHERE { ?a ?p ?x . ?b ?q ?y } GROUP BY ?a"]:
+        deadline = QueryDeadline(0.2)
+        start = time.perf_counter()
+        try:
+            with deadline:
+                res = evaluate(g, guard(prepareQuery(sparql)))
+            for _ in deadline.iterate(res["bindings"]):
+                pass
+        except QueryTimeout:
+            pass
+        else:
+            raise AssertionError(f"no timeout for {sparql}")
+        finally:
+            deadline.close()
+        elapsed = time.perf_counter() - start
+        assert elapsed < 1.0, f"timed out only after {elapsed:.2f} s: {sparql}"
+    # The timeout was raised in this thread at a check, not into the store.
+    answer = []
+    reader = threading.Thread(target=lambda: answer.append(len(g.query("SELECT ?s WHERE { ?s ?p 7 }"))))
+    reader.start()
+    reader.join(5.0)
+    assert answer == [1], "the store is unusable after a timeout"
+
+    # The pre-forked workers' backstop: a section that never reaches a check.
+    overruns = []
+    watchdog = DeadlineWatchdog(interval=0.02)
+    watchdog.enable(0.1, overruns.append)
+    deadline = QueryDeadline(0.05)
+    watchdog.add(deadline)
+    with deadline:
+        time.sleep(0.4)
+    watchdog.discard(deadline)
+    assert overruns and overruns[0] is deadline, "watchdog didn't report the overrun"
+
+
+# Solution modifiers the planner leaves in place; it rewrites the pattern below them.
+PLAN_MODIFIERS = {"SelectQuery", "Project", "Slice", "Distinct", "Reduced", "OrderBy", "AggregateJoin", "Group"}
+
+
+def _above_aggregate(node) -> bool:
+    while isinstance(node, CompValue) and isinstance(node.get("p"), CompValue):
+        node = node.p
+        if node.name == "AggregateJoin":
+            return True
+    return False
+
+
+def pattern_root(node):
+    """The graph pattern under a query's modifiers (and the SELECT expressions over its groups)."""
+    while node.name in PLAN_MODIFIERS or (node.name in ("Extend", "Filter") and _above_aggregate(node)):
+        node = node.p
+    return node
+
+
+def solution_multiset(g: Graph, prepared, node, bindings) -> Counter:
+    ctx = QueryContext(g, initBindings=bindings)
+    ctx.prologue = prepared.prologue
+    return Counter(frozenset(row.items()) for row in evalPart(ctx, node))
+
+
+def _unordered_cell(value):
+    # GROUP_CONCAT joins a group's values in evaluation order, which the rewrite changes.
+    return None if value is None else ", ".join(sorted(str(value).split(", ")))
+
+
+def result_multiset(g: Graph, prepared, bindings) -> Counter:
+    res = evaluate(g, prepared, bindings)
+    return Counter(tuple(_unordered_cell(row.get(v)) for v in res["vars_"]) for row in res["bindings"])
+
+
+@check
+def check_rewrite_parity() -> None:
+    """The planner's rewrite returns the same results as the query as written, for every template and UI example."""
+    g = Graph()
+    load_sources(g, [resolve(f) for f in OWL_FILES if os.path.exists(resolve(f))])
+    planner = QueryPlanner(GraphStats.build(g))
+    cases = [(f"template {tid}", t["sparql"], parse_bindings(json.dumps(t["defaults"])))
+             for tid, t in sparql_server.QUERY_TEMPLATES.items()]
+    cases += [(f"example {i}", sparql, {}) for i, sparql in enumerate(example_queries(), 1)]
+    for name, sparql, bindings in cases:
+        # Which groups a LIMIT without ORDER BY keeps depends on evaluation order; compare them all.
+        unlimited = re.sub(r"\b(LIMIT|OFFSET)\s+\d+", " ", sparql)
+        prepared = prepareQuery(unlimited, initNs=dict(g.namespaces()))
+        plan = planner.optimize(prepared, bindings)
+        assert plan.algebra is not prepared.algebra
+        original, rewritten = result_multiset(g, prepared, bindings), result_multiset(g, plan, bindings)
+        assert original, f"{name}: no results to compare"
+        assert original == rewritten, f"{name}: {sum(original.values())} rows as written, " \
+                                      f"{sum(rewritten.values())} rewritten"
+        if name.startswith("template"):
+            # Aggregates (DISTINCT in GROUP_CONCAT) can hide duplicated or lost solutions.
+            before = solution_multiset(g, prepared, pattern_root(prepared.algebra), bindings)
+            after = solution_multiset(g, plan, pattern_root(plan.algebra), bindings)
+            assert before == after, f"{name}: the rewritten pattern yields {sum(after.values())} " \
+                                    f"solutions instead of {sum(before.values())}"
+
+
+@check
+def check_inferred_entailments() -> None:
+    """With the ontology applied, actedInMovie is hasActor reversed and every actor and director is a Person."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        g = load_graph()
+    with tempfile.TemporaryDirectory() as tmp:
+        served = with_inferred(g, materialize(g, [resolve(f) for f in OWL_FILES], cache_dir=tmp))
+    acted = set(served.query(PREFIXES + "SELECT ?a ?m WHERE { ?a mc:actedInMovie ?m }"))
+    cast = set(served.query(PREFIXES + "SELECT ?a ?m WHERE { ?m mc:hasActor ?a }"))
+    assert cast and acted == cast, f"actedInMovie: {len(acted)} pairs, hasActor: {len(cast)}"
+    people = {row[0] for row in served.query(PREFIXES + "SELECT ?p WHERE { ?p a mc:Person }")}
+    crew = {row[0] for row in served.query(PREFIXES + """
+        SELECT ?p WHERE { { ?m mc:hasActor ?p } UNION { ?m mc:hasDirector ?p } }""")}
+    assert crew and not crew - people, f"{len(crew - people)} of {len(crew)} actors/directors aren't a mc:Person"
+
+
+def add_to_ontology(path: str, rdf_xml: str) -> None:
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text.replace("</rdf:RDF>", rdf_xml + "\n</rdf:RDF>"))
+
+
+@check
+def check_inferred_updates() -> None:
+    """Inserting an entailed triple is logged; the inference cache survives a restart but not an ontology edit."""
+    movie, actor = URIRef("urn:x:movie/1"), URIRef("urn:x:actor/1")
+    acted_in = (actor, URIRef(MC + "actedInMovie"), movie)
+    ask = sparql_url("{}", f"ASK {{ <{actor}> <{MC}actedInMovie> <{movie}> }}")
+    with tempfile.TemporaryDirectory() as tmp:
+        cast, ontology, wal = (os.path.join(tmp, name) for name in ("cast.owl", "ontology.owl", "updates.wal"))
+        g = Graph()
+        g.add((movie, RDF.type, URIRef(MC + "Movie")))
+        g.add((movie, URIRef(MC + "hasActor"), actor))
+        g.serialize(cast, format="xml")
+        shutil.copy(resolve("ontology.owl"), ontology)
+
+        with serving([cast, ontology], wal=wal, infer=True) as base:
+            assert not sparql_server.inference.from_cache, "a fresh cache directory had cached inferences"
+            status, _, body = fetch(ask.format(base))
+            assert status == 200 and json.loads(body)["boolean"], "actedInMovie isn't entailed"
+            status, _, body = fetch(f"{base}/update", f"INSERT DATA {{ <{actor}> <{MC}actedInMovie> <{movie}> }}"
+                                    .encode("utf-8"), {"Content-Type": "application/sparql-update"})
+            assert status == 200 and json.loads(body)["added"] == 1, f"/update answered {status}: {body[:200]!r}"
+        assert replayed(wal)[2] == {acted_in}, "the entailed triple wasn't written to the log"
+
+        with serving([cast, ontology], wal=wal, infer=True):
+            # The log changed since the first run; this run computes and caches again.
+            assert not sparql_server.inference.from_cache, "the update log's change didn't invalidate the cache"
+        with serving([cast, ontology], wal=wal, infer=True):
+            assert sparql_server.inference.from_cache, "unchanged sources didn't reuse the cached inferences"
+            assert acted_in in sparql_server.current_snapshot().graph
+
+        add_to_ontology(ontology, f'<rdf:Description rdf:about="{MC}Actor">'
+                                  f'<rdfs:subClassOf rdf:resource="urn:x:Performer"/></rdf:Description>')
+        with serving([cast, ontology], wal=wal, infer=True) as base:
+            assert not sparql_server.inference.from_cache, "editing the ontology didn't invalidate the cache"
+            status, _, body = fetch(sparql_url(base, "ASK { ?a a <urn:x:Performer> }"))
+            assert json.loads(body)["boolean"], "the edited ontology's entailment is missing"
+
+
+FACET_PREDICATES = {"country": "producedInCountry", "director": "hasDirector", "actor": "hasActor"}
+
+
+def facet_count_query(selection: Dict[str, str], group: Optional[str] = None) -> str:
+    """COUNT(DISTINCT ?m) of the movies matching one value per facet, per ``group`` value if given.
+
+    Facet values are computed as FacetIndex does: names without the DBpedia
+    prefix, and a movie's year is that of its earliest release date.
+    """
+    patterns = ["?m a mc:Movie ."]
+    for i, facet in enumerate(list(selection) + ([group] if group else [])):
+        if facet == "year":
+            patterns.append(f"{{ SELECT ?m (MIN(STR(?d)) AS ?first) WHERE {{ ?m mc:releaseDate ?d }} GROUP BY ?m }} "
+                            f"BIND(SUBSTR(?first, 1, 4) AS ?x{i})")
+        else:
+            patterns.append(f"?m mc:{FACET_PREDICATES[facet]} ?v{i} . "
+                            f"BIND(REPLACE(STR(?v{i}), \"^{DBPEDIA}\", \"\") AS ?x{i})")
+        if facet in selection:
+            patterns.append(f"FILTER(?x{i} = {json.dumps(selection[facet], ensure_ascii=False)})")
+    where = "WHERE {\n  " + "\n  ".join(patterns) + "\n}"
+    if group:
+        return PREFIXES + f"SELECT (?x{len(selection)} AS ?value) (COUNT(DISTINCT ?m) AS ?n) {where} GROUP BY ?x{len(selection)}"
+    return PREFIXES + f"SELECT (COUNT(DISTINCT ?m) AS ?n) {where}"
+
+
+@check
+def check_facet_counts() -> None:
+    """/facets totals and counts for a country+year and a director drill-down match COUNT(DISTINCT ?m) queries."""
+    with serving([resolve(f) for f in OWL_FILES]) as base:
+        def facets(**selection) -> dict:
+            status, _, body = fetch(f"{base}/facets?" + urllib.parse.urlencode(dict(selection, top=0, limit=0)))
+            assert status == 200, f"/facets answered {status}"
+            return json.loads(body)
+
+        def sparql_counts(selection: Dict[str, str], group: Optional[str] = None) -> Dict[str, int]:
+            status, _, body = fetch(sparql_url(base, facet_count_query(selection, group)))
+            assert status == 200, f"/sparql answered {status}: {body[:200]!r}"
+            return {row.get("value", {}).get("value"): int(row["n"]["value"])
+                    for row in json.loads(body)["results"]["bindings"]}
+
+        top = facets()["facets"]
+        # Few movies have a release date: take a year, then a country it has movies from.
+        for item in top["year"]["values"]:
+            countries = facets(year=item["value"])["facets"]["country"]["values"]
+            if countries:
+                year, country = item["value"], countries[0]["value"]
+                break
+        else:
+            raise AssertionError("no movie has both a release year and a country")
+        director = top["director"]["values"][0]["value"]
+        for selection, other in (({"country": country, "year": year}, "director"),
+                                 ({"director": director}, "country")):
+            body = facets(**selection)
+            assert body["total"] == sparql_counts(selection)[None] > 0, f"{selection}: total {body['total']}"
+            # Counts for a facet already selected ignore its own selection.
+            for facet in list(selection) + [other]:
+                within = {f: v for f, v in selection.items() if f != facet}
+                counts = {item["value"]: item["movies"] for item in body["facets"][facet]["values"]}
+                expected = sparql_counts(within, group=facet)
+                assert counts == expected, f"{selection}, {facet} counts: " + ", ".join(
+                    f"{v}: {counts.get(v)} vs SPARQL {expected.get(v)}"
+                    for v in sorted(set(counts) | set(expected)) if counts.get(v) != expected.get(v))
+
+
+COUNTRY_FACTS = ("capital", "population", "areaKm2", "description")
+
+
+@check
+def check_country_parity() -> None:
+    """/country gives the facts the "Find country" query joins via owl:sameAs, for every linked country."""
+    template = sparql_server.QUERY_TEMPLATES["country-facts"]["sparql"]
+    # Every movie (an empty keyword matches all titles), unpaged.
+    sparql = re.sub(r"LIMIT \d+\s*$", "", template.strip())
+    with serving([resolve(f) for f in OWL_FILES]) as base:
+        rows = sparql_server.current_snapshot().graph.query(sparql, initBindings={"keyword": Literal("")})
+        joined: Dict[str, set] = {}
+        for row in rows:
+            if row.capital is not None:
+                joined.setdefault(str(row.country), set()).add(tuple(row[fact].toPython() for fact in COUNTRY_FACTS))
+        status, _, body = fetch(f"{base}/country")
+        linked = [record for record in json.loads(body)["countries"] if record["sameAs"]]
+        assert linked, "no country has a sameAs link"
+        matched = set()
+        for record in linked:
+            facts = tuple(record[fact] for fact in COUNTRY_FACTS)
+            names = [alias.replace(DBPEDIA, "") for alias in record["sameAs"] if alias.startswith(DBPEDIA)]
+            for name in names:
+                status, _, body = fetch(f"{base}/country?" + urllib.parse.urlencode({"id": name}))
+                assert status == 200 and json.loads(body) == record, f"/country?id={name} isn't {record['country']}"
+                if name in joined:
+                    assert joined[name] == {facts}, f"{name}: the query joins {joined[name]}, /country has {facts}"
+                    matched.add(name)
+            # The query's OPTIONAL binds nothing unless the country has all four facts.
+            if record["movies"] and None not in facts:
+                assert matched.intersection(names), f"{record['country']}: the query joins no facts for it"
+        assert set(joined) <= matched, f"facts joined for countries /country doesn't link: {set(joined) - matched}"
+
+
+@check
+def check_reload_diff() -> None:
+    """POST /reload applies a changed source's diff; triples another source still asserts stay."""
+    with tempfile.TemporaryDirectory() as tmp:
+        movies, extra = os.path.join(tmp, "movies.owl"), os.path.join(tmp, "extra.owl")
+        write_movies(movies, range(0, 50))
+        write_movies(extra, range(40, 60))
+        with serving([movies, extra]) as base:
+            assert movie_ids(base) == list(range(0, 60))
+            status, _, body = fetch(base + "/reload", data=b"")
+            report = json.loads(body)
+            assert status == 200 and "graph_version" not in report, f"unchanged sources reloaded: {report}"
+
+            # Drops 0-9 (gone) and 45-49 (still in extra.owl), adds 60-69.
+            write_movies(movies, list(range(10, 45)) + list(range(60, 70)))
+            status, _, body = fetch(base + "/reload", data=b"")
+            assert status == 200, f"/reload answered {status}: {body[:200]!r}"
+            report = json.loads(body)
+            diff = report["files"][movies]
+            assert diff["changed"] and (diff["added"], diff["removed"]) == (20, 30), f"diff: {diff}"
+            assert not report["files"][extra]["changed"], "extra.owl reported as changed"
+            assert "graph_version" in report, "reload published no new graph"
+            assert movie_ids(base) == list(range(10, 70)), "served graph doesn't match the sources"
+            assert report["triples"] == 2 * 60
+
+
+WAL_TRIPLES = [
+    (URIRef("urn:x:a"), URIRef(MC + "title"), Literal("A", lang="en")),
+    (URIRef("urn:x:a"), URIRef(MC + "runtimeMinutes"), Literal(90, datatype=XSD.integer)),
+    (BNode("b1"), URIRef(MC + "title"), Literal("B")),
+    (URIRef("urn:x:c"), RDF.type, URIRef(MC + "Movie")),
+]
+
+
+def wal_batches(path: str, count: int) -> List[int]:
+    """Append ``count`` batches to a fresh log at ``path``; returns the file size after each."""
+    log = UpdateLog(path)
+    t = WAL_TRIPLES
+    batches = [(t[:2], []), ([t[2]], [t[0]]), ([t[3], t[0]], [t[1]])]
+    sizes = []
+    for added, removed in batches[:count]:
+        log.append(added, removed)
+        sizes.append(os.path.getsize(path))
+    return sizes
+
+
+def replayed(path: str):
+    g = Graph()
+    with contextlib.redirect_stdout(io.StringIO()):
+        log = UpdateLog(path)
+    return log, log.replay(g), set(g)
+
+
+@check
+def check_wal_replay() -> None:
+    """Logged batches replay in order, terms intact, and the sequence carries on after reopening."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "updates.wal")
+        wal_batches(path, 3)
+        log, counts, triples = replayed(path)
+        t = WAL_TRIPLES
+        assert counts == (3, 5, 2), f"replay counts {counts}"
+        assert triples == {t[0], t[2], t[3]}, f"replayed {triples}"
+        assert (log.seq, log.records) == (3, 3)
+        assert log.append([], [t[3]]) == 4
+        assert replayed(path)[2] == {t[0], t[2]}
+
+
+@check
+def check_wal_torn_tail() -> None:
+    """A torn or corrupt last record is truncated away on open; the batches before it survive."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "updates.wal")
+        sizes = wal_batches(path, 3)
+        expected = replayed(path)[2]
+        t = WAL_TRIPLES
+        for damage in ("truncate", "flip", "garbage"):
+            with open(path, "r+b") as f:
+                if damage == "truncate":
+                    f.truncate(sizes[-1] - 5)
+                elif damage == "flip":
+                    f.seek(sizes[-1] - 1)
+                    last = f.read(1)
+                    f.seek(sizes[-1] - 1)
+                    f.write(bytes([last[0] ^ 0xFF]))
+                else:
+                    f.seek(0, os.SEEK_END)
+                    f.write(b"UPD1\x00\x01")
+            log, counts, triples = replayed(path)
+            good = sizes[-2] if damage != "garbage" else sizes[-1]
+            assert os.path.getsize(path) == good, f"{damage}: tail not truncated"
+            assert counts[0] == log.records == len(sizes) - (damage != "garbage"), f"{damage}: {counts}"
+            if damage == "garbage":
+                assert triples == expected, "garbage tail changed the replay"
+                continue
+            # The dropped batch is gone; appending after the truncation works.
+            assert triples == {t[1], t[2]}, f"{damage}: replayed {triples}"
+            log.append([t[3], t[0]], [t[1]])
+            sizes[-1] = os.path.getsize(path)
+            assert replayed(path)[2] == expected, f"{damage}: re-appended batch didn't replay"
+
+
+@check
+def check_update_rollback() -> None:
+    """A failing update in a batch is undone on its own; the others apply and the base graph is untouched."""
+    base = Graph()
+    kept = (URIRef("urn:x:kept"), URIRef("urn:x:p"), Literal(0))
+    base.add(kept)
+    updates = [prepareUpdate(text) for text in (
+        "INSERT DATA { <urn:x:a> <urn:x:p> 1 }",
+        "INSERT DATA { <urn:x:b> <urn:x:p> 2 } ; DELETE DATA { <urn:x:kept> <urn:x:p> 0 } ; "
+        "LOAD <file:///nonexistent/update-rollback.owl>",
+        "DELETE DATA { <urn:x:a> <urn:x:p> 1 } ; INSERT DATA { <urn:x:c> <urn:x:p> 3 }",
+    )]
+    new, results, added, removed = apply_updates(base, updates)
+    assert [r.error is None for r in results] == [True, False, True], f"results {results}"
+    assert (results[1].added, results[1].removed) == (0, 0)
+    assert set(new) == {kept, (URIRef("urn:x:c"), URIRef("urn:x:p"), Literal(3))}, f"after the batch: {set(new)}"
+    # Net changes: <a> was added and removed again within the batch.
+    assert (len(added), len(removed)) == (1, 0), f"net +{len(added)} / -{len(removed)}"
+    assert set(base) == {kept}, "the base graph was modified"
+
+
+@check
+def check_cursor_paging() -> None:
+    """page_size pages through one evaluation; the same query reuses it; a bad token is 400, an expired one 410."""
+    with tempfile.TemporaryDirectory() as tmp:
+        movies = os.path.join(tmp, "movies.owl")
+        write_movies(movies, range(0, 45))
+        with serving([movies]) as base:
+            status, _, body = fetch(sparql_url(base, MOVIE_TITLES))
+            expected = json.loads(body)["results"]["bindings"]
+            pages, rows, url = [], [], sparql_url(base, MOVIE_TITLES, page_size=20)
+            while url:
+                status, headers, body = fetch(url)
+                assert status == 200, f"page {len(pages)} answered {status}"
+                page = json.loads(body)
+                pages.append(page["cursor"])
+                rows += page["results"]["bindings"]
+                token = page["cursor"]["next"]
+                url = f"{base}/sparql?" + urllib.parse.urlencode({"cursor": token}) if token else None
+            assert [c["offset"] for c in pages] == [0, 20, 40] and pages[0]["total"] == 45
+            assert rows == expected, "paged rows differ from the plain result"
+
+            status, _, body = fetch(sparql_url(base, MOVIE_TITLES, page_size=20))
+            assert json.loads(body)["cursor"]["id"] == pages[0]["id"], "re-running the query evaluated it again"
+
+            status, _, _ = fetch(f"{base}/sparql?cursor=not-a-token")
+            assert status == 400, f"malformed token answered {status}"
+            for page_size in (sparql_server.MAX_PAGE_SIZE + 1, 99999999):
+                token = f"{pages[0]['id']}-0-{page_size}"
+                status, _, _ = fetch(f"{base}/sparql?" + urllib.parse.urlencode({"cursor": token}))
+                assert status == 400, f"token with page size {page_size} answered {status}"
+            ttl, sparql_server.cursor_store.ttl = sparql_server.cursor_store.ttl, 0.05
+            try:
+                time.sleep(0.1)
+                status, _, _ = fetch(f"{base}/sparql?" + urllib.parse.urlencode({"cursor": pages[0]["next"]}))
+            finally:
+                sparql_server.cursor_store.ttl = ttl
+            assert status == 410, f"expired cursor answered {status}"
+
+
+@check
+def check_cursor_spill() -> None:
+    """Buffers over the memory budget spill to disk (least recently used first) and page back intact."""
+    rows = [json.dumps({"n": {"type": "literal", "value": str(i)}}).encode("utf-8") for i in range(500)]
+    with tempfile.TemporaryDirectory() as tmp:
+        store = CursorStore(ttl=60.0, memory_budget=48 << 10, spill_dir=tmp)
+        try:
+            # A single result bigger than the budget spills while it is filled.
+            big = store.create(["n"], rows * 4)
+            assert big.spilled and store.spills == 1
+            assert big.rows(1990, 20) == (rows * 4)[1990:2000]
+            first = store.create(["n"], rows, key="first")
+            second = store.create(["n"], rows[:250])
+            assert not first.spilled and not second.spilled
+            assert store.find("first") is first  # now the most recently used
+            third = store.create(["n"], rows[:250])
+            assert (first.spilled, second.spilled, third.spilled) == (False, True, False), \
+                "spilled the wrong buffer"
+            assert second.rows(0, 250) == rows[:250] and first.rows(490, 50) == rows[490:]
+            stats = store.stats()
+            assert stats["memory_bytes"] <= store.memory_budget, f"over budget: {stats}"
+            assert stats["spilled_bytes"] == big.nbytes + second.nbytes
+            store.ttl = 0.0
+            time.sleep(0.01)
+            assert store.get(first.id) is None and store.find("first") is None, "expired buffer still served"
+            assert store.stats()["cursors"] == 0
+        finally:
+            store.close()
+
+
+@check
+def check_compression_negotiation() -> None:
+    """Accept-Encoding picks gzip (or br) by q-value; streamed, cached and paged bodies decode to the identity body."""
+    best = compression.supported()[0]
+    for header, expected in [(None, None), ("", None), ("gzip", "gzip"), ("identity", None),
+                             ("gzip;q=0", None), ("*", best), ("*;q=0.5, gzip;q=0", "br" if best == "br" else None),
+                             ("deflate, gzip;q=0.2", "gzip"), ("GZIP; q=1.0", "gzip")]:
+        assert compression.negotiate(header) == expected, f"{header!r} -> {compression.negotiate(header)!r}"
+    with tempfile.TemporaryDirectory() as tmp:
+        movies = os.path.join(tmp, "movies.owl")
+        write_movies(movies, range(0, 45))
+        with serving([movies]) as base:
+            _, headers, plain = fetch(sparql_url(base, MOVIE_TITLES))
+            assert headers.get("Content-Encoding") is None, "compressed without Accept-Encoding"
+            for attempt in ("streamed", "cached"):
+                _, headers, body = fetch(sparql_url(base, MOVIE_TITLES), headers={"Accept-Encoding": "gzip"})
+                assert headers.get("Content-Encoding") == "gzip", f"{attempt}: not gzipped"
+                assert "Accept-Encoding" in headers.get("Vary", ""), f"{attempt}: no Vary"
+                assert gzip.decompress(body) == plain, f"{attempt}: body differs from the identity one"
+            _, headers, body = fetch(sparql_url(base, MOVIE_TITLES), headers={"Accept-Encoding": "gzip;q=0"})
+            assert headers.get("Content-Encoding") is None and body == plain, "gzip;q=0 was ignored"
+            url = sparql_url(base, MOVIE_TITLES, page_size=40)
+            _, _, page = fetch(url)
+            _, headers, body = fetch(url, headers={"Accept-Encoding": "gzip"})
+            assert headers.get("Content-Encoding") == "gzip" and gzip.decompress(body) == page, \
+                "cursor page not gzipped"
+
+
+def columnar_rows(g: Graph, sparql: str, batch_rows: int):
+    stats: dict = {}
+    body = b"".join(stream_columnar(evaluate(g, prepareQuery(sparql)), stats, batch_rows=batch_rows))
+    return read_columnar(body), stats["rows"]
+
+
+@check
+def check_columnar_round_trip() -> None:
+    """read_columnar decodes stream_columnar back to the same terms, unbound cells and batches included."""
+    g = Graph()
+    objects = [URIRef("urn:x:o"), BNode("b0"), Literal("plain"), Literal(""),
+               Literal("été", lang="fr"), Literal("chat", lang="en-GB"),
+               Literal(42, datatype=XSD.integer), Literal("2024-01-31", datatype=XSD.date),
+               Literal("x", datatype=URIRef("urn:x:type")), Literal("line\nbreak \u2603")]
+    for i, o in enumerate(objects):
+        g.add((URIRef(f"urn:x:s{i:02d}"), URIRef("urn:x:p"), o))
+        if i % 3 == 0:
+            g.add((URIRef(f"urn:x:s{i:02d}"), URIRef("urn:x:q"), o))  # repeated terms reuse their ids
+    sparql = "SELECT ?s ?o ?q WHERE { ?s <urn:x:p> ?o OPTIONAL { ?s <urn:x:q> ?q } } ORDER BY ?s"
+    expected = [list(row) for row in g.query(sparql)]
+    for batch_rows in (1, 3, 4096):
+        (names, rows), count = columnar_rows(g, sparql, batch_rows)
+        assert names == ["s", "o", "q"], f"variables {names}"
+        assert count == len(rows) == len(objects)
+        for got, want in zip(rows, expected):
+            assert got == want and [type(t) for t in got] == [type(t) for t in want], \
+                f"batch_rows={batch_rows}: {got} != {want}"
+            assert [getattr(t, "language", None) for t in got] == [getattr(t, "language", None) for t in want]
+            assert [getattr(t, "datatype", None) for t in got] == [getattr(t, "datatype", None) for t in want]
+    (names, rows), count = columnar_rows(g, "SELECT ?s WHERE { ?s <urn:x:none> ?o }", 3)
+    assert (names, rows, count) == (["s"], [], 0)
+    try:
+        read_columnar(b"SRC0")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("read_columnar accepted a bad magic")
+
+
+@check
+def check_format_negotiation() -> None:
+    """Accept (or format=) picks JSON, XML, CSV, TSV or columnar; nothing acceptable is 406."""
+    for header, expected in [(None, "json"), ("*/*", "json"), ("application/json", "json"),
+                             ("text/csv", "csv"), ("text/*", "csv"), ("text/tab-separated-values", "tsv"),
+                             ("application/sparql-results+xml;q=0.5, text/csv;q=0.9", "csv"),
+                             ("text/csv;q=0.1, */*;q=0.2", "json"), (COLUMNAR_TYPE, "columnar"),
+                             ("image/png", None), ("text/csv;q=0", None)]:
+        assert negotiate_format(header) == expected, f"{header!r} -> {negotiate_format(header)!r}"
+    with tempfile.TemporaryDirectory() as tmp:
+        movies = os.path.join(tmp, "movies.owl")
+        write_movies(movies, range(0, 12))
+        with serving([movies]) as base:
+            url = sparql_url(base, MOVIE_TITLES)
+            _, _, body = fetch(url)
+            expected = [[URIRef(b["m"]["value"]), Literal(b["t"]["value"])]
+                        for b in json.loads(body)["results"]["bindings"]]
+            for accept, content_type, head in [("text/csv", CSV_TYPE, b"m,t\r\n"),
+                                               ("text/tab-separated-values", TSV_TYPE, b"?m\t?t\n"),
+                                               ("application/sparql-results+xml", XML_TYPE, b"<?xml")]:
+                status, headers, body = fetch(url, headers={"Accept": accept})
+                assert status == 200 and headers.get("Content-Type") == content_type, \
+                    f"{accept}: {status} {headers.get('Content-Type')}"
+                assert body.startswith(head), f"{accept}: body starts {body[:40]!r}"
+            status, headers, body = fetch(url, headers={"Accept": COLUMNAR_TYPE})
+            assert headers.get("Content-Type") == COLUMNAR_TYPE
+            assert read_columnar(body) == (["m", "t"], expected), "columnar body differs from the JSON one"
+            status, headers, _ = fetch(sparql_url(base, MOVIE_TITLES, format="tsv"), headers={"Accept": "text/csv"})
+            assert headers.get("Content-Type") == TSV_TYPE, "format= didn't override Accept"
+            status, _, _ = fetch(url, headers={"Accept": "image/png"})
+            assert status == 406, f"unacceptable Accept answered {status}"
+            status, _, _ = fetch(sparql_url(base, MOVIE_TITLES, format="yaml"))
+            assert status == 400, f"unknown format= answered {status}"
+
+
+def run_checks(name_filter: str = "") -> int:
+    failed = 0
+    for fn in CHECKS:
+        if name_filter not in fn.__name__:
+            continue
+        start = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            failed += 1
+            print(f"  ✗ {fn.__name__}: {type(e).__name__}: {e}")
+        else:
+            print(f"  ✓ {fn.__name__} ({(time.perf_counter() - start) * 1000.0:.0f} ms)")
+    print(f"Checks: {failed} failed" if failed else "Checks: all passed")
+    return 1 if failed else 0
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Run the query suite, or benchmark it with --bench.")
+    ap.add_argument("--bench", action="store_true", help="time each query instead of printing results")
+    ap.add_argument("--checks", action="store_true", help="only run the pass/fail checks")
+    ap.add_argument("--warmup", type=int, default=2, help="untimed runs per query (default 2)")
+    ap.add_argument("--iterations", type=int, default=10, help="timed runs per query (default 10)")
+    ap.add_argument("--scale", type=int, default=1,
+                    help="replicate the movie data N times with renamed IRIs (e.g. 10, 100)")
+    ap.add_argument("--store", choices=["default", "Compact"], default="default",
+                    help="rdflib store plugin to load the graph into (default: Memory)")
+    ap.add_argument("--filter", "-k", default="", help="only queries (or checks) whose name contains this text")
+    ap.add_argument("--json", default="", help="write the benchmark report here ('-' for stdout)")
+    ap.add_argument("--baseline", default="",
+                    help="compare against this report (written there if it does not exist yet)")
+    ap.add_argument("--threshold", type=float, default=0.25,
+                    help="allowed p50 slowdown vs the baseline, as a fraction (default 0.25)")
+    ap.add_argument("--min-delta-ms", type=float, default=2.0,
+                    help="ignore p50 differences smaller than this (default 2 ms)")
+    args = ap.parse_args(argv)
+    if args.iterations < 1:
+        ap.error("--iterations must be at least 1")
+    return args
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.bench:
+        return run_benchmark(args)
+    if args.checks:
+        return run_checks(args.filter)
+
+    g = load_graph(args.store)
+    if args.scale > 1:
+        print(f"Scaled movie data {args.scale}x: +{scale_graph(g, args.scale)} triples")
 
     suite = query_suite()
     for i, tq in enumerate(suite, 1):
@@ -322,7 +1401,8 @@ def main() -> int:
 
     print("=" * 80)
     print(f"Done. Ran {len(suite)} queries.")
-    return 0
+    print("=" * 80)
+    return run_checks()
 
 
 if __name__ == "__main__":
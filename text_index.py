@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import threading
+import time
+import weakref
+from collections import OrderedDict, defaultdict
+from typing import Dict, FrozenSet, List, Sequence, Set
+
+from rdflib import Graph, Literal, Namespace, URIRef, Variable
+from rdflib.plugins.sparql import CUSTOM_EVALS
+from rdflib.plugins.sparql.evaluate import evalBGP
+from rdflib.plugins.sparql.operators import register_custom_function
+from rdflib.plugins.sparql.sparql import SPARQLError
+
+
+# In-process keyword index over the movie graph.
+#
+# Every object of an indexed predicate (titles, actors, directors, countries)
+# is reduced to lower-case text -- the lexical form of a literal, the local
+# name of an IRI -- and its character trigrams go into an inverted index.
+# A keyword probe intersects the posting lists of its trigrams and verifies
+# the survivors with a plain substring test, so it touches a handful of
+# distinct terms instead of every row of a FILTER(CONTAINS(...)) scan.
+#
+# Exposed to SPARQL in two ways:
+#
+#   ?movie mc:textMatch "jackie_chan" .                 magic predicate
+#   FILTER(mc:textContains(?actor, "jackie_chan"))      indexed CONTAINS
+
+MC = Namespace("http://www.semanticweb.org/lenovo/ontologies/2025/11/untitled-ontology-5#")
+
+TEXT_MATCH = MC.textMatch
+TEXT_CONTAINS = MC.textContains
+
+DEFAULT_PREDICATES = (MC.title, MC.hasActor, MC.hasDirector, MC.producedInCountry)
+
+NGRAM = 3
+
+
+def term_text(term) -> str:
+    if isinstance(term, URIRef):
+        value = str(term)
+        cut = max(value.rfind("/"), value.rfind("#"))
+        return value[cut + 1:].lower()
+    return str(term).lower()
+
+
+def _ngrams(text: str) -> Set[str]:
+    return {text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+
+class TextIndex:
+    """Trigram index from object text to the terms and subjects that carry it."""
+
+    def __init__(self, predicates: Sequence[URIRef] = DEFAULT_PREDICATES,
+                 cache_size: int = 1024) -> None:
+        self.predicates = tuple(predicates)
+        self.terms: List[object] = []
+        self.term_ids: Dict[object, int] = {}
+        self.texts: List[str] = []
+        self.subjects: List[List[object]] = []
+        self.postings: Dict[str, List[int]] = {}
+        self.build_seconds = 0.0
+        self._cache: "OrderedDict[str, FrozenSet[int]]" = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, graph: Graph, predicates: Sequence[URIRef] = DEFAULT_PREDICATES) -> "TextIndex":
+        start = time.perf_counter()
+        index = cls(predicates)
+        ids = index.term_ids
+        postings = defaultdict(list)
+        for predicate in index.predicates:
+            for s, o in graph.subject_objects(predicate):
+                tid = ids.get(o)
+                if tid is None:
+                    tid = ids[o] = len(index.terms)
+                    text = term_text(o)
+                    index.terms.append(o)
+                    index.texts.append(text)
+                    index.subjects.append([])
+                    for gram in _ngrams(text):
+                        postings[gram].append(tid)
+                index.subjects[tid].append(s)
+        index.postings = dict(postings)
+        index.build_seconds = time.perf_counter() - start
+        return index
+
+    def _probe(self, keyword: str) -> FrozenSet[int]:
+        keyword = keyword.lower()
+        with self._lock:
+            hit = self._cache.get(keyword)
+            if hit is not None:
+                self._cache.move_to_end(keyword)
+                return hit
+
+        texts = self.texts
+        if len(keyword) >= NGRAM:
+            lists = sorted((self.postings.get(g, ()) for g in _ngrams(keyword)), key=len)
+            candidates = set(lists[0])
+            for other in lists[1:]:
+                if not candidates:
+                    break
+                candidates.intersection_update(other)
+        else:
+            candidates = range(len(texts))
+        found = frozenset(tid for tid in candidates if keyword in texts[tid])
+
+        with self._lock:
+            self._cache[keyword] = found
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return found
+
+    def matching_terms(self, keyword: str) -> Set[object]:
+        return {self.terms[tid] for tid in self._probe(keyword)}
+
+    def matching_subjects(self, keyword: str) -> Set[object]:
+        found: Set[object] = set()
+        for tid in self._probe(keyword):
+            found.update(self.subjects[tid])
+        return found
+
+    def contains(self, term, keyword: str) -> bool:
+        """CONTAINS(LCASE(text(term)), keyword), answered from the index when possible."""
+        keyword = keyword.lower()
+        tids = self._probe(keyword)
+        # Terms outside the indexed predicates still get an exact answer.
+        tid = self.term_ids.get(term)
+        if tid is not None:
+            return tid in tids
+        return keyword in term_text(term)
+
+    def stats(self) -> dict:
+        return {
+            "predicates": [str(p) for p in self.predicates],
+            "terms": len(self.terms),
+            "ngrams": len(self.postings),
+            "build_ms": round(self.build_seconds * 1000.0, 1),
+        }
+
+
+_indexes: "weakref.WeakKeyDictionary[Graph, TextIndex]" = weakref.WeakKeyDictionary()
+_indexes_lock = threading.Lock()
+
+
+def register_index(graph: Graph, index: TextIndex) -> None:
+    with _indexes_lock:
+        _indexes[graph] = index
+
+
+def index_for(graph: Graph) -> TextIndex:
+    """The index registered for ``graph``, built on first use if there is none."""
+    with _indexes_lock:
+        index = _indexes.get(graph)
+        if index is None:
+            index = _indexes[graph] = TextIndex.build(graph)
+        return index
+
+
+def _bound(ctx, node):
+    return ctx[node] if isinstance(node, Variable) else node
+
+
+def _solve(ctx, index: TextIndex, magic, rest):
+    if not magic:
+        # Same heuristic as rdflib's own BGP evaluation: most-bound patterns first.
+        ordered = sorted(rest, key=lambda t: len([n for n in t if ctx[n] is None]))
+        yield from evalBGP(ctx, ordered)
+        return
+
+    (s, _, keyword), remaining = magic[0], magic[1:]
+    keyword = _bound(ctx, keyword)
+    if not isinstance(keyword, Literal):
+        raise SPARQLError("mc:textMatch needs a literal keyword")
+    bound_subject = _bound(ctx, s)
+    subjects = index.matching_subjects(str(keyword))
+    if bound_subject is not None:
+        if bound_subject in subjects:
+            yield from _solve(ctx, index, remaining, rest)
+        return
+    for subject in subjects:
+        c = ctx.push()
+        c[s] = subject
+        yield from _solve(c, index, remaining, rest)
+
+
+def _eval_text_match(ctx, part):
+    if part.name != "BGP":
+        raise NotImplementedError()
+    magic = [t for t in part.triples if t[1] == TEXT_MATCH]
+    if not magic:
+        raise NotImplementedError()
+    rest = [t for t in part.triples if t[1] != TEXT_MATCH]
+    return _solve(ctx, index_for(ctx.graph), magic, rest)
+
+
+def _text_contains(e, ctx):
+    args = e.expr
+    if len(args) != 2:
+        raise SPARQLError("mc:textContains takes (term, keyword)")
+    term, keyword = args
+    if term is None or not isinstance(keyword, Literal):
+        raise SPARQLError("mc:textContains needs a bound term and a literal keyword")
+    return Literal(index_for(ctx.ctx.graph).contains(term, str(keyword)))
+
+
+def install() -> None:
+    """Hook mc:textMatch and mc:textContains into rdflib's SPARQL engine (idempotent)."""
+    CUSTOM_EVALS["text_index"] = _eval_text_match
+    register_custom_function(TEXT_CONTAINS, _text_contains, override=True, raw=True)
+
+
+install()
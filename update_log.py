@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import marshal
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from array import array
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+from rdflib import Graph
+from rdflib.plugins.sparql.sparql import Update
+from rdflib.plugins.sparql.update import evalUpdate
+from rdflib.store import Store
+
+from graph_reload import copy_graph
+from graph_snapshot import _decode_term, _encode_term
+
+
+# SPARQL 1.1 Update support: copy-on-write batches and a write-ahead log.
+#
+# Updates never touch the served graph. A batch of them is applied, in
+# arrival order, to a copy of it whose store is wrapped in a RecordingStore;
+# the net triple changes of the batch are appended to the WAL (and fsynced)
+# and only then is the copy published. Readers keep using whichever graph
+# they pinned and are never blocked.
+#
+# The WAL holds triple changes rather than update text, so replaying it at
+# startup doesn't depend on re-evaluating WHERE clauses. Each record is
+#
+#   magic "UPD1" | payload length u32 | crc32 u32 | payload
+#
+# with payload = marshal((seq, unix time, term rows, added ids, removed ids)),
+# the ids being uint32 triples into the record's own term table. A torn or
+# corrupt tail (crash mid-append) is dropped when the log is opened.
+
+WAL_MAGIC = b"UPD1"
+WAL_VERSION = 1
+_RECORD = struct.Struct("<4sII")
+
+Triple = Tuple[object, object, object]
+
+
+class RecordingStore(Store):
+    """Store proxy that applies changes to ``inner`` and journals the effective ones.
+
+    rdflib's update evaluator insists on a plain ``Graph`` (not a subclass), so
+    changes are captured at the store level. Only triples that really appear
+    or disappear are journalled, which makes ``rollback`` exact. With an
+    ``inference.InferredStore`` inner store, that is judged on the asserted
+    triples alone: inserting a merely inferred triple asserts it.
+    """
+
+    def __init__(self, inner: Store) -> None:
+        super().__init__()
+        self.inner = inner
+        self.asserted = getattr(inner, "asserted", inner)
+        self.context_aware = inner.context_aware
+        self.graph_aware = inner.graph_aware
+        self.journal: List[Tuple[bool, Triple, object]] = []
+
+    def _present(self, triple: Triple, context) -> bool:
+        for _ in self.asserted.triples(triple, context):
+            return True
+        return False
+
+    def add(self, triple, context=None, quoted: bool = False) -> None:
+        if not self._present(triple, context):
+            self.inner.add(triple, context, quoted)
+            self.journal.append((True, triple, context))
+
+    def addN(self, quads) -> None:
+        for s, p, o, c in quads:
+            self.add((s, p, o), c)
+
+    def remove(self, triple_pattern, context=None) -> None:
+        for triple, _ in list(self.asserted.triples(triple_pattern, context)):
+            self.inner.remove(triple, context)
+            self.journal.append((False, triple, context))
+
+    def triples(self, triple_pattern, context=None):
+        return self.inner.triples(triple_pattern, context)
+
+    def __len__(self, context=None) -> int:
+        return self.inner.__len__(context)
+
+    def contexts(self, triple=None):
+        return self.inner.contexts(triple)
+
+    def bind(self, prefix, namespace, override: bool = True) -> None:
+        self.inner.bind(prefix, namespace, override=override)
+
+    def namespace(self, prefix):
+        return self.inner.namespace(prefix)
+
+    def prefix(self, namespace):
+        return self.inner.prefix(namespace)
+
+    def namespaces(self):
+        return self.inner.namespaces()
+
+    def mark(self) -> int:
+        return len(self.journal)
+
+    def rollback(self, mark: int) -> None:
+        """Undo every change journalled after ``mark``."""
+        while len(self.journal) > mark:
+            added, triple, context = self.journal.pop()
+            if added:
+                self.inner.remove(triple, context)
+            else:
+                self.inner.add(triple, context)
+
+    def net_changes(self, mark: int = 0) -> Tuple[List[Triple], List[Triple]]:
+        """(added, removed) since ``mark``, with add/remove pairs cancelled out."""
+        state = {}
+        for added, triple, _ in self.journal[mark:]:
+            previous = state.get(triple)
+            if previous is None:
+                state[triple] = added
+            elif previous != added:
+                del state[triple]  # added then removed (or the reverse): no net change
+        return ([t for t, a in state.items() if a], [t for t, a in state.items() if not a])
+
+
+@dataclass
+class UpdateResult:
+    added: int
+    removed: int
+    error: Optional[str] = None
+
+
+def apply_updates(graph: Graph, updates: Sequence[Update]):
+    """Apply ``updates`` in order to a copy of ``graph``.
+
+    Returns (new graph, per-update results, net added, net removed). An update
+    that raises is rolled back on its own (SPARQL 1.1 requires a failed request
+    to have no effect) and the rest of the batch still applies.
+    """
+    work = copy_graph(graph)
+    recorder = RecordingStore(work.store)
+    view = Graph(store=recorder, identifier=work.identifier)
+    results = []
+    for update in updates:
+        mark = recorder.mark()
+        try:
+            evalUpdate(view, update)
+        except Exception as e:
+            recorder.rollback(mark)
+            results.append(UpdateResult(0, 0, f"{type(e).__name__}: {e}"))
+            continue
+        added, removed = recorder.net_changes(mark)
+        results.append(UpdateResult(len(added), len(removed)))
+    added, removed = recorder.net_changes()
+    return work, results, added, removed
+
+
+def _encode_changes(added: Sequence[Triple], removed: Sequence[Triple]):
+    ids = {}
+    rows = []
+
+    def intern(term) -> int:
+        tid = ids.get(term)
+        if tid is None:
+            tid = ids[term] = len(rows)
+            rows.append(_encode_term(term))
+        return tid
+
+    columns = []
+    for triples in (added, removed):
+        col = array("I")
+        for s, p, o in triples:
+            col.append(intern(s))
+            col.append(intern(p))
+            col.append(intern(o))
+        columns.append(col.tobytes())
+    return rows, columns[0], columns[1]
+
+
+def _decode_changes(rows, added_ids: bytes, removed_ids: bytes):
+    terms = [_decode_term(row) for row in rows]
+
+    def triples(blob: bytes) -> List[Triple]:
+        col = array("I")
+        col.frombytes(blob)
+        return [(terms[col[i]], terms[col[i + 1]], terms[col[i + 2]]) for i in range(0, len(col), 3)]
+
+    return triples(added_ids), triples(removed_ids)
+
+
+class UpdateLog:
+    """Append-only, fsynced log of update batches (net triple changes)."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.seq = 0
+        self.records = 0
+        self._lock = threading.Lock()
+        # Scan once: find the next sequence number and drop a torn tail.
+        good = 0
+        for seq, _, _, _, end in self._scan():
+            self.seq = seq
+            self.records += 1
+            good = end
+        if os.path.exists(path) and os.path.getsize(path) != good:
+            print(f"  (dropping {os.path.getsize(path) - good} bytes of incomplete update log tail)")
+            with open(path, "r+b") as f:
+                f.truncate(good)
+
+    def _scan(self) -> Iterator[tuple]:
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            offset = 0
+            while True:
+                header = f.read(_RECORD.size)
+                if len(header) < _RECORD.size:
+                    return
+                magic, length, crc = _RECORD.unpack(header)
+                payload = f.read(length)
+                if magic != WAL_MAGIC or len(payload) < length or zlib.crc32(payload) != crc:
+                    return
+                try:
+                    version, seq, stamp, rows, added_ids, removed_ids = marshal.loads(payload)
+                except (EOFError, ValueError, TypeError):
+                    return
+                if version != WAL_VERSION:
+                    return
+                offset += _RECORD.size + length
+                yield seq, stamp, rows, (added_ids, removed_ids), offset
+
+    def append(self, added: Sequence[Triple], removed: Sequence[Triple]) -> int:
+        """Durably append one batch; returns its sequence number."""
+        with self._lock:
+            rows, added_ids, removed_ids = _encode_changes(added, removed)
+            seq = self.seq + 1
+            payload = marshal.dumps((WAL_VERSION, seq, time.time(), rows, added_ids, removed_ids))
+            with open(self.path, "ab") as f:
+                f.write(_RECORD.pack(WAL_MAGIC, len(payload), zlib.crc32(payload)) + payload)
+                f.flush()
+                os.fsync(f.fileno())
+            self.seq = seq
+            self.records += 1
+            return seq
+
+    def replay(self, graph: Graph) -> Tuple[int, int, int]:
+        """Apply every logged batch to ``graph`` in order; returns (batches, added, removed)."""
+        batches = n_added = n_removed = 0
+        for _, _, rows, (added_ids, removed_ids), _ in self._scan():
+            added, removed = _decode_changes(rows, added_ids, removed_ids)
+            for triple in removed:
+                graph.remove(triple)
+            graph.store.addN((s, p, o, graph) for s, p, o in added)
+            batches += 1
+            n_added += len(added)
+            n_removed += len(removed)
+        return batches, n_added, n_removed
+
+    def stats(self) -> dict:
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        return {"path": self.path, "records": self.records, "bytes": size, "seq": self.seq}
+
+
+class UpdateBatcher:
+    """Coalesces concurrent update requests into batches run by one writer thread.
+
+    ``apply_batch(items)`` receives the queued items in arrival order and must
+    return one result per item; ``submit`` blocks until its batch is done.
+    A batch closes after ``max_batch`` items or once ``linger`` seconds have
+    passed since its first item arrived.
+    """
+
+    def __init__(self, apply_batch: Callable[[list], list], max_batch: int = 64,
+                 linger: float = 0.005) -> None:
+        self.apply_batch = apply_batch
+        self.max_batch = max_batch
+        self.linger = linger
+        self.batches = 0
+        self.items = 0
+        self._queue: "queue.Queue[Tuple[object, Future]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="update-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, item, timeout: Optional[float] = None):
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future.result(timeout)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0
+                                 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                results = self.apply_batch([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "updates": self.items, "queued": self._queue.qsize(),
+                "max_batch": self.max_batch, "linger_ms": self.linger * 1000.0}